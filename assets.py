@@ -0,0 +1,261 @@
+"""Сжатые варианты портретов и их упаковка в один файл.
+
+Исходники в ``icon/character`` — PNG 256×256 с прозрачностью по ~120 КБ;
+для фото с подписью этого слишком много. Сборка:
+
+* каждый портрет уменьшается до ``max_side`` (без увеличения), прозрачность
+  заливается фоном, и он пережимается в JPEG/WebP. Вариант сохраняется в
+  ``<cache>/variants/<sha1 исходника>-<параметры>.<ext>``, поэтому при
+  повторной сборке перекодируются только изменившиеся файлы;
+* все варианты складываются в один pack-файл: ``MAGIC``, длина заголовка
+  (4 байта, little-endian), JSON-заголовок и данные подряд. Файл заменяется
+  атомарно, так что процесс со старым mmap дочитывает старую версию.
+
+Во время работы ``PortraitPack`` держит pack-файл в mmap и отдаёт варианты
+как ``BufferedInputFile`` — без open/read на каждую отправку.
+
+Собрать заранее (нужен Pillow)::
+
+    python assets.py [--max-side 512] [--format jpeg|webp] [--quality 85]
+"""
+import os
+import io
+import json
+import mmap
+import struct
+import hashlib
+import logging
+import argparse
+from typing import NamedTuple
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow нужен только для сборки
+    Image = None
+
+MAGIC = b"PPK1"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+PACK_NAME = "portraits.pack"
+
+
+class VariantSettings(NamedTuple):
+    max_side: int = 512
+    format: str = "jpeg"
+    quality: int = 85
+    background: tuple = (24, 24, 27)
+
+    @property
+    def extension(self) -> str:
+        return "jpg" if self.format == "jpeg" else self.format
+
+    @property
+    def tag(self) -> str:
+        """Параметры в имени варианта: другие настройки — другой файл."""
+        return f"{self.max_side}-{self.format}-q{self.quality}-" + "".join(f"{c:02x}" for c in self.background)
+
+
+DEFAULT_SETTINGS = VariantSettings()
+
+
+class PackEntry(NamedTuple):
+    offset: int
+    length: int
+    hash: str          # sha1 варианта — им же проверяются file_id в PortraitRegistry
+    source_hash: str
+    filename: str
+
+
+def source_files(directory: str) -> list[str]:
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, n) for n in names if n.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def encode_variant(data: bytes, settings: VariantSettings) -> bytes:
+    if Image is None:
+        raise RuntimeError("Для сборки вариантов портретов нужен Pillow (pip install Pillow)")
+    with Image.open(io.BytesIO(data)) as im:
+        im.load()
+        if max(im.size) > settings.max_side:
+            im.thumbnail((settings.max_side, settings.max_side), Image.LANCZOS)
+        if im.mode in ("RGBA", "LA", "P"):
+            im = im.convert("RGBA")
+            canvas = Image.new("RGB", im.size, settings.background)
+            canvas.paste(im, mask=im.getchannel("A"))
+            im = canvas
+        elif im.mode != "RGB":
+            im = im.convert("RGB")
+        out = io.BytesIO()
+        if settings.format == "webp":
+            im.save(out, "WEBP", quality=settings.quality, method=6)
+        else:
+            im.save(out, "JPEG", quality=settings.quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+def read_header(pack_path: str) -> dict | None:
+    try:
+        with open(pack_path, "rb") as f:
+            head = f.read(len(MAGIC) + 4)
+            if len(head) < len(MAGIC) + 4 or head[:len(MAGIC)] != MAGIC:
+                return None
+            (size,) = struct.unpack("<I", head[len(MAGIC):])
+            return json.loads(f.read(size))
+    except (OSError, ValueError):
+        return None
+
+
+def _sources_with_hashes(sources) -> dict:
+    result = {}
+    for path in sources:
+        with open(path, "rb") as f:
+            data = f.read()
+        result[os.path.normpath(path)] = (hashlib.sha1(data).hexdigest(), data)
+    return result
+
+
+def is_current(pack_path: str, sources) -> bool:
+    """Pack-файл собран ровно из этих исходников (настройки не важны)."""
+    header = read_header(pack_path)
+    if header is None:
+        return False
+    entries = header.get("entries", {})
+    hashed = _sources_with_hashes(sources)
+    return entries.keys() == hashed.keys() and all(
+        entries[key]["source_hash"] == digest for key, (digest, _) in hashed.items())
+
+
+def build_pack(sources, cache_dir: str, pack_path: str, settings: VariantSettings = DEFAULT_SETTINGS) -> dict:
+    """Собирает варианты и pack-файл. Возвращает сводку для лога."""
+    variants_dir = os.path.join(cache_dir, "variants")
+    os.makedirs(variants_dir, exist_ok=True)
+    entries, blobs, used = {}, [], set()
+    encoded = source_bytes = 0
+    offset = 0
+    for key, (source_hash, data) in _sources_with_hashes(sources).items():
+        name = f"{source_hash}-{settings.tag}.{settings.extension}"
+        variant_path = os.path.join(variants_dir, name)
+        try:
+            with open(variant_path, "rb") as f:
+                variant = f.read()
+        except FileNotFoundError:
+            variant = encode_variant(data, settings)
+            tmp = f"{variant_path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(variant)
+            os.replace(tmp, variant_path)
+            encoded += 1
+        used.add(name)
+        source_bytes += len(data)
+        filename = f"{os.path.splitext(os.path.basename(key))[0]}.{settings.extension}"
+        entries[key] = PackEntry(offset, len(variant), hashlib.sha1(variant).hexdigest(), source_hash, filename)._asdict()
+        blobs.append(variant)
+        offset += len(variant)
+
+    header = json.dumps({"settings": settings._asdict(), "entries": entries}, ensure_ascii=False).encode()
+    tmp = f"{pack_path}.tmp"
+    os.makedirs(os.path.dirname(pack_path) or ".", exist_ok=True)
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, pack_path)
+
+    # Варианты, на которые больше ничего не ссылается (старые исходники/настройки)
+    for name in os.listdir(variants_dir):
+        if name not in used:
+            try:
+                os.remove(os.path.join(variants_dir, name))
+            except OSError:
+                pass
+    return {"files": len(entries), "encoded": encoded, "source_bytes": source_bytes, "pack_bytes": offset}
+
+
+def ensure_pack(sources, cache_dir: str, settings: VariantSettings | None = None) -> dict | None:
+    """Пересобирает pack, если исходники изменились. None — пересборка не понадобилась.
+
+    Без явных ``settings`` берутся настройки текущего pack-файла (например,
+    собранного вручную с ``--format webp``), а если его нет — DEFAULT_SETTINGS.
+    """
+    pack_path = os.path.join(cache_dir, PACK_NAME)
+    if settings is None:
+        if is_current(pack_path, sources):
+            return None
+        header = read_header(pack_path)
+        settings = DEFAULT_SETTINGS
+        if header and header.get("settings"):
+            saved = header["settings"]
+            settings = VariantSettings(**{**saved, "background": tuple(saved.get("background", settings.background))})
+    return build_pack(sources, cache_dir, pack_path, settings)
+
+
+class PortraitPack:
+    """Варианты портретов из pack-файла через mmap (только чтение)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._map = None
+        self._entries = {}
+
+    def load(self) -> bool:
+        """(Пере)открывает pack-файл. False — файла нет или он повреждён."""
+        header = read_header(self.path)
+        if header is None:
+            return False
+        with open(self.path, "rb") as f:
+            new_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        base = len(MAGIC) + 4 + struct.unpack("<I", new_map[len(MAGIC):len(MAGIC) + 4])[0]
+        entries = {key: PackEntry(**entry)._replace(offset=base + entry["offset"])
+                   for key, entry in header.get("entries", {}).items()}
+        old, self._map, self._entries = self._map, new_map, entries
+        if old is not None:
+            old.close()
+        return True
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._map, self._entries = None, {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path: str) -> bool:
+        return os.path.normpath(path) in self._entries
+
+    def get(self, path: str) -> PackEntry | None:
+        return self._entries.get(os.path.normpath(path))
+
+    def read(self, entry: PackEntry) -> bytes:
+        return self._map[entry.offset:entry.offset + entry.length]
+
+    def input_file(self, path: str):
+        """BufferedInputFile с вариантом портрета или None, если его нет в pack-файле."""
+        from aiogram.types import BufferedInputFile
+
+        entry = self.get(path)
+        if entry is None:
+            return None
+        return BufferedInputFile(self.read(entry), filename=entry.filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка сжатых вариантов портретов")
+    parser.add_argument("--source", default="icon/character", help="папка с исходными портретами")
+    parser.add_argument("--out", default=os.path.join(os.getenv("DATA_DIR", "data"), "portraits"))
+    parser.add_argument("--max-side", type=int, default=DEFAULT_SETTINGS.max_side)
+    parser.add_argument("--format", choices=("jpeg", "webp"), default=DEFAULT_SETTINGS.format)
+    parser.add_argument("--quality", type=int, default=DEFAULT_SETTINGS.quality)
+    args = parser.parse_args()
+
+    settings = VariantSettings(args.max_side, args.format, args.quality)
+    stats = build_pack(source_files(args.source), args.out, os.path.join(args.out, PACK_NAME), settings)
+    print(f"Портретов: {stats['files']}, перекодировано: {stats['encoded']}, "
+          f"{stats['source_bytes'] / 1024:.0f} КБ -> {stats['pack_bytes'] / 1024:.0f} КБ")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,96 @@
+"""Автоподбор билда: buildgen.BuildEngine против прежнего generate_build_for_character.
+
+Прежний подбор склеивал и просматривал подстрокой ``desc`` каждого комплекта
+реликвий дважды на вызов. Движок строит обратные индексы по описаниям один
+раз на снимок справочника. Печатаются время построения индексов, среднее
+время на персонажа в обоих вариантах, проход по всем персонажам
+(``generate_missing``) и для пары персонажей — что выбрал каждый вариант.
+aiogram для замера не нужен.
+
+    python benchmarks/bench_buildgen.py [--rounds 20]
+"""
+import sys
+import time
+import argparse
+
+from fixtures import ROOT, make_game_data
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from gamedata import GameData, get_index  # noqa: E402
+from buildgen import BuildEngine, format_generated_build, generate_missing  # noqa: E402
+
+
+def legacy_generate(character, game_data):
+    """Прежний generate_build_for_character (выбор без форматирования)."""
+    index = get_index(game_data)
+    path_id = character.get("path")
+    element_id = character.get("element")
+    path = index.path_names.get(path_id, path_id)
+    element = index.element_names.get(element_id, element_id)
+    relic_sets = []
+    for relic in game_data["relic_sets"].values():
+        desc = " ".join(relic.get("desc", []))
+        if element in desc or path in desc or "урон" in desc or "лечение" in desc or "защита" in desc:
+            relic_sets.append(relic["id"])
+    relic_sets = relic_sets[:2] if relic_sets else [list(game_data["relic_sets"].keys())[0]]
+    planar_sets = []
+    for relic in game_data["relic_sets"].values():
+        if relic.get("type") == "Planar":
+            desc = " ".join(relic.get("desc", []))
+            if element in desc or path in desc or "урон" in desc or "лечение" in desc or "защита" in desc:
+                planar_sets.append(relic["id"])
+    planar_sets = planar_sets[:2]
+    cones = []
+    for rarity in (5, 4, 3):
+        cones += index.cones_by_path_rarity.get((path_id, rarity), [])[:1]
+    return relic_sets, planar_sets, [index.cones.get(c, (c, ""))[0] for c in cones]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    # Как в боте: справочник с прикреплённым индексом (GameDataIndex общий для обоих вариантов)
+    game_data = GameData(make_game_data())
+    characters = list(game_data.index.characters_by_id.values())
+
+    start = time.perf_counter()
+    engine = BuildEngine(game_data)
+    print(f"Персонажей: {len(characters)}, комплектов: {len(game_data['relic_sets'])}, "
+          f"конусов: {len(game_data['light_cones'])}")
+    print(f"Индексы описаний: {(time.perf_counter() - start) * 1000:.2f} мс")
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for c in characters:
+            legacy_generate(c, game_data)
+    legacy_ms = (time.perf_counter() - start) * 1000 / (args.rounds * len(characters))
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for c in characters:
+            engine.generate(c)
+    engine_ms = (time.perf_counter() - start) * 1000 / (args.rounds * len(characters))
+    print(f"На персонажа: прежний {legacy_ms:.3f} мс, движок {engine_ms:.3f} мс ({legacy_ms / engine_ms:.1f}×)")
+
+    builds, report = generate_missing(game_data, lambda c: False)
+    print(f"Проход по всем: {report.generated} билдов, индексы {report.index_ms:.2f} мс, "
+          f"подбор {report.generate_ms:.2f} мс")
+
+    for c in characters[:2]:
+        relics, planars, cones = legacy_generate(c, game_data)
+        build = engine.generate(c)
+        print(f"\n{c['name']} ({c['path']}, {c['element']})")
+        print(f"  прежний: реликвии {relics}, украшения {planars}, конусы {cones}")
+        print(f"  движок:  реликвии {[(r.id, r.score) for r in build.relic_sets]}, "
+              f"украшения {[(p.id, p.score) for p in build.planar_sets]}, "
+              f"конусы {[(k.name, k.rarity, k.score) for k in build.light_cones]}")
+    print()
+    print(format_generated_build(builds[str(characters[0]["id"])], game_data))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Кэш справочника: прежний cache.json vs разделы с манифестом (gamedata.py).
+
+Сравнивает размер на диске, время записи и время чтения: всего кэша и только
+тех разделов, которые нужны для выбора персонажа (characters + paths).
+Если установлен orjson, замеры повторяются и со стандартным json.
+
+    python benchmarks/bench_cache.py [--rounds 20]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+from fixtures import ROOT, make_cache
+
+sys.path.insert(0, ROOT)
+import gamedata  # noqa: E402
+
+
+def _timed(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _dirs, files in os.walk(path) for name in files)
+
+
+def run(cache, work_dir, rounds, label):
+    legacy = os.path.join(work_dir, "cache.json")
+    cache_dir = os.path.join(work_dir, "cache")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def write_legacy():
+        gamedata.write_cache_file(legacy, cache)
+
+    def read_legacy():
+        return gamedata.read_cache_file(legacy)["game_data"]["Honkai: Star Rail"]["characters"]
+
+    def read_sections(*sections):
+        game = gamedata.read_cache(cache_dir)["game_data"]["Honkai: Star Rail"]
+        for section in sections:
+            game[section]
+
+    legacy_write = _timed(write_legacy, rounds)
+    first_write = _timed(lambda: gamedata.write_cache(cache_dir, cache), 1)
+    print(f"[{label}]")
+    print(f"  размер: cache.json {os.path.getsize(legacy):>9} Б, разделы {_dir_size(cache_dir):>9} Б")
+    print(f"  запись: cache.json {legacy_write:7.2f} мс, "
+          f"разделы {first_write:7.2f} мс (первая), "
+          f"{_timed(lambda: gamedata.write_cache(cache_dir, cache), rounds):7.2f} мс (без изменений)")
+    print(f"  чтение: cache.json целиком {_timed(read_legacy, rounds):7.2f} мс")
+    print(f"          манифест           {_timed(read_sections, rounds):7.2f} мс")
+    print(f"          characters + paths {_timed(lambda: read_sections('characters', 'paths'), rounds):7.2f} мс")
+    all_sections = list(cache["game_data"]["Honkai: Star Rail"])
+    print(f"          все разделы        {_timed(lambda: read_sections(*all_sections), rounds):7.2f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    cache = make_cache()
+    work_dir = tempfile.mkdtemp(prefix="hsr-cache-")
+    try:
+        codec = gamedata.orjson
+        run(cache, work_dir, args.rounds, "orjson" if codec else "json")
+        if codec is not None:
+            gamedata.orjson = None
+            run(cache, work_dir, args.rounds, "json")
+            gamedata.orjson = codec
+
+        # Повреждённый раздел не должен молча подменять данные
+        cache_dir = os.path.join(work_dir, "cache")
+        manifest = gamedata.read_manifest(cache_dir)
+        entry = manifest["games"]["Honkai: Star Rail"]["characters"]
+        with open(os.path.join(cache_dir, entry["file"]), "r+b") as f:
+            f.truncate(entry["size"] // 2)
+        broken = gamedata.read_cache(cache_dir)["game_data"]["Honkai: Star Rail"]
+        print(f"Обрезанный раздел characters: {len(broken['characters'])} записей, "
+              f"paths: {len(broken['paths'])} записей")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
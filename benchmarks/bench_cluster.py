@@ -0,0 +1,133 @@
+"""Масштабирование многопроцессного webhook (cluster.py) по числу воркеров.
+
+Поднимает заглушку Bot API (как bench_webhook.py), затем для каждого числа
+воркеров — фронт ``ClusterFront`` и воркеры ``WorkerSupervisor``. Воркер —
+этот же скрипт, запущенный супервизором с ``BOT_WORKER_SOCKET``: он
+импортирует bot.py с общей папкой данных (SQLite FSM, подписчики, кэш) и
+обслуживает апдейты ``WebhookServer`` на unix-сокете.
+
+Клиент шлёт ту же смесь апдейтов, что и bench_webhook.py, от 500 чатов и
+ждёт, пока воркеры обработают всё. Печатает апдейтов/с для каждого N;
+прирост ограничен числом ядер машины.
+
+    python benchmarks/bench_cluster.py [--workers 1,2,4] [--updates 4000] [--connections 80]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from aiohttp import ClientSession, UnixConnector
+
+import fixtures
+from bench_webhook import SECRET, serve_fake_api, make_updates, load_in_process, _percentile
+
+
+# --- воркер (запускается супервизором) ---
+async def run_worker(socket_path, api_port):
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    os.chdir(fixtures.ROOT)
+    sys.path.insert(0, fixtures.ROOT)
+    import bot
+    from webhook import WebhookServer
+
+    bot.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{api_port}"))
+    server = WebhookServer(bot.dp, bot.bot, path="/", order_callbacks=False)
+    await server.start_unix(socket_path)
+    try:
+        await bot.wait_for_stop()
+    finally:
+        await server.stop()
+        await bot.bot.session.close()
+
+
+# --- фронт и нагрузка ---
+async def processed(sockets):
+    """Сколько апдейтов воркеры уже обработали и сколько ещё в работе."""
+    done = in_flight = 0
+    for socket_path in sockets:
+        async with ClientSession(connector=UnixConnector(path=socket_path)) as session:
+            async with session.get("http://worker/healthz") as resp:
+                health = await resp.json()
+        done += health["received"]
+        in_flight += health["in_flight"]
+    return done - in_flight
+
+
+async def bench(workers, args, updates, data_dir, pool):
+    from cluster import ClusterFront, WorkerSupervisor
+
+    port = args.port + 1 + workers
+    supervisor = WorkerSupervisor(workers, os.path.join(data_dir, f"workers-{workers}"),
+                                  command=[sys.executable, os.path.abspath(__file__)])
+    await supervisor.start()
+    front = ClusterFront(supervisor.sockets, secret_token=SECRET)
+    try:
+        await supervisor.wait_ready()
+        await front.start("127.0.0.1", port)
+        start = time.perf_counter()
+        latencies, statuses, answered_in = await asyncio.get_running_loop().run_in_executor(
+            pool, load_in_process, f"http://127.0.0.1:{port}/webhook", updates, args.connections)
+        while await processed(supervisor.sockets) < len(updates):
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+    finally:
+        await front.stop()
+        await supervisor.stop()
+    print(f"[{workers} воркер(ов)] статусы {statuses}   ответ p50 {_percentile(latencies, 0.5):6.1f} мс"
+          f"   p99 {_percentile(latencies, 0.99):6.1f} мс")
+    print(f"  принято {len(updates) / answered_in:7.0f} апдейтов/с, обработано {len(updates) / elapsed:7.0f} апдейтов/с")
+    return len(updates) / elapsed
+
+
+async def main_async(args, pool):
+    data_dir = os.environ["DATA_DIR"]
+    bot_module = fixtures.load_bot(data_dir)
+    characters = [b["character"] for b in bot_module.builds_index.builds]
+    updates = make_updates(args.updates, characters)
+
+    print(f"{args.updates} апдейтов, {args.connections} соединений, ядер {os.cpu_count()}")
+    baseline = None
+    for workers in args.workers:
+        rate = await bench(workers, args, updates, data_dir, pool)
+        baseline = baseline or rate
+        print(f"  ускорение x{rate / baseline:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=lambda s: [int(n) for n in s.split(",")],
+                        default=sorted({1, 2, max(1, os.cpu_count() or 1)}))
+    parser.add_argument("--updates", type=int, default=4000)
+    parser.add_argument("--connections", type=int, default=80)
+    parser.add_argument("--api-latency", type=float, default=0.03)
+    parser.add_argument("--port", type=int, default=18180)
+    args = parser.parse_args()
+
+    # Воркеры наследуют окружение: общая папка данных и адрес заглушки
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="hsr-cluster-")
+    os.environ["BENCH_API_PORT"] = str(args.port)
+
+    ctx = multiprocessing.get_context("spawn")
+    calls = ctx.Value("i", 0)
+    api = ctx.Process(target=serve_fake_api, args=(args.port, args.api_latency, calls), daemon=True)
+    api.start()
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            asyncio.run(main_async(args, pool))
+    finally:
+        api.terminate()
+
+
+if __name__ == "__main__":
+    if os.getenv("BOT_WORKER_SOCKET"):
+        os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:BENCHMARK")
+        asyncio.run(run_worker(os.environ["BOT_WORKER_SOCKET"], int(os.environ["BENCH_API_PORT"])))
+    else:
+        main()
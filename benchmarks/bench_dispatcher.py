@@ -0,0 +1,235 @@
+"""Прогон синтетических апдейтов через Dispatcher без сети.
+
+Каждый пользователь проходит типичный путь по меню:
+
+    /start → game:HSR → f:HSR:builds → p:<путь> → c:<персонаж> → teams:show → teams:back → back:char
+
+Апдейты подаются в ``dp.feed_update`` напрямую (без webhook и polling),
+а сессия бота подменена заглушкой: запросы к Bot API не уходят в сеть, ответ
+собирается локально и разбирается тем же ``check_response``, что и настоящий.
+Справочник — синтетический ``cache.json`` из fixtures.py, билды — настоящий
+``best_builds.json``.
+
+Печатает задержку по шагам и в целом (p50/p95/p99), апдейты в секунду и пиковый
+RSS процесса. ``--save`` сохраняет итог в JSON, ``--baseline`` сравнивает с
+сохранённым ранее — удобно гонять до и после оптимизации:
+
+    python benchmarks/bench_dispatcher.py --save before.json
+    ... изменения ...
+    python benchmarks/bench_dispatcher.py --baseline before.json
+
+    python benchmarks/bench_dispatcher.py [--users 200] [--flows 5] [--concurrency 50]
+                                          [--api-latency 0] [--storage sqlite|memory]
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+
+from fixtures import load_bot
+
+STEPS = ("start", "game", "feature", "element", "char", "teams:show", "teams:back", "back:char")
+
+
+def _percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def _peak_rss_mb() -> float:
+    # В Linux ru_maxrss — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_session(latency: float):
+    """Сессия aiogram, отвечающая на любой метод без сети."""
+    from aiogram.client.session.base import BaseSession
+
+    class FakeSession(BaseSession):
+        calls = 0
+
+        async def close(self):
+            pass
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b""
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls += 1
+            if latency:
+                await asyncio.sleep(latency)
+            name = method.__api_method__.lower()
+            chat_id = getattr(method, "chat_id", None) or 1
+            message = {"message_id": random.randint(1, 10**6), "date": 1700000000,
+                       "chat": {"id": chat_id, "type": "private"}}
+            if name == "sendphoto":
+                result = {**message, "photo": [{"file_id": "photo-id", "file_unique_id": "u", "width": 1, "height": 1}]}
+            elif name.startswith(("send", "edit", "copy")):
+                result = {**message, "text": "ok"}
+            else:
+                result = True
+            content = json.dumps({"ok": True, "result": result})
+            return self.check_response(bot=bot, method=method, status_code=200, content=content).result
+
+    return FakeSession()
+
+
+# --- апдейты ---
+def plan_flows(bot_module, flows, seed=1):
+    """Пути по меню: [(путь, id персонажа)], только персонажи с билдами."""
+    rng = random.Random(seed)
+    game_data = bot_module.game_store.get().game(bot_module.GAME_CODES["HSR"])
+    choices = []
+    for element in bot_module.get_elements(game_data):
+        for char_id, name in bot_module.get_character_buttons(game_data, element):
+            if str(char_id).isdigit() and bot_module.get_rendered_builds(name):
+                choices.append((element, int(char_id)))
+    if not choices:
+        raise SystemExit("В справочнике нет персонажей с билдами из best_builds.json")
+    return [rng.choice(choices) for _ in range(flows)]
+
+
+def flow_updates(chat_id, element, char_id, first_id):
+    from callbacks import CharacterCallback, FeatureCallback, PathCallback
+
+    user = {"id": chat_id, "is_bot": False, "first_name": "u"}
+    chat = {"id": chat_id, "type": "private"}
+    message = {"message_id": first_id, "date": 1700000000, "chat": chat, "text": "menu"}
+    datas = ["game:HSR", FeatureCallback(game="HSR", feature="builds").pack(), PathCallback(path=element).pack(),
+             CharacterCallback(id=char_id).pack(), "teams:show", "teams:back", "back:char"]
+    updates = [{"update_id": first_id, "message": {
+        "message_id": first_id, "date": 1700000000, "chat": chat, "from": user, "text": "/start",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}}]
+    for n, data in enumerate(datas, 1):
+        updates.append({"update_id": first_id + n, "callback_query": {
+            "id": str(first_id + n), "from": user, "chat_instance": "c", "data": data, "message": message}})
+    return updates
+
+
+def make_users(bot_module, users, flows_per_user, first_chat=10_000):
+    """Апдейты каждого пользователя по порядку, уже разобранные в Update.
+
+    Чаты прогрева и замера должны различаться: CallbackMiddleware отбросил бы
+    нажатие той же кнопки того же сообщения как повторное.
+    """
+    from aiogram.types import Update
+
+    plans = plan_flows(bot_module, users * flows_per_user)
+    result = []
+    update_id = 0
+    for u in range(users):
+        chat_id = first_chat + u
+        updates = []
+        for element, char_id in plans[u * flows_per_user:(u + 1) * flows_per_user]:
+            for step, raw in zip(STEPS, flow_updates(chat_id, element, char_id, update_id)):
+                updates.append((step, Update.model_validate(raw, context={"bot": bot_module.bot})))
+            update_id += len(STEPS)
+        result.append(updates)
+    return result
+
+
+async def replay(bot_module, users, concurrency):
+    """Пользователи идут параллельно (не больше ``concurrency``), апдейты одного — строго по порядку."""
+    from aiogram.dispatcher.event.bases import UNHANDLED
+
+    latencies = {step: [] for step in STEPS}
+    semaphore = asyncio.Semaphore(concurrency)
+    dp, bot = bot_module.dp, bot_module.bot
+    unhandled = 0
+
+    async def run_user(updates):
+        nonlocal unhandled
+        async with semaphore:
+            for step, update in updates:
+                start = time.perf_counter()
+                handled = await dp.feed_update(bot, update)
+                latencies[step].append((time.perf_counter() - start) * 1000)
+                if handled is UNHANDLED:
+                    unhandled += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_user(updates) for updates in users))
+    return latencies, time.perf_counter() - start, unhandled
+
+
+def summarize(latencies, elapsed, calls, unhandled, rss_before):
+    every = [ms for samples in latencies.values() for ms in samples]
+    stats = lambda samples: {"p50": _percentile(samples, 0.50), "p95": _percentile(samples, 0.95),
+                             "p99": _percentile(samples, 0.99), "count": len(samples)}
+    return {
+        "steps": {step: stats(samples) for step, samples in latencies.items() if samples},
+        "total": stats(every),
+        "updates_per_sec": len(every) / elapsed,
+        "api_calls": calls,
+        "unhandled": unhandled,
+        "rss_start_mb": rss_before,
+        "rss_peak_mb": _peak_rss_mb(),
+    }
+
+
+def report(result, baseline=None):
+    def delta(now, before):
+        if before is None or not before:
+            return ""
+        return f" ({(now - before) / before:+.0%})"
+
+    print(f"{'шаг':<12} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'апдейтов':>9}")
+    rows = list(result["steps"].items()) + [("всего", result["total"])]
+    for step, s in rows:
+        base = (baseline or {}).get("steps", {}).get(step) if step != "всего" else (baseline or {}).get("total")
+        line = f"{step:<12} {s['p50']:>9.2f} {s['p95']:>9.2f} {s['p99']:>9.2f} {s['count']:>9}"
+        if base:
+            line += f"   p95{delta(s['p95'], base['p95'])}"
+        print(line)
+    print(f"пропускная способность: {result['updates_per_sec']:.0f} апдейтов/с"
+          f"{delta(result['updates_per_sec'], (baseline or {}).get('updates_per_sec'))}")
+    print(f"запросов к Bot API: {result['api_calls']}, не обработано апдейтов: {result['unhandled']}")
+    print(f"RSS: {result['rss_start_mb']:.0f} МБ после прогрева, пик {result['rss_peak_mb']:.0f} МБ"
+          f"{delta(result['rss_peak_mb'], (baseline or {}).get('rss_peak_mb'))}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200, help="пользователей (чатов)")
+    parser.add_argument("--flows", type=int, default=5, help="проходов по меню на пользователя")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременно активных пользователей")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа заглушки Bot API, с")
+    parser.add_argument("--storage", choices=("sqlite", "memory"), default="sqlite")
+    parser.add_argument("--warmup", type=int, default=20, help="пользователей для прогрева (не учитываются)")
+    parser.add_argument("--save", help="сохранить итог в JSON")
+    parser.add_argument("--baseline", help="сравнить с итогом, сохранённым через --save")
+    args = parser.parse_args()
+
+    os.environ["FSM_STORAGE"] = args.storage
+    bot_module = load_bot(tempfile.mkdtemp())
+    session = make_session(args.api_latency)
+    bot_module.bot.session = session
+
+    # Прогрев: снимок справочника, клавиатуры, индекс имён
+    await replay(bot_module, make_users(bot_module, args.warmup, 1, first_chat=1), args.concurrency)
+    session.calls = 0
+
+    users = make_users(bot_module, args.users, args.flows)
+    rss_before = _peak_rss_mb()
+    latencies, elapsed, unhandled = await replay(bot_module, users, args.concurrency)
+    result = summarize(latencies, elapsed, session.calls, unhandled, rss_before)
+    result["params"] = {k: v for k, v in vars(args).items() if k not in ("save", "baseline")}
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"итог сохранён в {args.save}")
+    await bot_module.dp.storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""Загрузка справочника: последовательно vs параллельно vs условные запросы.
+
+Поднимает локальный сервер-заглушку вместо raw.githubusercontent.com
+(с ETag/Last-Modified и искусственной задержкой) и замеряет fetch_sources:
+  * sequential  — файлы по одному, как делал старый requests.get-цикл;
+  * parallel    — холодная параллельная загрузка;
+  * conditional — повторная загрузка, все файлы отвечают 304.
+Параллельно меряется максимальная задержка event loop.
+
+    python benchmarks/bench_fetch.py [--latency-ms 150]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import hashlib
+
+from aiohttp import web
+
+from fixtures import ROOT, make_game_data
+
+sys.path.insert(0, ROOT)
+from fetcher import fetch_sources  # noqa: E402
+
+
+def make_app(sections: dict, latency: float, hits: dict):
+    bodies = {key: json.dumps(value, ensure_ascii=False, indent=2).encode() for key, value in sections.items()}
+    etags = {key: '"%s"' % hashlib.sha1(body).hexdigest() for key, body in bodies.items()}
+
+    async def handler(request):
+        key = request.match_info["key"]
+        await asyncio.sleep(latency)
+        if request.headers.get("If-None-Match") == etags[key]:
+            hits["304"] += 1
+            return web.Response(status=304)
+        hits["200"] += 1
+        return web.Response(body=bodies[key], content_type="application/json",
+                            headers={"ETag": etags[key], "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+
+    app = web.Application()
+    app.router.add_get("/{key}.json", handler)
+    return app
+
+
+async def loop_lag_probe(stop: asyncio.Event, out: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        out.append(time.perf_counter() - start - 0.001)
+
+
+async def timed(label, coro):
+    stop, lags = asyncio.Event(), []
+    probe = asyncio.create_task(loop_lag_probe(stop, lags))
+    start = time.perf_counter()
+    result = await coro
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    print(f"  {label:<12} {elapsed * 1000:8.1f} ms   max loop lag {max(lags, default=0) * 1000:6.1f} ms")
+    return result
+
+
+async def run(latency: float):
+    sections = make_game_data()
+    hits = {"200": 0, "304": 0}
+    runner = web.AppRunner(make_app(sections, latency, hits))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    urls = {key: f"http://127.0.0.1:{port}/{key}.json" for key in sections}
+    fallback_dir = os.path.join(ROOT, "data")
+
+    async def sequential():
+        for key, url in urls.items():
+            await fetch_sources({key: url}, fallback_dir=fallback_dir)
+
+    try:
+        await timed("sequential", sequential())
+        data, validators, stats = await timed("parallel", fetch_sources(urls, fallback_dir=fallback_dir))
+        assert data == sections and stats["downloaded"] == len(urls)
+        data2, _, stats = await timed("conditional", fetch_sources(urls, data, validators, fallback_dir=fallback_dir))
+        assert stats["not_modified"] == len(urls) and data2 == sections
+        print(f"  ответы сервера: 200 × {hits['200']}, 304 × {hits['304']}")
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency-ms", type=float, default=150)
+    args = parser.parse_args()
+    asyncio.run(run(args.latency_ms / 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Форматирование билдов: прежняя цепочка re.sub vs markup.py.
+
+Все поля *_pretty всех билдов из best_builds.json через старые to_html +
+sanitize_caption и через markup.to_html; выход нового варианта проверяется
+markup.check_html. Фаззинг разметки — в tests/test_markup.py.
+
+    python benchmarks/bench_markup.py [--rounds 200]
+"""
+import re
+import sys
+import json
+import time
+import argparse
+
+from fixtures import ROOT
+
+sys.path.insert(0, ROOT)
+import markup  # noqa: E402
+
+PRETTY_FIELDS = (
+    "best_relic_pretty", "alt_relic_pretty", "best_5_lc_pretty", "best_4_lc_pretty",
+    "best_planar_pretty", "alt_planar_pretty", "main_stats_pretty", "recommended_stats_pretty",
+    "recommended_substats_pretty", "best_teammates_pretty", "team_pretty", "role_pretty",
+)
+
+
+def legacy_to_html(text):
+    """Копия вложенной to_html из format_best_build до перехода на markup.py."""
+    if not text:
+        return ""
+    text = re.sub(r'\*(.*?)\*', r'<b>\1</b>', text)
+    text = re.sub(r'(?<!_)_(?!_)([^_]+?)(?<!_)_(?!_)', r'<i>\1</i>', text)
+    text = re.sub(r'__([^_]+)_', r'<i>\1</i>', text)
+    text = re.sub(r'~(.*?)~', r' \1 ', text)
+    text = re.sub(r'```(.*?)```', r'<code>\1</code>', text, flags=re.DOTALL)
+    text = re.sub(r'\[(.*?)\]\((https?://[^\s]+)\)', r'<a href="\2">\1</a>', text)
+    return text
+
+
+def legacy_sanitize(text):
+    """Копия прежней sanitize_caption."""
+    text = text.replace("&lt;", "<").replace("&gt;", ">")
+    text = re.sub(r"<(\d)", r"&lt;\1", text)
+    text = re.sub(r"<%", "&lt;%", text)
+    text = re.sub(r"(\d)>", r"\1&gt;", text)
+    text = re.sub(r"%>", "%&gt;", text)
+    return text
+
+
+def legacy_render(build):
+    return legacy_sanitize("\n".join(legacy_to_html(build.get(f, "")) for f in PRETTY_FIELDS))
+
+
+def new_render(build):
+    return "\n".join(markup.to_html(build.get(f, "")) for f in PRETTY_FIELDS)
+
+
+def bench(label, fn, builds, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for build in builds:
+            fn(build)
+    elapsed = time.perf_counter() - start
+    per_build = elapsed / (rounds * len(builds)) * 1e6
+    print(f"  {label:<8} {per_build:8.1f} µs на билд")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    with open(f"{ROOT}/best_builds.json", encoding="utf-8") as f:
+        builds = json.load(f)
+    print(f"Рендеринг {len(builds)} билдов × {args.rounds}")
+    bench("legacy", legacy_render, builds, args.rounds)
+    bench("markup", new_render, builds, args.rounds)
+    invalid = [b["character"] for b in builds if markup.check_html(new_render(b))]
+    print(f"  невалидный HTML в билдах: {len(invalid)} {invalid}")
+    if invalid:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Поиск персонажа по имени: индекс names.NameIndex против прежнего перебора.
+
+Запросы — точные имена, префиксы, латиница, транслит и опечатки. Для
+каждого печатаются первые результаты и среднее время запроса; цель — меньше
+1 мс на запрос (inline-режим отвечает на каждое нажатие клавиши).
+
+    python benchmarks/bench_names.py [--iterations 2000]
+"""
+import time
+import argparse
+import tempfile
+
+from fixtures import load_bot
+
+QUERIES = ["Кафка", "каф", "kafka", "хуохуо", "huo-huo", "Март 7", "первопроходец",
+           "пожиратель", "imbibitor", "черный лебедь", "цзинь юань", "jing yuan", "xyzzy"]
+
+
+def legacy_lookup(by_character, name):
+    key = name.strip().lower()
+    if key in by_character:
+        return key
+    base = key.split(" (", 1)[0]
+    return next((k for k in by_character if k.startswith(base)), None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    bot = load_bot(tempfile.mkdtemp(prefix="hsr-bench-"))
+    by_character = bot.builds_index.by_character
+
+    start = time.perf_counter()
+    name_index = bot.get_name_index()
+    print(f"Индекс: {len(name_index.keys)} персонажей, построен за {(time.perf_counter() - start) * 1000:.2f} мс")
+
+    for query in QUERIES:
+        legacy = legacy_lookup(by_character, query)
+        found = name_index.search(query, limit=3)
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            name_index.search(query)
+        elapsed = (time.perf_counter() - start) / args.iterations * 1000
+        print(f"{query!r:>18}: {elapsed:6.3f} мс  {found}   (перебор: {legacy!r})")
+
+
+if __name__ == "__main__":
+    main()
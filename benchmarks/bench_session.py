@@ -0,0 +1,177 @@
+"""Сессия Bot API под нагрузкой на заглушке с ошибками.
+
+Заглушка (отдельный процесс) отвечает с задержкой ``--api-latency`` и с
+заданной вероятностью возвращает 429 (flood wait), 502 или рвёт соединение.
+Клиент шлёт ``--requests`` вызовов (sendMessage, editMessageText,
+answerCallbackQuery, deleteMessage) не более чем ``--concurrency`` сразу через:
+
+* сессию aiogram по умолчанию;
+* ``botapi.create_session`` с ``RetryMiddleware``.
+
+Печатает долю успешных вызовов, ошибки по типам, задержку (p50/p95/p99),
+число TCP-соединений, открытых к заглушке, и сколько раз повторялись запросы.
+
+    python benchmarks/bench_session.py [--requests 3000] [--concurrency 100] [--api-latency 0.03]
+                                       [--flood 0.002] [--server-errors 0.02] [--drops 0.01]
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+import multiprocessing
+
+from aiohttp import web, ClientSession
+
+from fixtures import ROOT
+
+SEND_METHODS = ("sendMessage", "editMessageText", "answerCallbackQuery", "deleteMessage")
+
+
+def _percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0.0
+
+
+# --- заглушка Bot API ---
+def fake_api_app(args):
+    stats = {"requests": 0, "peers": set(), "flood": 0, "server": 0, "drops": 0}
+    rng = random.Random(1)
+
+    async def handle(request):
+        stats["requests"] += 1
+        stats["peers"].add(request.transport.get_extra_info("peername"))
+        await request.post()
+        await asyncio.sleep(args.api_latency)
+        roll = rng.random()
+        if roll < args.flood:
+            stats["flood"] += 1
+            return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                      "parameters": {"retry_after": 1}}, status=429)
+        roll -= args.flood
+        if roll < args.server_errors:
+            stats["server"] += 1
+            return web.json_response({"ok": False, "error_code": 502, "description": "Bad Gateway"}, status=502)
+        roll -= args.server_errors
+        if roll < args.drops:
+            stats["drops"] += 1
+            request.transport.close()
+            return web.Response()
+        method = request.match_info["method"].lower()
+        if method in ("sendmessage", "editmessagetext"):
+            result = {"message_id": rng.randint(1, 10**6), "date": 1700000000,
+                      "chat": {"id": 1, "type": "private"}, "text": "ok"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_stats(request):
+        return web.json_response({**stats, "peers": len(stats["peers"])})
+
+    async def handle_reset(request):
+        stats.update(requests=0, peers=set(), flood=0, server=0, drops=0)
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    app.router.add_get("/stats", handle_stats)
+    app.router.add_post("/reset", handle_reset)
+    return app
+
+
+def serve_fake_api(args):
+    web.run_app(fake_api_app(args), host="127.0.0.1", port=args.port, print=None, access_log=None)
+
+
+# --- клиент ---
+async def call(bot, method):
+    if method == "sendMessage":
+        return await bot.send_message(chat_id=1, text="bench")
+    if method == "editMessageText":
+        return await bot.edit_message_text("bench", chat_id=1, message_id=1)
+    if method == "answerCallbackQuery":
+        return await bot.answer_callback_query("1")
+    return await bot.delete_message(chat_id=1, message_id=1)
+
+
+async def run(label, session, args, base):
+    from aiogram import Bot
+
+    async with ClientSession() as control:
+        await control.post(f"{base}/reset")
+    bot = Bot(token="123456:BENCHMARK", session=session)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, errors = [], {}
+
+    async def one(n):
+        method = SEND_METHODS[n % len(SEND_METHODS)]
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call(bot, method)
+                latencies.append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    await bot.session.close()
+    async with ClientSession() as control:
+        async with control.get(f"{base}/stats") as resp:
+            stats = await resp.json()
+
+    print(f"[{label}] успешно {len(latencies)}/{args.requests} за {elapsed:.2f} с, ошибки: {errors or 'нет'}")
+    print(f"  задержка: p50 {_percentile(latencies, 0.5):7.1f} мс   p95 {_percentile(latencies, 0.95):7.1f} мс"
+          f"   p99 {_percentile(latencies, 0.99):7.1f} мс")
+    print(f"  заглушка: запросов {stats['requests']}, соединений {stats['peers']}, "
+          f"429: {stats['flood']}, 502: {stats['server']}, обрывов: {stats['drops']}; "
+          f"повторов клиента {stats['requests'] - args.requests}")
+
+
+async def main_async(args):
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from botapi import RetryMiddleware, create_session
+
+    base = f"http://127.0.0.1:{args.port}"
+    for _ in range(50):
+        try:
+            async with ClientSession() as control:
+                await control.get(f"{base}/stats")
+            break
+        except OSError:
+            await asyncio.sleep(0.1)
+
+    print(f"{args.requests} вызовов, {args.concurrency} одновременно, задержка {args.api_latency * 1000:.0f} мс, "
+          f"429 {args.flood:.1%}, 502 {args.server_errors:.1%}, обрывы {args.drops:.1%}")
+    await run("aiogram по умолчанию", AiohttpSession(api=TelegramAPIServer.from_base(base)), args, base)
+    session = create_session(api_base=base, pool_size=args.concurrency)
+    session.middleware(RetryMiddleware())
+    await run("botapi.create_session + RetryMiddleware", session, args, base)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--api-latency", type=float, default=0.03)
+    parser.add_argument("--flood", type=float, default=0.002, help="доля ответов 429")
+    parser.add_argument("--server-errors", type=float, default=0.02, help="доля ответов 502")
+    parser.add_argument("--drops", type=float, default=0.01, help="доля оборванных соединений")
+    parser.add_argument("--port", type=int, default=18090)
+    args = parser.parse_args()
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    ctx = multiprocessing.get_context("spawn")
+    api = ctx.Process(target=serve_fake_api, args=(args,), daemon=True)
+    api.start()
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        api.terminate()
+
+
+if __name__ == "__main__":
+    main()
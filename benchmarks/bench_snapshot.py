@@ -0,0 +1,86 @@
+"""Задержка колбэков до/после снимка GameData в памяти.
+
+«До» — поведение старой версии: на каждое нажатие заново парсится
+cache.json целиком. «После» — обработчик берёт готовый снимок из game_store.
+
+    python benchmarks/bench_snapshot.py [--iterations 200]
+"""
+import os
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from fixtures import load_bot
+
+
+class _FakeMessage:
+    chat = SimpleNamespace(id=1)
+
+    async def edit_text(self, *args, **kwargs):
+        pass
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def delete(self):
+        pass
+
+
+def _callback(data):
+    return SimpleNamespace(data=data, message=_FakeMessage())
+
+
+async def _measure(bot, handler, data, iterations):
+    from aiogram.fsm.context import FSMContext
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+    await state.update_data(game="Honkai: Star Rail", element="Warrior")
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await handler(_callback(data), state)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"  {label:<8} mean {statistics.mean(samples):8.3f} ms   p50 {statistics.median(samples):8.3f} ms   p95 {p95:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="hsr-bench-")
+    bot = load_bot(data_dir)
+    from gamedata import GameDataSnapshot, read_cache_file
+    handlers = [
+        ("feature:HSR:builds", bot.cb_choose_feature_legacy),
+        ("element:Warrior", bot.cb_choose_element_legacy),
+        ("back:element", bot.cb_back_element),
+        ("back:char", bot.cb_back_char),
+    ]
+    snapshot_get = bot.game_store.get
+
+    def legacy_get():
+        # Старое поведение: полный json.load на каждый вызов
+        return GameDataSnapshot(cache=read_cache_file(os.path.join(data_dir, "cache.json")), generation=0)
+
+    for data, handler in handlers:
+        print(data)
+        bot.game_store.get = legacy_get
+        _report("before", asyncio.run(_measure(bot, handler, data, args.iterations)))
+        bot.game_store.get = snapshot_get
+        _report("after", asyncio.run(_measure(bot, handler, data, args.iterations)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Нагрузочный тест режима webhook на локальной заглушке Bot API.
+
+Поднимает:
+* заглушку api.telegram.org (отдельный процесс), которая отвечает на любой
+  метод с задержкой ``--api-latency`` (имитация сети до Telegram);
+* сервер webhook бота — прежний ``SimpleRequestHandler`` (ответ Telegram
+  только после обработки апдейта) и новый ``webhook.WebhookServer``;
+* клиента (отдельный процесс), который, как Telegram, шлёт апдейты не более
+  чем в ``--connections`` параллельных соединений.
+
+Смесь апдейтов: /start, выбор «Билды» и выбор персонажа (с портретом).
+Печатает время ответа webhook (p50/p95/p99) и пропускную способность.
+
+    python benchmarks/bench_webhook.py [--updates 2000] [--connections 40] [--api-latency 0.03]
+"""
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from aiohttp import web, ClientSession, TCPConnector
+
+from fixtures import load_bot
+
+SECRET = "bench-secret"
+
+
+def _percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+# --- заглушка Bot API ---
+def _message(chat_id, **extra):
+    return {"message_id": random.randint(1, 10**6), "date": 1700000000, "chat": {"id": chat_id, "type": "private"}, **extra}
+
+
+def fake_api_app(latency, calls):
+    async def handle(request):
+        with calls.get_lock():
+            calls.value += 1
+        method = request.match_info["method"].lower()
+        # aiogram шлёт параметры формой (multipart, если есть файл)
+        data = await request.post()
+        await asyncio.sleep(latency)
+        chat_id = int(data.get("chat_id") or 1)
+        if method == "sendphoto":
+            photo = [{"file_id": "photo-id", "file_unique_id": "u", "width": 1, "height": 1}]
+            result = _message(chat_id, photo=photo)
+        elif method.startswith("send") or method in ("editmessagetext", "copymessage"):
+            result = _message(chat_id, text="ok")
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    return app
+
+
+def serve_fake_api(port, latency, calls):
+    web.run_app(fake_api_app(latency, calls), host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+# --- апдейты ---
+def make_updates(count, characters):
+    updates = []
+    for i in range(count):
+        user = {"id": 1000 + i % 500, "is_bot": False, "first_name": "u"}
+        chat = {"id": user["id"], "type": "private"}
+        kind = i % 3
+        if kind == 0:
+            updates.append({"update_id": i, "message": {
+                "message_id": i, "date": 1700000000, "chat": chat, "from": user, "text": "/start",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}})
+        else:
+            data = "feature:HSR:builds" if kind == 1 else f"char:{characters[i % len(characters)]}"
+            updates.append({"update_id": i, "callback_query": {
+                "id": str(i), "from": user, "chat_instance": "c", "data": data,
+                "message": {"message_id": i, "date": 1700000000, "chat": chat, "text": "menu"}}})
+    return updates
+
+
+async def run_load(url, updates, connections):
+    latencies = []
+    statuses = {}
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    async def client(session):
+        while not queue.empty():
+            update = queue.get_nowait()
+            start = time.perf_counter()
+            async with session.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as resp:
+                await resp.read()
+                statuses[resp.status] = statuses.get(resp.status, 0) + 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    async with ClientSession(connector=TCPConnector(limit=connections)) as session:
+        await asyncio.gather(*(client(session) for _ in range(connections)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def load_in_process(url, updates, connections):
+    return asyncio.run(run_load(url, updates, connections))
+
+
+async def bench(bot_module, label, make_server, args, updates, api_port, port, pool):
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    bot_module.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{api_port}"))
+    server, stop, in_flight = await make_server(port)
+    latencies, statuses, answered_in = await asyncio.get_running_loop().run_in_executor(
+        pool, load_in_process, f"http://127.0.0.1:{port}/webhook", updates, args.connections)
+    while in_flight():
+        await asyncio.sleep(0.01)
+    total = len(updates)
+    print(f"[{label}] статусы {statuses}")
+    print(f"  ответ webhook: p50 {_percentile(latencies, 0.5):7.1f} мс   p95 {_percentile(latencies, 0.95):7.1f} мс"
+          f"   p99 {_percentile(latencies, 0.99):7.1f} мс   среднее {statistics.mean(latencies):7.1f} мс")
+    print(f"  принято {total / answered_in:8.0f} апдейтов/с")
+    await stop()
+    await bot_module.bot.session.close()
+
+
+async def main_async(args, pool, calls):
+    bot_module = load_bot(tempfile.mkdtemp(prefix="hsr-bench-"))
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+    from webhook import WebhookServer
+
+    characters = [b["character"] for b in bot_module.builds_index.builds]
+    updates = make_updates(args.updates, characters)
+
+    async def legacy_server(port):
+        # Как в прежнем start_webhook: апдейты в фоне, без лимита и без ожидания при остановке
+        app = web.Application()
+        handler = SimpleRequestHandler(dispatcher=bot_module.dp, bot=bot_module.bot, secret_token=SECRET)
+        app.router.add_post("/webhook", handler.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner, runner.cleanup, lambda: len(handler._background_feed_update_tasks)
+
+    async def new_server(port):
+        server = WebhookServer(bot_module.dp, bot_module.bot, secret_token=SECRET, max_in_flight=args.in_flight,
+                               order_callbacks=False)
+        await server.start("127.0.0.1", port)
+        return server, server.stop, lambda: server.in_flight
+
+    print(f"{args.updates} апдейтов, {args.connections} соединений, задержка Bot API {args.api_latency * 1000:.0f} мс")
+    for label, factory, port in (("SimpleRequestHandler", legacy_server, args.port),
+                                 ("WebhookServer", new_server, args.port + 2)):
+        before = calls.value
+        start = time.perf_counter()
+        await bench(bot_module, label, factory, args, updates, args.port + 1, port, pool)
+        elapsed = time.perf_counter() - start
+        print(f"  обработано полностью за {elapsed:6.2f} с ({len(updates) / elapsed:6.0f} апдейтов/с), "
+              f"вызовов Bot API {calls.value - before}")
+
+    # Проверка секрета и /healthz
+    server = WebhookServer(bot_module.dp, bot_module.bot, secret_token=SECRET)
+    await server.start("127.0.0.1", args.port + 3)
+    async with ClientSession() as session:
+        async with session.post(f"http://127.0.0.1:{args.port + 3}/webhook", json=updates[0]) as resp:
+            print(f"Без секрета: HTTP {resp.status}")
+        async with session.get(f"http://127.0.0.1:{args.port + 3}/healthz") as resp:
+            print(f"/healthz: HTTP {resp.status} {await resp.text()}")
+    await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--connections", type=int, default=40)
+    parser.add_argument("--api-latency", type=float, default=0.03)
+    parser.add_argument("--in-flight", type=int, default=100)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    calls = ctx.Value("i", 0)
+    api = ctx.Process(target=serve_fake_api, args=(args.port + 1, args.api_latency, calls), daemon=True)
+    api.start()
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            asyncio.run(main_async(args, pool, calls))
+    finally:
+        api.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Синтетический справочник в формате StarRailRes (index_new/ru) для бенчмарков.
+
+Настоящие json-файлы тянутся с GitHub; чтобы замеры не зависели от сети,
+генерируем данные той же структуры и сопоставимого объёма (~1 МБ).
+Имена персонажей берутся из best_builds.json, id — из icon/character.
+"""
+import os
+import json
+import random
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PATHS = {
+    "Warrior": "Разрушение",
+    "Rogue": "Охота",
+    "Mage": "Эрудиция",
+    "Shaman": "Гармония",
+    "Warlock": "Небытие",
+    "Knight": "Сохранение",
+    "Priest": "Изобилие",
+    "Memory": "Память",
+}
+ELEMENTS = {
+    "Physical": "Физический",
+    "Fire": "Огненный",
+    "Ice": "Ледяной",
+    "Thunder": "Электрический",
+    "Wind": "Ветряной",
+    "Quantum": "Квантовый",
+    "Imaginary": "Мнимый",
+}
+PATH_IDS = {v: k for k, v in PATHS.items()}
+MAIN_PROPERTIES = [
+    "HPDelta", "AttackDelta", "HPAddedRatio", "AttackAddedRatio", "DefenceAddedRatio",
+    "CriticalChanceBase", "CriticalDamageBase", "HealRatioBase", "StatusProbabilityBase",
+    "SpeedDelta", "PhysicalAddedRatio", "FireAddedRatio", "IceAddedRatio",
+    "ThunderAddedRatio", "WindAddedRatio", "QuantumAddedRatio", "ImaginaryAddedRatio",
+    "BreakDamageAddedRatioBase", "SPRatioBase",
+]
+WORDS = ("урон", "атака", "защита", "лечение", "скорость", "союзник", "противник", "эффект",
+         "энергия", "щит", "ход", "бонус", "крит", "шанс", "навык", "техника", "слабость")
+
+
+def _text(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def _character_names():
+    with open(os.path.join(ROOT, "best_builds.json"), encoding="utf-8") as f:
+        builds = json.load(f)
+    return builds
+
+
+def _character_ids():
+    ids = []
+    for name in sorted(os.listdir(os.path.join(ROOT, "icon", "character"))):
+        stem = name.rsplit(".", 1)[0]
+        if stem.isdigit():
+            ids.append(stem)
+    return ids
+
+
+def make_game_data(seed: int = 7) -> dict:
+    """Справочник одной игры: {"characters": {...}, "light_cones": {...}, ...}."""
+    rng = random.Random(seed)
+    paths = {pid: {"id": pid, "text": name, "name": name, "desc": _text(rng, 20),
+                   "icon": f"icon/path/{pid}.png"} for pid, name in PATHS.items()}
+    elements = {eid: {"id": eid, "name": name, "desc": _text(rng, 12), "color": "#FFFFFF",
+                      "icon": f"icon/element/{eid}.png"} for eid, name in ELEMENTS.items()}
+
+    characters = {}
+    builds = _character_names()
+    ids = _character_ids()
+    for i, cid in enumerate(ids):
+        build = builds[i % len(builds)]
+        name = build["character"].split(" (", 1)[0]
+        if cid.startswith("800"):
+            name = "{NICKNAME}"
+        path_id = PATH_IDS.get(build["analytics"].get("path")) or rng.choice(list(PATHS))
+        element_id = build["analytics"].get("element") or rng.choice(list(ELEMENTS))
+        if element_id not in ELEMENTS:
+            element_id = rng.choice(list(ELEMENTS))
+        characters[cid] = {
+            "id": cid, "name": name, "tag": f"char{cid}", "rarity": rng.choice([4, 5]),
+            "path": path_id, "element": element_id, "max_sp": rng.choice([100, 120, 130, 140]),
+            "ranks": [f"{cid}0{r}" for r in range(1, 7)],
+            "skills": [f"{cid}0{s}" for s in range(1, 8)],
+            "skill_trees": [f"{cid}{t:03d}" for t in range(1, 19)],
+            "icon": f"icon/character/{cid}.png", "preview": f"image/character_preview/{cid}.png",
+            "portrait": f"image/character_portrait/{cid}.png",
+        }
+
+    light_cones = {}
+    for i in range(160):
+        cid = str(20000 + i)
+        light_cones[cid] = {
+            "id": cid, "name": f"Конус {_text(rng, 3)} {i}", "rarity": rng.choice([3, 4, 4, 5]),
+            "path": rng.choice(list(PATHS)), "desc": _text(rng, 220),
+            "icon": f"icon/light_cone/{cid}.png", "preview": f"image/light_cone_preview/{cid}.png",
+            "portrait": f"image/light_cone_portrait/{cid}.png",
+        }
+
+    relic_sets = {}
+    for i in range(70):
+        sid = str(101 + i) if i < 45 else str(301 + i - 45)
+        planar = sid.startswith("3")
+        relic_sets[sid] = {
+            "id": sid, "name": f"Комплект {_text(rng, 2)} {sid}",
+            "type": "Planar" if planar else "Relic",
+            "desc": [f"{rng.choice(list(ELEMENTS.values()))} {_text(rng, 15)}", _text(rng, 40)],
+            "properties": [[{"type": rng.choice(MAIN_PROPERTIES), "value": 0.1}]],
+            "icon": f"icon/relic/{sid}.png",
+        }
+
+    relics = {}
+    for sid, relic_set in relic_sets.items():
+        slots = ("NECK", "OBJECT") if relic_set["type"] == "Planar" else ("HEAD", "HAND", "BODY", "FOOT")
+        for rarity in (2, 3, 4, 5):
+            for n, slot in enumerate(slots, 1):
+                rid = f"{rarity}{sid}{n}"
+                relics[rid] = {
+                    "id": rid, "set_id": sid, "name": f"{relic_set['name']} {slot}", "rarity": rarity,
+                    "type": slot, "max_level": rarity * 3, "main_affix_id": f"{rarity}{n}",
+                    "sub_affix_id": str(rarity), "icon": f"icon/relic/{sid}_{n - 1}.png",
+                }
+
+    def affixes(n):
+        return {str(k): {"affix_id": str(k), "property": MAIN_PROPERTIES[(k - 1) % len(MAIN_PROPERTIES)],
+                         "base": 0.05, "step": 0.01} for k in range(1, n + 1)}
+
+    relic_main_affixes = {f"{r}{n}": {"id": f"{r}{n}", "affixes": affixes(10)} for r in (2, 3, 4, 5) for n in range(1, 7)}
+    relic_sub_affixes = {str(r): {"id": str(r), "affixes": affixes(12)} for r in (2, 3, 4, 5)}
+
+    return {
+        "characters": characters,
+        "relics": relics,
+        "relic_sets": relic_sets,
+        "light_cones": light_cones,
+        "relic_main_affixes": relic_main_affixes,
+        "relic_sub_affixes": relic_sub_affixes,
+        "paths": paths,
+        "elements": elements,
+    }
+
+
+def make_cache(last_updated: str = "2099-01-01T00:00:00") -> dict:
+    return {"last_updated": last_updated, "game_data": {"Honkai: Star Rail": make_game_data()}}
+
+
+def write_cache(path: str) -> dict:
+    cache = make_cache()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    return cache
+
+
+def load_bot(data_dir: str):
+    """Импортирует bot.py с временной папкой данных и фиктивным токеном."""
+    import sys
+    os.environ["DATA_DIR"] = data_dir
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:BENCHMARK")
+    os.chdir(ROOT)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    write_cache(os.path.join(data_dir, "cache.json"))
+    import bot
+    return bot
@@ -1,25 +1,46 @@
 import os
 import logging
 import asyncio
-import requests
 import json
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.filters import Command, ExceptionTypeFilter
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent, ErrorEvent
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from config import BotConfig
+from fetcher import fetch_sources
+from refresher import CacheRefresher
+from portraits import PortraitRegistry
+from assets import PortraitPack, PACK_NAME, ensure_pack, source_files
+from cards import CardCache, CardRenderer, CACHE_SIZE as CARD_CACHE_SIZE
+from storage import create_storage
+from broadcast import Broadcaster, GLOBAL_RATE
+from subscribers import SubscriberStore
+import markup
+from gamedata import GameDataStore, get_index, read_cache, write_cache
 from aiogram.client.default import DefaultBotProperties
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
-from aiohttp import web
-import threading
+from webhook import WebhookServer, MAX_IN_FLIGHT, start_metrics_server
+import metrics
+from botapi import RetryMiddleware, create_session, POOL_SIZE, KEEPALIVE, DEFAULT_TIMEOUT
+from middlewares import ApiCallCounter, CallbackMiddleware, MetricsMiddleware, ProfilingMiddleware
+from profiling import Profiler, DEFAULT_FRACTION
+from watcher import FileWatcher
+from names import NameIndex, base_name
+from buildgen import format_generated_build, generate_missing, get_engine as get_build_engine
+from callbacks import CharacterCallback, FeatureCallback, PathCallback
+from cluster import ClusterFront, WorkerSupervisor
+from locks import FileLock
 import re
-from aiogram.exceptions import TelegramBadRequest
-import random
+import hashlib
+import weakref
+import signal
+import secrets
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter, TelegramNetworkError, TelegramServerError
 import html
+from typing import NamedTuple
 
 # --- Коды игр ---
 GAME_CODES = {
@@ -27,13 +48,28 @@ GAME_CODES = {
     "ZZZ": "Zenless Zone Zero"
 }
 
-DATA_DIR = "data"
+DATA_DIR = os.getenv("DATA_DIR", "data")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+# Кэш в прежнем формате (один файл): читается, пока нет data/cache/manifest.json
 CACHE_FILE = os.path.join(DATA_DIR, "cache.json")
 CACHE_TTL_HOURS = 24
 
 # === Рассылка: файл со списком подписок ===
 SUBSCRIBERS_FILE = os.path.join(DATA_DIR, "subscribers.json")
 
+# === Журналы рассылок (для продолжения после перезапуска) ===
+BROADCASTS_DIR = os.path.join(DATA_DIR, "broadcasts")
+
+# === file_id уже загруженных в Telegram портретов ===
+PORTRAIT_IDS_FILE = os.path.join(DATA_DIR, "portrait_ids.json")
+
+# === Сжатые варианты портретов (assets.py) ===
+PORTRAITS_DIR = os.path.join(DATA_DIR, "portraits")
+
+# === Карточки билдов (cards.py) и их file_id ===
+CARDS_DIR = os.path.join(DATA_DIR, "cards")
+CARD_IDS_FILE = os.path.join(DATA_DIR, "card_ids.json")
+
 ART_DIR = "icon/character"
 art_map = {
     "Ахерон": "Acheron.png",
@@ -79,6 +115,27 @@ art_map = {
 # --- переключатель пола для картинок Первопроходца ---
 _tb_toggle = {}
 
+portrait_registry = PortraitRegistry(PORTRAIT_IDS_FILE)
+# Пока pack-файл не собран (нет Pillow и т.п.), портреты отправляются с диска как есть
+portrait_pack = PortraitPack(os.path.join(PORTRAITS_DIR, PACK_NAME))
+portraits_lock = FileLock(os.path.join(DATA_DIR, "portraits.lock"))
+
+card_renderer = CardRenderer(
+    CardCache(CARDS_DIR, int(os.getenv("CARD_CACHE_SIZE", CARD_CACHE_SIZE))),
+    workers=int(os.getenv("CARD_WORKERS", 0)),
+)
+# Путь к карточке уже содержит хэш содержимого — он же ключ file_id
+card_registry = PortraitRegistry(CARD_IDS_FILE)
+cards_lock = FileLock(os.path.join(DATA_DIR, "cards.lock"))
+prerender_lock = asyncio.Lock()
+
+def art_exists(path):
+    """Есть ли картинка: сначала в pack-файле (без обращения к диску), затем на диске."""
+    return path in portrait_pack or os.path.exists(path)
+
+# Подписчики в памяти, изменения — в журнал subscribers.json.log
+subscribers = SubscriberStore(SUBSCRIBERS_FILE)
+
 def get_art_path(character_name, art_map=art_map, art_dir=ART_DIR):
     """Возвращает путь к картинке персонажа.
     1) По словарю art_map → icon/character/<filename>
@@ -88,16 +145,15 @@ def get_art_path(character_name, art_map=art_map, art_dir=ART_DIR):
     filename = art_map.get(character_name)
     if filename:
         cand = os.path.join(art_dir, filename)
-        if os.path.exists(cand):
+        if art_exists(cand):
             return cand
     # 2. пробуем по id из characters.json
     try:
-        cache = load_cache()
-        game_data = cache["game_data"].get("Honkai: Star Rail", {})
-        char = next((c for c in game_data.get("characters", {}).values() if c.get("name") == character_name.split(" (",1)[0]), None)
+        game_data = game_store.get().game("Honkai: Star Rail") or {}
+        char = get_index(game_data).characters_by_name.get(character_name.split(" (",1)[0])
         if char:
             cand2 = os.path.join("icon", "character", f"{char['id']}.png")
-            if os.path.exists(cand2):
+            if art_exists(cand2):
                 return cand2
     except Exception:
         pass
@@ -121,11 +177,11 @@ def get_art_path(character_name, art_map=art_map, art_dir=ART_DIR):
             _tb_toggle[elem] = 1 - idx  # flip
             tb_id = pair[idx]
             cand = os.path.join("icon", "character", f"{tb_id}.png")
-            if not os.path.exists(cand):
+            if not art_exists(cand):
                 # fallback на второе
                 tb_id = pair[1-idx]
                 cand = os.path.join("icon", "character", f"{tb_id}.png")
-            if os.path.exists(cand):
+            if art_exists(cand):
                 return cand
 
     return None
@@ -136,8 +192,46 @@ API_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")
 
 logging.basicConfig(level=logging.INFO)
-bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-dp = Dispatcher(storage=MemoryStorage())
+# Пул соединений, keep-alive и таймауты по методам — в botapi.py; BOT_API_URL — свой Bot API сервер
+bot_session = create_session(
+    api_base=os.getenv("BOT_API_URL"),
+    pool_size=int(os.getenv("BOT_API_POOL_SIZE", POOL_SIZE)),
+    keepalive=float(os.getenv("BOT_API_KEEPALIVE", KEEPALIVE)),
+    timeout=float(os.getenv("BOT_API_TIMEOUT", DEFAULT_TIMEOUT)),
+)
+bot = Bot(token=API_TOKEN, session=bot_session, default=DefaultBotProperties(parse_mode="HTML"))
+# FSM-хранилище выбирается через FSM_STORAGE (sqlite по умолчанию, см. storage.py)
+dp = Dispatcher(storage=create_storage(DATA_DIR))
+# Время и ошибки каждого нажатия/команды — в /metrics; профилирование — по /profile
+profiler = Profiler(os.path.join(DATA_DIR, "profiles"))
+# Колбэки гасятся сразу, повторные нажатия той же кнопки отбрасываются (см. middlewares.py);
+# на подписку обработчик отвечает сам — текстом уведомления
+bot.session.middleware(ApiCallCounter())
+# Повторы при flood wait/5xx/сетевых ошибках — внутри счётчика, чтобы повтор не считался новым вызовом
+bot.session.middleware(RetryMiddleware())
+dp.callback_query.outer_middleware(CallbackMiddleware(answered_by_handler=("sub:",)))
+for observer in (dp.message, dp.callback_query, dp.inline_query):
+    observer.outer_middleware(MetricsMiddleware())
+    observer.outer_middleware(ProfilingMiddleware(profiler))
+
+FETCH_SECONDS = metrics.histogram("bot_fetch_seconds", "Загрузка справочника StarRailRes целиком")
+FETCH_FILES = metrics.counter("bot_fetch_files_total", "Файлы справочника по результату запроса", ["result"])
+PHOTO_SECONDS = metrics.histogram("bot_photo_send_seconds", "Отправка портрета", ["source"])
+
+# asyncio держит на задачи только слабые ссылки: фоновые задачи храним здесь,
+# а их исключения пишем в лог, иначе они пропадут молча
+_background_tasks = set()
+
+def spawn_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+def _background_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"[bot] Фоновая задача {task.get_coro().__qualname__} упала", exc_info=task.exception())
 
 # --- FSM States ---
 class BuildStates(StatesGroup):
@@ -153,19 +247,15 @@ class AdminStates(StatesGroup):
     waiting_post = State()
 
 # --- Кэширование и загрузка данных ---
+# Снимок кэша в памяти: обработчики не парсят файлы на каждое нажатие,
+# а разделы справочника читаются с диска только при первом обращении
+game_store = GameDataStore(CACHE_DIR, legacy_path=CACHE_FILE)
+
 def load_cache() -> dict:
-    if not os.path.exists(CACHE_FILE):
-        return {"last_updated": None, "game_data": {}}
-    try:
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {"last_updated": None, "game_data": {}}
+    return read_cache(CACHE_DIR, legacy_path=CACHE_FILE)
 
 def save_cache(cache: dict):
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(cache, f, ensure_ascii=False, indent=2)
+    write_cache(CACHE_DIR, cache)
 
 def is_cache_valid(cache: dict) -> bool:
     try:
@@ -176,43 +266,91 @@ def is_cache_valid(cache: dict) -> bool:
     except Exception:
         return False
 
-def fetch_all_data():
+async def fetch_all_data(previous: dict | None = None, validators: dict | None = None):
     """Скачивает справочную информацию по игре.
 
-    1. Пытается взять актуальные json-файлы из GitHub (timeout=10 s).
-    2. Если запрос упал или истёк таймаут, использует локальную копию из папки
-       «data».  Благодаря этому бот сможет запуститься даже без доступа к сети,
-       а платформа деплоя не застрянет в состоянии «Waiting for build to start».
+    1. Параллельно запрашивает json-файлы из GitHub (timeout=10 s) условными
+       запросами: неизменившиеся файлы (304) берутся из ``previous``.
+    2. Если запрос упал или истёк таймаут, использует прежний раздел кэша или
+       локальную копию из папки «data».  Благодаря этому бот сможет запуститься
+       даже без доступа к сети, а платформа деплоя не застрянет в состоянии
+       «Waiting for build to start».
+
+    Возвращает ``(data, validators, stats)``.
     """
     urls = BotConfig.GITHUB_DATA_URLS["Honkai: Star Rail"]
-    data: dict[str, dict] = {}
-    for key, url in urls.items():
-        try:
-            resp = requests.get(url, timeout=10)
-            resp.raise_for_status()
-            data[key] = resp.json()
-        except Exception as e:
-            logging.warning(f"[cache] Не удалось скачать {url}: {e}. Пытаюсь загрузить локальный {key}.json…")
-            fallback_path = os.path.join(DATA_DIR, f"{key}.json")
-            try:
-                with open(fallback_path, encoding="utf-8") as f:
-                    data[key] = json.load(f)
-            except FileNotFoundError:
-                logging.error(f"[cache] Локальный файл {fallback_path} не найден; пропускаю.")
-                data[key] = {}
-    return data
-
-def update_cache():
-    data = fetch_all_data()
+    with FETCH_SECONDS.time():
+        data, validators, stats = await fetch_sources(urls, previous, validators, fallback_dir=DATA_DIR)
+    for result in ("downloaded", "not_modified", "failed"):
+        FETCH_FILES.inc(stats[result], result=result)
+    logging.info(f"[cache] Справочник: скачано {stats['downloaded']}, без изменений {stats['not_modified']}, ошибок {stats['failed']}")
+    return data, validators, stats
+
+async def update_cache():
+    """Обновляет кэш. Вызывать через ``cache_refresher``, а не напрямую.
+
+    Если часть файлов не скачалась, сохраняет то, что удалось собрать, но не
+    сдвигает ``last_updated`` и бросает RuntimeError — координатор повторит
+    попытку после backoff.
+    """
+    # При нескольких процессах бота справочник качает один из них. Кто ждал
+    # блокировку, берёт уже записанный кэш, если тот изменился за время ожидания
+    before = game_store.get()
+    await asyncio.to_thread(cache_lock.acquire)
+    try:
+        current = game_store.get()
+        if current is not before and is_cache_valid(current.cache):
+            return current.cache
+        return await _download_cache(current.cache)
+    finally:
+        cache_lock.release()
+
+async def _download_cache(previous: dict):
+    game_name = "Honkai: Star Rail"
+    data, validators, stats = await fetch_all_data(
+        previous.get("game_data", {}).get(game_name),
+        previous.get("http_validators", {}).get(game_name),
+    )
+    complete = stats["failed"] == 0
     cache = {
-        "last_updated": datetime.now().isoformat(),
+        "last_updated": datetime.now().isoformat() if complete else previous.get("last_updated"),
         "game_data": {
-            "Honkai: Star Rail": data
+            game_name: data
+        },
+        # ETag/Last-Modified хранятся рядом с данными, которые они описывают
+        "http_validators": {
+            game_name: validators
         }
     }
-    save_cache(cache)
+    await asyncio.to_thread(save_cache, cache)
+    game_store.publish(cache)
+    schedule_fallback_refresh()
+    if not complete:
+        raise RuntimeError(f"не скачано файлов: {stats['failed']} из {len(data)}")
     return cache
 
+# Вне CACHE_DIR: write_cache удаляет оттуда всё, чего нет в манифесте
+cache_lock = FileLock(os.path.join(DATA_DIR, "cache.lock"))
+
+# Единственная точка запуска update_cache: обработчики, планировщик и /update
+# делят одно обновление, а не качают справочник каждый сам по себе
+cache_refresher = CacheRefresher(update_cache)
+
+async def get_game_data(game_name):
+    """Справочник игры из текущего снимка (stale-while-revalidate).
+
+    Устаревший кэш отдаётся сразу, а обновление запускается в фоне. Ждём
+    обновления, только если данных по игре нет совсем.
+    """
+    snapshot = game_store.get()
+    game_data = snapshot.game(game_name)
+    if not game_data:
+        await cache_refresher.refresh()
+        return game_store.get().game(game_name)
+    if not is_cache_valid(snapshot.cache):
+        cache_refresher.trigger()
+    return game_data
+
 # --- Сопоставление русских и английских имён персонажей ---
 def build_tag_map(game_data, builds):
     # tag: {"ru": ..., "en": ...}
@@ -237,91 +375,61 @@ def find_build_for_character(character, builds):
     return None
 
 # --- Связывание и поиск данных ---
+# Все поиски идут через индекс снимка (gamedata.GameDataIndex) за O(1)
 def get_elements(game_data):
-    elements = set()
-    for char in game_data["characters"].values():
-        if "path" in char and char["path"]:
-            elements.add(char["path"])
-    return sorted(elements)
+    return list(get_index(game_data).elements)
 
 def get_path_name(game_data, path_id):
-    for path in game_data["paths"].values():
-        if path["id"] == path_id:
-            return path["name"]
-    return path_id
+    return get_index(game_data).path_names.get(path_id, path_id)
 
 def get_element_name(game_data, element_id):
-    for el in game_data["elements"].values():
-        if el["id"] == element_id:
-            return el["name"]
-    return element_id
+    return get_index(game_data).element_names.get(element_id, element_id)
 
-def get_characters_by_element(game_data, element):
+def character_display_name(game_data, c):
     # Для мульти-путейных персонажей возвращаем имя с путём
-    result = []
-    for c in game_data["characters"].values():
-        if c.get("path") == element:
-            name = c["name"]
-            # Для Март 7 и Первопроходца добавляем путь в скобках
-            if name == "Март 7":
-                # Показываем путь (Охота / Сохранение)
-                path_name = get_path_name(game_data, c.get("path"))
-                name = f"{name} ({path_name})"
-            elif name == "Первопроходец" or name == "{NICKNAME}":
-                # Для Первопроходца нужна стихия
-                elem_name = get_element_name(game_data, c.get("element"))
-                name = f"Первопроходец ({elem_name})"
-            result.append(name)
-    return result
+    name = c["name"]
+    # Для Март 7 и Первопроходца добавляем путь в скобках
+    if name == "Март 7":
+        # Показываем путь (Охота / Сохранение)
+        path_name = get_path_name(game_data, c.get("path"))
+        name = f"{name} ({path_name})"
+    elif name == "Первопроходец" or name == "{NICKNAME}":
+        # Для Первопроходца нужна стихия
+        elem_name = get_element_name(game_data, c.get("element"))
+        name = f"Первопроходец ({elem_name})"
+    return name
+
+def get_characters_by_element(game_data, element):
+    return [character_display_name(game_data, c) for c in get_index(game_data).characters_by_path.get(element, [])]
+
+def get_character_buttons(game_data, element):
+    """(id, отображаемое имя) персонажей пути — для клавиатуры."""
+    return [(c.get("id"), character_display_name(game_data, c))
+            for c in get_index(game_data).characters_by_path.get(element, [])]
 
 def get_character_data(game_data, name):
-    for c in game_data["characters"].values():
-        if c.get("name") == name:
-            return c
-    return None
+    return get_index(game_data).characters_by_name.get(name)
 
 def get_relic_set_name(game_data, set_id):
-    for s in game_data["relic_sets"].values():
-        if s["id"] == set_id:
-            return s["name"]
-    return set_id
+    return get_index(game_data).relic_set_names.get(set_id, set_id)
 
 def get_planar_name(game_data, set_id):
-    for s in game_data["relic_sets"].values():
-        if s["id"] == set_id and s.get("type") == "Planar":
-            return s["name"]
-    return set_id
+    return get_index(game_data).planar_names.get(set_id, set_id)
 
 def get_cone_name(game_data, cone_id):
-    for cone in game_data["light_cones"].values():
-        if cone["id"] == cone_id:
-            return cone["name"], cone.get("rarity", "")
-    return cone_id, ""
+    return get_index(game_data).cones.get(cone_id, (cone_id, ""))
 
 def get_main_stat_name(game_data, stat_id):
-    for stat in game_data["relic_main_affixes"].values():
-        if stat["id"] == stat_id:
-            # В ru это словарь affixes, но для отображения нужен property
-            affixes = stat.get("affixes", {})
-            if affixes:
-                # Берём первый property
-                for affix in affixes.values():
-                    return affix.get("property", stat_id)
-            return stat_id
-    return stat_id
+    # В ru это словарь affixes; индекс хранит property первого из них
+    return get_index(game_data).main_stat_names.get(stat_id, stat_id)
 
 def get_sub_stat_name(game_data, stat_id):
-    for stat in game_data["relic_sub_affixes"].values():
-        if stat["id"] == stat_id:
-            affixes = stat.get("affixes", {})
-            if affixes:
-                for affix in affixes.values():
-                    return affix.get("property", stat_id)
-            return stat_id
-    return stat_id
+    return get_index(game_data).sub_stat_names.get(stat_id, stat_id)
 
 # --- Клавиатуры ---
-def game_keyboard(subscribed: bool = False):
+# Клавиатуры не зависят от пользователя, поэтому строятся заранее и отдаются
+# обработчикам по ссылке. Менять полученную разметку нельзя.
+def _build_game_keyboard(subscribed: bool):
     kb = [
         [InlineKeyboardButton(text="🎮 Honkai: Star Rail", callback_data="game:HSR")],
         [InlineKeyboardButton(text="🛠 Zenless Zone Zero (WIP)", callback_data="game:ZZZ")],
@@ -335,14 +443,25 @@ def game_keyboard(subscribed: bool = False):
 
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
-def feature_keyboard(game_key: str):
-    """Возвращает клавиатуру с функциями внутри выбранной игры."""
+_GAME_KEYBOARDS = {subscribed: _build_game_keyboard(subscribed) for subscribed in (False, True)}
+
+def game_keyboard(subscribed: bool = False):
+    return _GAME_KEYBOARDS[bool(subscribed)]
+
+def _build_feature_keyboard(game_key: str):
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📑 Билды", callback_data=f"feature:{game_key}:builds")],
-        [InlineKeyboardButton(text="🖼 Генерация карточек (WIP)", callback_data=f"feature:{game_key}:cards")],
+        [InlineKeyboardButton(text="📑 Билды", callback_data=FeatureCallback(game=game_key, feature="builds").pack())],
+        [InlineKeyboardButton(text="🖼 Генерация карточек", callback_data=FeatureCallback(game=game_key, feature="cards").pack())],
         [InlineKeyboardButton(text="⬅️ Назад", callback_data="back:home")]
     ])
 
+_FEATURE_KEYBOARDS = {code: _build_feature_keyboard(code) for code in GAME_CODES}
+
+def feature_keyboard(game_key: str):
+    """Возвращает клавиатуру с функциями внутри выбранной игры."""
+    keyboard = _FEATURE_KEYBOARDS.get(game_key)
+    return keyboard if keyboard is not None else _build_feature_keyboard(game_key)
+
 def element_keyboard(elements, game_data):
     # Эмодзи для путей
     path_emojis = {
@@ -360,20 +479,52 @@ def element_keyboard(elements, game_data):
     for el in elements:
         el_name = get_path_name(game_data, el)
         emoji = path_emojis.get(el_name, "")
-        kb.append([InlineKeyboardButton(text=f"{emoji} {el_name}", callback_data=f"element:{el}")])
+        kb.append([InlineKeyboardButton(text=f"{emoji} {el_name}", callback_data=PathCallback(path=el).pack())])
     kb.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="back:game")])
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 def character_keyboard(characters):
+    """``characters`` — пары (id StarRailRes, отображаемое имя)."""
     kb = []
-    for ch in characters:
+    for char_id, ch in characters:
         if "{NICKNAME}" in ch:
             continue
-        kb.append([InlineKeyboardButton(text=f"👤 {ch}", callback_data=f"char:{ch}")])
+        # id в справочнике числовые; на всякий случай без id остаётся прежний формат
+        data = CharacterCallback(id=int(char_id)).pack() if str(char_id).isdigit() else f"char:{ch}"
+        kb.append([InlineKeyboardButton(text=f"👤 {ch}", callback_data=data)])
     kb.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="back:element")])
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
-def build_keyboard(show_team_button: bool = False):
+class SnapshotKeyboards(NamedTuple):
+    """Клавиатуры, построенные по одному снимку справочника."""
+    elements: InlineKeyboardMarkup
+    characters: dict      # путь -> клавиатура персонажей
+
+# GameDataIndex живёт столько же, сколько снимок: после обновления кэша
+# клавиатуры строятся заново, а прежние уходят вместе со старым снимком
+_snapshot_keyboards = weakref.WeakKeyDictionary()
+
+def get_keyboards(game_data) -> SnapshotKeyboards:
+    """Все клавиатуры путей и персонажей для снимка (строятся при первом обращении)."""
+    index = get_index(game_data)
+    keyboards = _snapshot_keyboards.get(index)
+    metrics.CACHE_REQUESTS.inc(cache="keyboards", result="miss" if keyboards is None else "hit")
+    if keyboards is None:
+        elements = get_elements(game_data)
+        keyboards = SnapshotKeyboards(
+            elements=element_keyboard(elements, game_data),
+            characters={el: character_keyboard(get_character_buttons(game_data, el)) for el in elements},
+        )
+        _snapshot_keyboards[index] = keyboards
+    return keyboards
+
+def characters_keyboard_for(game_data, element):
+    keyboard = get_keyboards(game_data).characters.get(element)
+    if keyboard is None:
+        keyboard = character_keyboard(get_character_buttons(game_data, element))
+    return keyboard
+
+def _build_build_keyboard(show_team_button: bool):
     kb = []
     if show_team_button:
         kb.append([InlineKeyboardButton(text="⚔️ Отряды", callback_data="teams:show")])
@@ -381,16 +532,25 @@ def build_keyboard(show_team_button: bool = False):
     kb.append([InlineKeyboardButton(text="🏠 В начало", callback_data="back:home")])
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+_BUILD_KEYBOARDS = {show: _build_build_keyboard(show) for show in (False, True)}
+
+def build_keyboard(show_team_button: bool = False):
+    return _BUILD_KEYBOARDS[bool(show_team_button)]
+
+_TEAMS_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="⬅️ К билду", callback_data="teams:back")]
+])
+
 def teams_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅️ К билду", callback_data="teams:back")]
-    ])
+    return _TEAMS_KEYBOARD
+
+_INFO_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="💖 Поддержать автора", url="https://www.donationalerts.com/r/perpetuajdh")],
+    [InlineKeyboardButton(text="🏠 В начало", callback_data="back:home")]
+])
 
 def info_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="💖 Поддержать автора", url="https://www.donationalerts.com/r/perpetuajdh")],
-        [InlineKeyboardButton(text="🏠 В начало", callback_data="back:home")]
-    ])
+    return _INFO_KEYBOARD
 
 # --- Форматирование билда по ТЗ ---
 def format_build(character, game_data):
@@ -410,24 +570,22 @@ def format_build(character, game_data):
         if len(planars) > 1:
             msg += f"<b>Альтернатива:</b> {get_planar_name(game_data, planars[1])}\n"
     # Конусы (5★, 4★, 3★/4★)
-    cones = character.get("light_cones", [])
-    cone_5 = next((c for c in cones if get_cone_name(game_data, c)[1] == 5), None)
-    cone_4 = next((c for c in cones if get_cone_name(game_data, c)[1] == 4), None)
-    cone_3 = next((c for c in cones if get_cone_name(game_data, c)[1] == 3), None)
-    if cone_5:
-        name, _ = get_cone_name(game_data, cone_5)
-        msg += f"<b>5★ конус:</b> {name}\n"
-    if cone_4:
-        name, _ = get_cone_name(game_data, cone_4)
-        msg += f"<b>4★ конус:</b> {name}\n"
-    if cone_3:
-        name, _ = get_cone_name(game_data, cone_3)
-        msg += f"<b>3★ конус:</b> {name}\n"
-    else:
-        cones_4 = [c for c in cones if get_cone_name(game_data, c)[1] == 4]
-        if len(cones_4) > 1:
-            name, _ = get_cone_name(game_data, cones_4[1])
-            msg += f"<b>4★ конус (альтернатива):</b> {name}\n"
+    # Один проход по конусам персонажа: группируем имена по редкости
+    cones_by_rarity = {}
+    for c in character.get("light_cones", []):
+        name, rarity = get_cone_name(game_data, c)
+        cones_by_rarity.setdefault(rarity, []).append(name)
+    cones_5 = cones_by_rarity.get(5, [])
+    cones_4 = cones_by_rarity.get(4, [])
+    cones_3 = cones_by_rarity.get(3, [])
+    if cones_5:
+        msg += f"<b>5★ конус:</b> {cones_5[0]}\n"
+    if cones_4:
+        msg += f"<b>4★ конус:</b> {cones_4[0]}\n"
+    if cones_3:
+        msg += f"<b>3★ конус:</b> {cones_3[0]}\n"
+    elif len(cones_4) > 1:
+        msg += f"<b>4★ конус (альтернатива):</b> {cones_4[1]}\n"
     # Параметры реликвий (основные характеристики)
     main_stats = character.get("main_stats", {})
     if main_stats:
@@ -486,109 +644,245 @@ def format_build_full(character, game_data, build):
 
 # --- Генерация билда на основе справочника ---
 def generate_build_for_character(character, game_data):
-    # 1. Путь и элемент
-    path_id = character.get("path")
-    element_id = character.get("element")
-    path = get_path_name(game_data, path_id)
-    element = get_element_name(game_data, element_id)
-
-    # 2. Реликвии (по элементу/роли)
-    relic_sets = []
-    for relic in game_data["relic_sets"].values():
-        # Бонус на нужный элемент или универсальный бонус по роли
-        desc = " ".join(relic.get("desc", []))
-        if element in desc or path in desc or "урон" in desc or "лечение" in desc or "защита" in desc:
-            relic_sets.append(relic["id"])
-    # Сортируем по совпадению с элементом, затем по совпадению с ролью
-    relic_sets = relic_sets[:2] if relic_sets else [list(game_data["relic_sets"].keys())[0]]
-
-    # 3. Планарные украшения (ищем по универсальности или по ключевым словам)
-    planar_sets = []
-    for relic in game_data["relic_sets"].values():
-        if relic.get("type") == "Planar":
-            desc = " ".join(relic.get("desc", []))
-            if element in desc or path in desc or "урон" in desc or "лечение" in desc or "защита" in desc:
-                planar_sets.append(relic["id"])
-    planar_sets = planar_sets[:2] if planar_sets else [r["id"] for r in list(game_data["relic_sets"].values()) if r.get("type") == "Planar"][:2]
-
-    # 4. Конусы (по пути и редкости)
-    cones = [cone["id"] for cone in game_data["light_cones"].values() if cone.get("path") == path_id]
-    cones_5 = [c for c in cones if get_cone_name(game_data, c)[1] == 5]
-    cones_4 = [c for c in cones if get_cone_name(game_data, c)[1] == 4]
-    cones_3 = [c for c in cones if get_cone_name(game_data, c)[1] == 3]
-    cones = cones_5[:1] + cones_4[:1] + cones_3[:1]
-
-    # 5. Основные статы (по типу слота)
-    main_stats = {
-        "Голова": ["HPDelta"],
-        "Руки": ["AttackDelta"],
-        "Тело": ["AttackAddedRatio", "CriticalChanceBase", "CriticalDamageBase", "HealRatioBase", "StatusProbabilityBase"],
-        "Ноги": ["SpeedDelta", "AttackAddedRatio"],
-        "Сфера": [f"{element}AddedRatio", "HPAddedRatio", "AttackAddedRatio"],
-        "Канат": ["SPRatioBase", "AttackAddedRatio", "HPAddedRatio"]
-    }
-    # 6. Субстаты (универсальные)
-    sub_stats = ["CriticalChanceBase", "CriticalDamageBase", "SpeedDelta", "AttackAddedRatio", "HPAddedRatio", "StatusProbabilityBase"]
-
-    # 7. Формируем краткое сообщение
-    msg = f"<b>{character['name']}</b>\n"
-    msg += f"Путь: {path}\n"
-    msg += f"Элемент: {element}\n\n"
-    msg += f"<b>Реликвии:</b> {', '.join([get_relic_set_name(game_data, r) for r in relic_sets])}\n"
-    if planar_sets:
-        msg += f"<b>Планарные украшения:</b> {', '.join([get_relic_set_name(game_data, p) for p in planar_sets])}\n"
-    if cones:
-        cones_str = []
-        for cone in cones:
-            name, rarity = get_cone_name(game_data, cone)
-            cones_str.append(f"{name} ({rarity}★)" if rarity else name)
-        msg += f"<b>Конусы:</b> {', '.join(cones_str)}\n"
-    msg += "<b>Основные статы:</b>\n"
-    for slot, stats in main_stats.items():
-        stat_names = [get_main_stat_name(game_data, s) for s in stats]
-        msg += f"- {slot}: {', '.join(stat_names)}\n"
-    msg += "<b>Второстаты:</b> " + ", ".join([get_sub_stat_name(game_data, s) for s in sub_stats])
-    return msg.strip()
+    """Автоподбор билда по справочнику (buildgen.py) в виде HTML."""
+    return format_generated_build(get_build_engine(game_data).generate(character), game_data)
 
 # === ИНТЕГРАЦИЯ best_builds.json ===
 BEST_BUILDS_PATH = "best_builds.json"
-best_builds = []
-builds_by_character = {}
 
-# Потокобезопасная загрузка билдов
-builds_lock = threading.Lock()
+class RenderedBuild(NamedTuple):
+    """Билд, заранее отрендеренный в HTML для Telegram."""
+    build: dict
+    text: str             # подпись без отрядов
+    text_with_team: str   # подпись вместе с отрядами
+    team_text: str        # текст для кнопки «Отряды»
+    has_team: bool
+    fits_caption: bool    # text влезает в подпись к фото (1024 символа)
+
+class BuildsIndex(NamedTuple):
+    """Загруженный best_builds.json со всеми производными индексами.
+
+    Подменяется одной ссылкой (``builds_index``), поэтому обработчик, взявший
+    индекс, видит либо прежнюю версию целиком, либо новую.
+    """
+    builds: list
+    by_character: dict    # имя в нижнем регистре -> [билд]
+    rendered: dict        # тот же ключ -> [RenderedBuild]
+    version: str | None   # sha256 содержимого файла (первые 12 символов)
+    loaded_at: datetime | None
+
+EMPTY_BUILDS = BuildsIndex([], {}, {}, None, None)
+
+def render_build(build) -> RenderedBuild:
+    text = format_best_build(build, include_team=False)
+    return RenderedBuild(
+        build=build,
+        text=text,
+        text_with_team=format_best_build(build, include_team=True),
+        team_text=sanitize_caption(build.get("team_pretty", "Нет примеров отрядов.")),
+        has_team=bool(build.get("team_pretty")),
+        fits_caption=markup.fits_caption(text),
+    )
+
+def read_builds_index(path: str = BEST_BUILDS_PATH) -> BuildsIndex:
+    """Читает и проверяет файл билдов, строит индексы. Бросает ValueError/OSError."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    builds = json.loads(raw)
+    if not isinstance(builds, list):
+        raise ValueError("ожидался список билдов")
+    by_character = {}
+    rendered = {}
+    for n, build in enumerate(builds):
+        if not isinstance(build, dict) or not str(build.get("character") or "").strip():
+            raise ValueError(f"билд #{n}: нет поля character")
+        name = build["character"].strip().lower()
+        by_character.setdefault(name, []).append(build)
+        rendered.setdefault(name, []).append(render_build(build))
+    return BuildsIndex(builds, by_character, rendered, hashlib.sha256(raw).hexdigest()[:12], datetime.now())
+
+builds_index = EMPTY_BUILDS
+
 def load_best_builds():
-    global best_builds, builds_by_character
-    with builds_lock:
+    """Первая загрузка при старте: без файла бот работает с пустым списком."""
+    global builds_index
+    try:
+        builds_index = read_builds_index(BEST_BUILDS_PATH)
+        logging.info(f"Загружено {len(builds_index.builds)} билдов из {BEST_BUILDS_PATH} (версия {builds_index.version})")
+    except Exception as e:
+        logging.warning(f"Не удалось загрузить {BEST_BUILDS_PATH}: {e}")
+
+async def reload_best_builds() -> bool:
+    """Перечитывает файл вне event loop. Невалидный файл не заменяет загруженные билды."""
+    global builds_index
+    try:
+        new_index = await asyncio.to_thread(read_builds_index, BEST_BUILDS_PATH)
+    except Exception as e:
+        logging.warning(f"[builds] {BEST_BUILDS_PATH} не загружен, остаётся версия {builds_index.version}: {e}")
+        return False
+    builds_index = new_index
+    logging.info(f"[builds] Загружена версия {new_index.version}: {len(new_index.builds)} билдов")
+    spawn_background(prerender_cards(new_index))
+    schedule_fallback_refresh()
+    return True
+
+# Изменения best_builds.json подхватываются без перезапуска
+builds_watcher = FileWatcher(BEST_BUILDS_PATH, reload_best_builds)
+
+def card_source(build):
+    """(билд, портрет, хэш портрета) — аргументы CardRenderer.render."""
+    art_path = get_art_path(build["character"].strip())
+    if not art_path or not os.path.exists(art_path):
+        return build, None, None
+    return build, art_path, portrait_registry.content_hash(art_path)
+
+async def prerender_cards(index: BuildsIndex | None = None):
+    """Дорисовывает карточки, которых нет в кэше (после загрузки best_builds.json)."""
+    if not card_renderer.available:
+        return
+    # Внутри процесса — один проход за раз (следующий запустит новая перезагрузка билдов);
+    # в кластере рисует один процесс, остальные найдут готовые файлы в кэше
+    if prerender_lock.locked() or not cards_lock.acquire(blocking=False):
+        return
+    async with prerender_lock:
         try:
-            with open(BEST_BUILDS_PATH, encoding="utf-8") as f:
-                best_builds = json.load(f)
-            builds_by_character = {}
-            for build in best_builds:
-                name = build["character"].strip().lower()
-                builds_by_character.setdefault(name, []).append(build)
-            logging.info(f"Загружено {len(best_builds)} билдов из {BEST_BUILDS_PATH}")
+            index = index or builds_index
+            sources = [card_source(rendered[0].build) for rendered in index.rendered.values()]
+            drawn = await card_renderer.prerender(sources)
+            if drawn:
+                logging.info(f"[cards] Нарисовано карточек: {drawn} из {len(sources)}")
         except Exception as e:
-            logging.warning(f"Не удалось загрузить {BEST_BUILDS_PATH}: {e}")
-            best_builds = []
-            builds_by_character = {}
+            logging.warning(f"[cards] Ошибка при подготовке карточек: {e}")
+        finally:
+            cards_lock.release()
 
-# Загружаем при старте
-load_best_builds()
+def character_aliases(index: BuildsIndex, game_data) -> dict:
+    """Ключ билда → другие имена персонажа.
 
-def get_builds_for_character(name):
+    Тег StarRailRes, английское имя из файла портрета в art_map и другие
+    написания, ведущие на тот же файл («Хохо»/«Хуохуо»).
+    """
+    spellings = {}
+    for name, filename in art_map.items():
+        spellings.setdefault(filename, []).append(name)
+    characters = get_index(game_data).characters_by_name if game_data else {}
+    aliases = {}
+    for key, builds in index.by_character.items():
+        name = builds[0]["character"].strip()
+        found = []
+        filename = art_map.get(name) or art_map.get(base_name(name))
+        if filename:
+            found.append(os.path.splitext(filename)[0])
+            found.extend(spellings[filename])
+        char = characters.get(base_name(name))
+        if char and char.get("tag"):
+            found.append(char["tag"])
+        aliases[key] = found
+    return aliases
+
+# (индекс билдов, поколение снимка справочника, NameIndex)
+_name_index_cache = (None, None, None)
+
+def get_name_index(index: BuildsIndex | None = None) -> NameIndex:
+    """Индекс имён; перестраивается, когда меняются билды или справочник."""
+    global _name_index_cache
+    if index is None:
+        index = builds_index
+    snapshot = game_store.get()
+    cached_index, generation, name_index = _name_index_cache
+    stale = cached_index is not index or generation != snapshot.generation
+    metrics.CACHE_REQUESTS.inc(cache="name_index", result="miss" if stale else "hit")
+    if stale:
+        name_index = NameIndex(character_aliases(index, snapshot.game("Honkai: Star Rail")))
+        _name_index_cache = (index, snapshot.generation, name_index)
+    return name_index
+
+# (индекс билдов, поколение снимка справочника, {id персонажа: HTML}, BulkReport)
+_fallback_cache = (None, None, {}, None)
+FALLBACK_NOTE = "\n\n<i>Билда пока нет в нашей базе — это автоматический подбор по описаниям комплектов и конусов.</i>"
+
+# Пересборкой занимается только refresh_fallback_builds; обработчики лишь читают кортеж
+_fallback_lock = asyncio.Lock()
+_fallback_task = None
+
+def _generate_fallback_builds(index: BuildsIndex, name_index: NameIndex, game_data):
+    """Подбор и форматирование для персонажей без билда (выполняется в потоке)."""
+    def has_build(c):
+        name = character_display_name(game_data, c)
+        return name.strip().lower() in index.by_character or name_index.lookup(name) is not None
+
+    builds, report = generate_missing(game_data, has_build)
+    texts = {char_id: format_generated_build(build, game_data) + FALLBACK_NOTE for char_id, build in builds.items()}
+    return texts, report
+
+async def refresh_fallback_builds(force: bool = False):
+    """Пересобирает автоподобранные билды, если сменились билды или справочник. Возвращает BulkReport."""
+    global _fallback_cache
+    async with _fallback_lock:
+        index = builds_index
+        snapshot = game_store.get()
+        cached_index, generation, _, report = _fallback_cache
+        if not force and cached_index is index and generation == snapshot.generation:
+            return report
+        game_data = snapshot.game("Honkai: Star Rail") or {}
+        if not game_data:
+            return None
+        # NameIndex собирается здесь, чтобы поток не трогал _name_index_cache
+        name_index = get_name_index(index)
+        texts, report = await asyncio.to_thread(_generate_fallback_builds, index, name_index, game_data)
+        _fallback_cache = (index, snapshot.generation, texts, report)
+    logging.info(f"[buildgen] Автоподбор: {report.generated} из {report.characters} персонажей, "
+                 f"индексы {report.index_ms:.1f} мс, подбор {report.generate_ms:.1f} мс")
+    return report
+
+def schedule_fallback_refresh():
+    global _fallback_task
+    if _fallback_task is None or _fallback_task.done():
+        _fallback_task = spawn_background(refresh_fallback_builds())
+
+def get_fallback_build(char_name, char_data: dict | None = None):
+    """HTML автоподобранного билда или None.
+
+    Только читает кэш: устаревший отдаётся как есть, а пересборка запускается в фоне.
+    """
+    cached_index, generation, texts, _ = _fallback_cache
+    snapshot = game_store.get()
+    stale = cached_index is not builds_index or generation != snapshot.generation
+    metrics.CACHE_REQUESTS.inc(cache="fallback_builds", result="miss" if stale else "hit")
+    if stale:
+        schedule_fallback_refresh()
+    if char_data is None:
+        game_data = snapshot.game("Honkai: Star Rail") or {}
+        char_data = get_character_data(game_data, base_name(char_name)) if game_data else None
+    if not char_data:
+        return None
+    return texts.get(str(char_data.get("id")))
+
+def find_character_key(name, index: BuildsIndex | None = None):
+    """Ключ индекса билдов для имени из кнопки или None."""
+    if index is None:
+        index = builds_index
     key = name.strip().lower()
-    builds = builds_by_character.get(key)
-    if builds:
-        return builds
-
-    # --- Фолбэк для вариаций Первопроходца и близких имён ---
-    base = key.split(" (", 1)[0]
-    candidates = [v for k,v in builds_by_character.items() if k.startswith(base)]
-    if candidates:
-        # flatten and return first list (they are already list per key)
-        return candidates[0]
-    return []
+    if key in index.by_character:
+        return key
+    # Алиасы, другое написание, вариации Первопроходца и Март 7 (имя без скобок)
+    return get_name_index(index).lookup(name)
+
+def get_builds_for_character(name):
+    index = builds_index
+    key = find_character_key(name, index)
+    return index.by_character.get(key, []) if key else []
+
+def get_rendered_builds(name):
+    """Готовые тексты билдов персонажа (без повторного форматирования)."""
+    index = builds_index
+    key = find_character_key(name, index)
+    return index.rendered.get(key, []) if key else []
+
+def get_rendered_build_by_key(key):
+    """Первый готовый билд по ключу из состояния FSM или None."""
+    rendered = builds_index.rendered.get(key) if key else None
+    return rendered[0] if rendered else None
 
 def format_best_build(build, include_team: bool = True):
     # Заголовок: имя, редкость, путь, элемент
@@ -600,23 +894,10 @@ def format_best_build(build, include_team: bool = True):
     path_emoji = "🛤️"
     element_emoji = "🌪️"
     rarity_emoji = "⭐️"
+    name, rarity, path, element = (html.escape(str(v), quote=False) for v in (name, rarity, path, element))
     header = f"<b>{name}</b> | {rarity_emoji} <b>{rarity}</b> | {path_emoji} <b>{path}</b> | {element_emoji} <b>{element}</b>"
-    def to_html(text):
-        if not text:
-            return ""
-        # Жирный: *текст* → <b>текст</b>
-        text = re.sub(r'\*(.*?)\*', r'<b>\1</b>', text)
-        # Курсив: _текст_ → <i>текст</i>, только если ровно по одному подчёркиванию с каждой стороны и не двойные
-        text = re.sub(r'(?<!_)_(?!_)([^_]+?)(?<!_)_(?!_)', r'<i>\1</i>', text)
-        # Убрать двойные подчёркивания в начале/конце (например, __Имя_ → <i>Имя</i>)
-        text = re.sub(r'__([^_]+)_', r'<i>\1</i>', text)
-        # Зачёркнутый: ~текст~ → текст
-        text = re.sub(r'~(.*?)~', r' \1 ', text)
-        # Код: ```код``` → <code>код</code>
-        text = re.sub(r'```(.*?)```', r'<code>\1</code>', text, flags=re.DOTALL)
-        # Ссылки: [текст](url) → <a href="url">текст</a>
-        text = re.sub(r'\[(.*?)\]\((https?://[^\s]+)\)', r'<a href="\2">\1</a>', text)
-        return text
+    # *жирный*, _курсив_, ```код```, ссылки → HTML за один проход (см. markup.py)
+    to_html = markup.to_html
     parts = [
         header,
         to_html(build.get("best_relic_pretty", "")),
@@ -637,38 +918,32 @@ def format_best_build(build, include_team: bool = True):
 # === Helper: sanitize caption for Telegram ===
 def sanitize_caption(text: str) -> str:
     """Готовит текст для отправки в подписи Telegram.
-    1. Экранирует случайные символы «<» перед цифрами/процентами, чтобы Telegram не
-       пытался распознать их как HTML-теги (ошибка Unsupported start tag "95").
-    2. Сохраняет допустимую HTML-разметку (<b>, <i>,  , <code>, <a>).
+    1. Экранирует случайные «<», «>» и «&», чтобы Telegram не пытался распознать
+       их как HTML-теги (ошибка Unsupported start tag "95").
+    2. Сохраняет допустимую HTML-разметку (<b>, <i>, <code>, <a> …) и
+       закрывает незакрытые теги.
     """
-    # & заменяем в первую очередь, чтобы не испортить уже экранированные последовательности
-    text = text.replace("&lt;", "<").replace("&gt;", ">")  # откатываем двойное экранирование, если было
-    # <число  / <%  / <±  → &lt;...
-    text = re.sub(r"<(\d)" , r"&lt;\1", text)
-    text = re.sub(r"<%", "&lt;%", text)
-    # Аналогично для >, но только если перед ней цифра или % без пробела
-    text = re.sub(r"(\d)>", r"\1&gt;", text)
-    text = re.sub(r"%>", "%&gt;", text)
-    return text
+    return markup.sanitize_html(text)
+
+# Загружаем при старте (после определения функций форматирования)
+load_best_builds()
 
 # --- FSM-логика через инлайн-кнопки ---
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     await state.clear()
-    subs = load_subscribers()
     await message.answer(
         "<b>Привет, я Honkai Helper!</b>\nЯ помогу тебе подобрать билд на нужного тебе персонажа!\nВыберите игру:",
-        reply_markup=game_keyboard(message.chat.id in subs)
+        reply_markup=game_keyboard(message.chat.id in subscribers)
     )
     await state.set_state(BuildStates.choose_game)
 
 @dp.message(Command("cancel"))
 async def cmd_cancel(message: types.Message, state: FSMContext):
     await state.clear()
-    subs = load_subscribers()
     await message.answer(
         "Диалог сброшен.\nВыберите игру:",
-        reply_markup=game_keyboard(message.chat.id in subs)
+        reply_markup=game_keyboard(message.chat.id in subscribers)
     )
     await state.set_state(BuildStates.choose_game)
 
@@ -684,75 +959,101 @@ async def cb_choose_game(callback: types.CallbackQuery, state: FSMContext):
     )
     await state.set_state(BuildStates.choose_feature)
 
+@dp.callback_query(FeatureCallback.filter())
+async def cb_choose_feature(callback: types.CallbackQuery, callback_data: FeatureCallback, state: FSMContext):
+    await choose_feature(callback, state, callback_data.game, callback_data.feature)
+
 @dp.callback_query(F.data.startswith("feature:"))
-async def cb_choose_feature(callback: types.CallbackQuery, state: FSMContext):
-    """Обработка выбора функции внутри игры."""
+async def cb_choose_feature_legacy(callback: types.CallbackQuery, state: FSMContext):
     parts = callback.data.split(":", 2)  # feature:<code>:<feat>
     if len(parts) < 3:
-        await callback.answer()
         return
-    _prefix, game_code, feat = parts
+    await choose_feature(callback, state, parts[1], parts[2])
+
+async def choose_feature(callback: types.CallbackQuery, state: FSMContext, game_code: str, feat: str):
+    """Обработка выбора функции внутри игры."""
     game_name = GAME_CODES.get(game_code, game_code)
 
-    if feat == "builds":
+    if feat in ("builds", "cards"):
         if game_code == "ZZZ":
             await safe_edit_text(callback.message, "Функция в разработке. Пожалуйста, загляните позже!", reply_markup=feature_keyboard(game_code))
             return
-        # Загружаем данные и переходим к выбору пути
-        cache = load_cache()
-        if not is_cache_valid(cache):
-            cache = update_cache()
-        game_data = cache["game_data"].get(game_name)
+        if feat == "cards" and not card_renderer.available:
+            await safe_edit_text(callback.message, "Генерация карточек сейчас недоступна.", reply_markup=feature_keyboard(game_code))
+            return
+        # Загружаем данные и переходим к выбору пути; карточка или текст — решается по feature
+        game_data = await get_game_data(game_name)
         if not game_data:
             await callback.message.edit_text("Данные по игре не найдены. Попробуйте позже.")
             return
-        elements = get_elements(game_data)
-        await state.update_data(game=game_name)
+        await state.update_data(game=game_name, feature=feat)
         await callback.message.edit_text(
             "<b>Выберите путь (элемент):</b>",
-            reply_markup=element_keyboard(elements, game_data)
+            reply_markup=get_keyboards(game_data).elements
         )
         await state.set_state(BuildStates.choose_element)
     else:
         # Любая другая функция пока в разработке
         await safe_edit_text(callback.message, "Функция в разработке. Пожалуйста, загляните позже!", reply_markup=feature_keyboard(game_code))
 
+@dp.callback_query(PathCallback.filter())
+async def cb_choose_element(callback: types.CallbackQuery, callback_data: PathCallback, state: FSMContext):
+    await choose_element(callback, state, callback_data.path)
+
 @dp.callback_query(F.data.startswith("element:"))
-async def cb_choose_element(callback: types.CallbackQuery, state: FSMContext):
+async def cb_choose_element_legacy(callback: types.CallbackQuery, state: FSMContext):
+    await choose_element(callback, state, callback.data.split(":", 1)[1])
+
+async def choose_element(callback: types.CallbackQuery, state: FSMContext, element: str):
     data = await state.get_data()
     game = data.get("game")
-    cache = load_cache()
-    game_data = cache["game_data"].get(game)
-    element = callback.data.split(":", 1)[1]
-    characters = get_characters_by_element(game_data, element)
+    game_data = game_store.get().game(game)
     await state.update_data(element=element)
     await callback.message.edit_text(
         f"<b>Выберите персонажа ({get_path_name(game_data, element)}):</b>",
-        reply_markup=character_keyboard(characters)
+        reply_markup=characters_keyboard_for(game_data, element)
     )
     await state.set_state(BuildStates.choose_character)
 
+@dp.callback_query(CharacterCallback.filter())
+async def cb_choose_character(callback: types.CallbackQuery, callback_data: CharacterCallback, state: FSMContext):
+    data_state = await state.get_data()
+    game_data = game_store.get().game(data_state.get("game") or GAME_CODES["HSR"]) or {}
+    char_data = get_index(game_data).characters_by_id.get(str(callback_data.id)) if game_data else None
+    if char_data is None:
+        await callback.message.edit_text("Персонаж не найден, выберите его заново.", reply_markup=build_keyboard())
+        return
+    if data_state.get("feature") == "cards":
+        await show_card(callback, state, character_display_name(game_data, char_data))
+        return
+    await show_character(callback, state, character_display_name(game_data, char_data), char_data)
+
 @dp.callback_query(F.data.startswith("char:"))
-async def cb_choose_character(callback: types.CallbackQuery, state: FSMContext):
+async def cb_choose_character_legacy(callback: types.CallbackQuery, state: FSMContext):
     char_name = callback.data.split(":", 1)[1]
-    builds = get_builds_for_character(char_name)
-    if builds:
-        # Используем первый найденный билд
-        build = builds[0]
-        build_text_raw = format_best_build(build, include_team=False)
-        build_text = sanitize_caption(build_text_raw)
+    if (await state.get_data()).get("feature") == "cards":
+        await show_card(callback, state, char_name)
+        return
+    await show_character(callback, state, char_name)
+
+async def show_character(callback: types.CallbackQuery, state: FSMContext, char_name: str, char_data: dict | None = None):
+    rendered = get_rendered_builds(char_name)
+    if rendered:
+        # Используем первый найденный билд, тексты уже готовы
+        rendered = rendered[0]
+        build_text = rendered.text
 
         # Пытаемся найти и отправить изображение персонажа вместе с билдом
         art_path = get_art_path(char_name)
         # Fallback: пробуем получить портрет из локального StarRailRes, если мапы нет
-        if (not art_path) or (not os.path.exists(art_path)):
+        if (not art_path) or (not art_exists(art_path)):
             try:
                 # Берём данные игры из кэша для поиска пути к портрету
-                data_state = await state.get_data()
-                game_key = data_state.get("game")
-                cache = load_cache()
-                game_data = cache["game_data"].get(game_key, {}) if cache else {}
-                char_data = get_character_data(game_data, char_name.split(" (", 1)[0]) if game_data else None
+                if char_data is None:
+                    data_state = await state.get_data()
+                    game_key = data_state.get("game")
+                    game_data = game_store.get().game(game_key) or {}
+                    char_data = get_character_data(game_data, char_name.split(" (", 1)[0]) if game_data else None
                 if char_data and char_data.get("portrait"):
                     candidate = os.path.join("StarRailRes-master", char_data["portrait"])
                     if os.path.exists(candidate):
@@ -760,19 +1061,24 @@ async def cb_choose_character(callback: types.CallbackQuery, state: FSMContext):
             except Exception:
                 art_path = None
 
-        if art_path and os.path.exists(art_path):
-            photo = FSInputFile(art_path)
-            try:
-                await bot.send_photo(
-                    chat_id=callback.message.chat.id,
-                    photo=photo,
-                    caption=build_text,
-                    reply_markup=build_keyboard(show_team_button=bool(build.get("team_pretty")))
-                )
-            except TelegramBadRequest:
+        if art_path and art_exists(art_path):
+            sent = False
+            # Длину подписи знаем заранее — не тратим запрос, который Telegram отклонит
+            if rendered.fits_caption:
+                try:
+                    await send_portrait(
+                        callback.message.chat.id,
+                        art_path,
+                        caption=build_text,
+                        reply_markup=build_keyboard(show_team_button=rendered.has_team)
+                    )
+                    sent = True
+                except TelegramBadRequest:
+                    pass
+            if not sent:
                 # Если подпись слишком длинная или другая HTML-ошибка – отправляем раздельно
-                await bot.send_photo(chat_id=callback.message.chat.id, photo=photo)
-                await bot.send_message(chat_id=callback.message.chat.id, text=build_text, reply_markup=build_keyboard(show_team_button=bool(build.get("team_pretty"))))
+                await send_portrait(callback.message.chat.id, art_path)
+                await bot.send_message(chat_id=callback.message.chat.id, text=build_text, reply_markup=build_keyboard(show_team_button=rendered.has_team))
             # Удаляем предыдущее сообщение с кнопками, чтобы не дублировать интерфейс
             try:
                 await callback.message.delete()
@@ -780,20 +1086,75 @@ async def cb_choose_character(callback: types.CallbackQuery, state: FSMContext):
                 pass
         else:
             # Если картинку не нашли — выводим текст как раньше
-            await callback.message.edit_text(build_text, reply_markup=build_keyboard(show_team_button=bool(build.get("team_pretty"))))
+            await callback.message.edit_text(build_text, reply_markup=build_keyboard(show_team_button=rendered.has_team))
         # Сохраняем тексты в state для быстрого доступа к отрядам и билду
-        await state.update_data(build_text=build_text, team_text=sanitize_caption(build.get("team_pretty", "Нет примеров отрядов.")))
+        # В состоянии храним только ключ персонажа: тексты берутся из кэша рендеринга
+        await state.update_data(char_key=find_character_key(char_name))
+        return
+    fallback = get_fallback_build(char_name, char_data)
+    if fallback:
+        await callback.message.edit_text(fallback, reply_markup=build_keyboard())
         return
     await callback.message.edit_text("Приносим извинения, билд не был обнаружен в нашей базе данных! Ожидайте его появления в боте!", reply_markup=build_keyboard())
 
+async def show_card(callback: types.CallbackQuery, state: FSMContext, char_name: str):
+    """Карточка билда картинкой (см. cards.py); рисуется в пуле процессов или берётся из кэша."""
+    rendered = get_rendered_builds(char_name)
+    if not rendered:
+        await callback.message.edit_text("Приносим извинения, билд не был обнаружен в нашей базе данных! Ожидайте его появления в боте!", reply_markup=build_keyboard())
+        return
+    rendered = rendered[0]
+    try:
+        card_path = await card_renderer.render(*card_source(rendered.build))
+    except Exception as e:
+        logging.warning(f"[cards] Не удалось нарисовать карточку {char_name}: {e}")
+        await safe_edit_text(callback.message, "Не удалось нарисовать карточку, попробуйте позже.", reply_markup=build_keyboard())
+        return
+    await send_card(
+        callback.message.chat.id,
+        card_path,
+        caption=f"<b>{html.escape(rendered.build['character'])}</b>",
+        reply_markup=build_keyboard(show_team_button=rendered.has_team),
+    )
+    try:
+        await callback.message.delete()
+    except Exception:
+        pass
+    await state.update_data(char_key=find_character_key(char_name))
+
+# --- Inline-режим: @бот имя ---
+INLINE_RESULTS = 20
+
+@dp.inline_query()
+async def inline_search(query: types.InlineQuery):
+    """Билды по имени в любом чате, без перехода по меню."""
+    index = builds_index
+    results = []
+    for key in get_name_index(index).search(query.query, limit=INLINE_RESULTS):
+        rendered = index.rendered[key][0]
+        analytics = rendered.build.get("analytics", {})
+        text = rendered.text_with_team if markup.fits_message(rendered.text_with_team) else rendered.text
+        results.append(InlineQueryResultArticle(
+            id=hashlib.sha1(f"{index.version}:{key}".encode()).hexdigest(),
+            title=rendered.build["character"],
+            description=" | ".join(str(v) for v in (analytics.get("path"), analytics.get("element")) if v) or None,
+            input_message_content=InputTextMessageContent(message_text=text, parse_mode="HTML"),
+        ))
+    await query.answer(results, cache_time=300)
+
+# --- Ошибки Bot API, оставшиеся после повторов ---
+@dp.errors(ExceptionTypeFilter(TelegramNetworkError, TelegramServerError, TelegramRetryAfter))
+async def on_bot_api_unavailable(event: ErrorEvent):
+    """Telegram недоступен или просит подождать дольше MAX_FLOOD_WAIT: апдейт теряется, но без трейсбека."""
+    logging.warning(f"[bot-api] Апдейт {event.update.update_id} не обработан: {event.exception!r}")
+
 # --- Навигация назад ---
 @dp.callback_query(F.data == "back:game")
 async def cb_back_game(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
-    subs = load_subscribers()
     await callback.message.edit_text(
         "<b>Привет, я Honkai Helper!</b>\nЯ помогу тебе подобрать билд на нужного тебе персонажа!\nВыберите игру:",
-        reply_markup=game_keyboard(callback.message.chat.id in subs)
+        reply_markup=game_keyboard(callback.message.chat.id in subscribers)
     )
     await state.set_state(BuildStates.choose_game)
 
@@ -801,19 +1162,13 @@ async def cb_back_game(callback: types.CallbackQuery, state: FSMContext):
 async def cb_back_element(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     game = data.get("game")
-    cache = load_cache()
-    game_data = cache["game_data"].get(game)
-    if not game_data:
-        # Попытка восстановить кэш
-        cache = update_cache()
-        game_data = cache["game_data"].get(game)
+    game_data = await get_game_data(game)
     if not game_data:
         await safe_edit_text(callback.message, "Ошибка загрузки данных, попробуйте позже.")
         return
-    elements = get_elements(game_data)
     await callback.message.edit_text(
         "<b>Выберите путь (элемент):</b>",
-        reply_markup=element_keyboard(elements, game_data)
+        reply_markup=get_keyboards(game_data).elements
     )
     await state.set_state(BuildStates.choose_element)
 
@@ -822,31 +1177,24 @@ async def cb_back_char(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     game = data.get("game")
     element = data.get("element")
-    cache = load_cache()
-    game_data = cache["game_data"].get(game)
-    if not game_data:
-        # Попытка восстановить кэш
-        cache = update_cache()
-        game_data = cache["game_data"].get(game)
+    game_data = await get_game_data(game)
     if not game_data:
         await safe_edit_text(callback.message, "Ошибка загрузки данных, попробуйте позже.")
         return
-    characters = get_characters_by_element(game_data, element)
     await safe_edit_text(
         callback.message,
         f"<b>Выберите персонажа ({get_path_name(game_data, element)}):</b>",
-        reply_markup=character_keyboard(characters)
+        reply_markup=characters_keyboard_for(game_data, element)
     )
     await state.set_state(BuildStates.choose_character)
 
 @dp.callback_query(F.data == "back:home")
 async def cb_back_home(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
-    subs = load_subscribers()
     await safe_edit_text(
         callback.message,
         "<b>Привет, я Honkai Helper!</b>\nЯ помогу тебе подобрать билд на нужного тебе персонажа!\nВыберите игру:",
-        reply_markup=game_keyboard(callback.message.chat.id in subs)
+        reply_markup=game_keyboard(callback.message.chat.id in subscribers)
     )
 
 @dp.callback_query(F.data == "info:main")
@@ -869,9 +1217,8 @@ async def cb_info_main(callback: types.CallbackQuery, state: FSMContext):
 
 @dp.callback_query(F.data == "sub:subscribe")
 async def cb_subscribe(callback: types.CallbackQuery):
-    subs = load_subscribers()
-    subs.add(callback.message.chat.id)
-    save_subscribers(subs)
+    # Журнал пишется с fsync под файловой блокировкой — не в event loop
+    await asyncio.to_thread(subscribers.add, callback.message.chat.id)
     await callback.answer("Вы подписались на рассылку!", show_alert=False)
     # Обновляем клавиатуру
     try:
@@ -881,9 +1228,8 @@ async def cb_subscribe(callback: types.CallbackQuery):
 
 @dp.callback_query(F.data == "sub:unsubscribe")
 async def cb_unsubscribe(callback: types.CallbackQuery):
-    subs = load_subscribers()
-    subs.discard(callback.message.chat.id)
-    save_subscribers(subs)
+    # Журнал пишется с fsync под файловой блокировкой — не в event loop
+    await asyncio.to_thread(subscribers.discard, callback.message.chat.id)
     await callback.answer("Вы отписались от рассылки.", show_alert=False)
     try:
         await callback.message.edit_reply_markup(reply_markup=game_keyboard(False))
@@ -906,29 +1252,141 @@ async def admin_broadcast(message: types.Message, state: FSMContext):
         await message.reply("Нет прав.")
         return
 
-    subs = load_subscribers()
+    # Подписки могли прийти в другие процессы бота (WEBHOOK_WORKERS)
+    await asyncio.to_thread(subscribers.reload)
+    subs = subscribers.snapshot()
     if not subs:
         await message.reply("Нет подписчиков для рассылки.")
         await state.clear()
         return
 
-    success = 0
-    for chat_id in subs:
-        try:
-            # Копируем исходное сообщение во все чаты — так сохраняются все медиа и форматирование
-            await bot.copy_message(chat_id=chat_id, from_chat_id=message.chat.id, message_id=message.message_id)
-            success += 1
-        except Exception:
-            pass
-
-    await message.reply(f"Рассылка завершена. Успешно отправлено: {success}/{len(subs)}")
+    # Копируем исходное сообщение во все чаты — так сохраняются все медиа и форматирование.
+    # Рассылка идёт в фоне, ход виден в статусном сообщении
+    await broadcaster.start(message.chat.id, message.message_id, subs, status_chat_id=message.chat.id)
     await state.clear()
 
+# Чаты, где бот заблокирован или которых больше нет, отписываются сами
+broadcaster = Broadcaster(
+    bot,
+    BROADCASTS_DIR,
+    on_blocked=subscribers.discard,
+    rate=float(os.getenv("BROADCAST_RATE", GLOBAL_RATE)),
+)
+
 # --- Автообновление данных ---
+@dp.message(Command("update"))
+async def cmd_update(message: types.Message):
+    if not ADMIN_CHAT_ID or str(message.from_user.id) != str(ADMIN_CHAT_ID):
+        await message.reply("Команда доступна только администратору.")
+        return
+    if await cache_refresher.refresh(force=True):
+        await message.reply("Кэш обновлён.")
+    else:
+        await message.reply("Не удалось обновить кэш, используется прежняя версия.")
+
+@dp.message(Command("builds_info"))
+async def cmd_builds_info(message: types.Message):
+    if not ADMIN_CHAT_ID or str(message.from_user.id) != str(ADMIN_CHAT_ID):
+        await message.reply("Команда доступна только администратору.")
+        return
+    index = builds_index
+    if index.version is None:
+        await message.reply(f"Билды не загружены: проверьте {html.escape(BEST_BUILDS_PATH)}.")
+        return
+    await message.reply(
+        f"<b>Билды:</b> версия <code>{index.version}</code>\n"
+        f"Загружены: {index.loaded_at:%Y-%m-%d %H:%M:%S}\n"
+        f"Билдов: {len(index.builds)}, персонажей: {len(index.by_character)}\n"
+        f"Слежение за файлом: {builds_watcher.backend}"
+    )
+
+@dp.message(Command("generate_builds"))
+async def cmd_generate_builds(message: types.Message):
+    """Заново подбирает билды всем персонажам без записи в best_builds.json и присылает отчёт."""
+    if not ADMIN_CHAT_ID or str(message.from_user.id) != str(ADMIN_CHAT_ID):
+        await message.reply("Команда доступна только администратору.")
+        return
+    report = await refresh_fallback_builds(force=True)
+    if report is None:
+        await message.reply("Справочник StarRailRes не загружен.")
+        return
+    await message.reply(
+        f"<b>Автоподбор билдов</b>\n"
+        f"Персонажей в справочнике: {report.characters}, без билда: {report.generated}\n"
+        f"Индексы описаний: {report.index_ms:.1f} мс\n"
+        f"Подбор: {report.generate_ms:.1f} мс"
+        f" ({report.generate_ms / max(report.generated, 1):.2f} мс на персонажа)"
+    )
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message):
+    """/profile on [доля] [mem] | off | status — выборочное профилирование апдейтов."""
+    if not ADMIN_CHAT_ID or str(message.from_user.id) != str(ADMIN_CHAT_ID):
+        await message.reply("Команда доступна только администратору.")
+        return
+    args = (message.text or "").split()[1:]
+    action = args[0].lower() if args else "status"
+    if action == "on":
+        try:
+            fraction = float(args[1]) if len(args) > 1 and args[1] != "mem" else DEFAULT_FRACTION
+        except ValueError:
+            await message.reply("Использование: /profile on [доля 0..1] [mem]")
+            return
+        profiler.enable(fraction, memory="mem" in args[1:])
+        await message.reply(f"Профилирование включено: {profiler.fraction:.0%} апдейтов"
+                            f"{', с tracemalloc' if profiler.memory else ''}. Профили: {html.escape(profiler.directory)}")
+        return
+    if action == "off":
+        profiler.disable()
+    lines = [f"Профилирование: {'включено' if profiler.enabled else 'выключено'}, профилей: {profiler.sampled}"]
+    for elapsed_ms, label, path in profiler.slowest():
+        lines.append(f"{elapsed_ms:8.1f} мс  {html.escape(label)}  <code>{html.escape(os.path.basename(path))}</code>")
+    await message.reply("\n".join(lines))
+
 async def auto_update_cache():
-    while True:
-        update_cache()
-        await asyncio.sleep(60 * 60 * 24)
+    """Планировщик: проверяет свежесть кэша и обновляет его через cache_refresher."""
+    await cache_refresher.run_scheduler(lambda: not is_cache_valid(game_store.get().cache))
+
+async def prepare_cache():
+    """При старте ждём обновления, только если кэша нет совсем; устаревший обновляется в фоне."""
+    snapshot = game_store.get()
+    if is_cache_valid(snapshot.cache):
+        print("[bot] Кэш валиден, запуск бота...")
+    elif not snapshot.game("Honkai: Star Rail"):
+        print("[bot] Кэш пуст, обновляю...")
+        await cache_refresher.refresh()
+    else:
+        print("[bot] Кэш устарел, обновляю в фоне...")
+        cache_refresher.trigger()
+    spawn_background(auto_update_cache())
+
+def _build_portraits():
+    """Пересобирает pack-файл портретов, если изменились исходники (в потоке)."""
+    # Воркеры кластера стартуют одновременно — собирает один, остальные ждут
+    with portraits_lock:
+        return ensure_pack(source_files(ART_DIR), PORTRAITS_DIR)
+
+async def prepare_portraits():
+    try:
+        stats = await asyncio.to_thread(_build_portraits)
+        if stats:
+            print(f"[bot] Портреты пересобраны: {stats['files']} шт., перекодировано {stats['encoded']}, "
+                  f"{stats['source_bytes'] // 1024} КБ -> {stats['pack_bytes'] // 1024} КБ")
+    except Exception as e:
+        logging.warning(f"[portraits] Сжатые варианты не собраны, отправляю исходники: {e}")
+    if portrait_pack.load():
+        print(f"[bot] Портретов в pack-файле: {len(portrait_pack)}")
+
+async def wait_for_stop():
+    """Ждёт SIGTERM/SIGINT."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    await stop.wait()
 
 async def start_webhook():
     # Получаем параметры из окружения
@@ -936,42 +1394,198 @@ async def start_webhook():
     webhook_path = os.getenv("WEBHOOK_PATH", "/webhook")
     host = os.getenv("WEBAPP_HOST", "0.0.0.0")
     port = int(os.getenv("WEBAPP_PORT", 8080))
+    # Без заданного секрета генерируем случайный: его знает только Telegram
+    secret = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    workers = int(os.getenv("WEBHOOK_WORKERS", 1))
 
-    print(f"[bot] Запуск в режиме webhook: {webhook_url}{webhook_path}")
     os.makedirs(DATA_DIR, exist_ok=True)
-    cache = load_cache()
-    if not is_cache_valid(cache):
-        print("[bot] Кэш невалиден, обновляю...")
-        update_cache()
-    else:
-        print("[bot] Кэш валиден, запуск бота...")
-    asyncio.create_task(auto_update_cache())
+    if workers > 1:
+        await start_cluster(webhook_url, webhook_path, host, port, secret, workers)
+        return
 
-    await bot.set_webhook(f"{webhook_url}{webhook_path}")
-    app = web.Application()
-    SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=webhook_path)
-    setup_application(app, dp, bot=bot)
-    web.run_app(app, host=host, port=port)
+    print(f"[bot] Запуск в режиме webhook: {webhook_url}{webhook_path}")
+    card_renderer.start()
+    await prepare_cache()
+    builds_watcher.start()
+    await prepare_portraits()
+    spawn_background(prerender_cards())
+    schedule_fallback_refresh()
+    await broadcaster.resume()
+
+    server = WebhookServer(
+        dp,
+        bot,
+        path=webhook_path,
+        secret_token=secret,
+        max_in_flight=int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", MAX_IN_FLIGHT)),
+        # Колбэки упорядочивает CallbackMiddleware, успев сразу ответить на нажатие
+        order_callbacks=False,
+    )
+    await server.start(host, port)
+    await bot.set_webhook(f"{webhook_url}{webhook_path}", secret_token=secret)
+
+    # Работаем до SIGTERM/SIGINT, затем дорабатываем начатые апдейты
+    try:
+        await wait_for_stop()
+    finally:
+        print("[bot] Остановка webhook...")
+        await server.stop()
+        card_renderer.shutdown()
+        await bot.session.close()
+
+async def start_cluster(webhook_url, webhook_path, host, port, secret, workers):
+    """Фронт + супервизор: апдейты раздаются воркерам по chat_id (см. cluster.py)."""
+    print(f"[bot] Запуск в режиме webhook с {workers} воркерами: {webhook_url}{webhook_path}")
+    supervisor = WorkerSupervisor(workers, os.path.join(DATA_DIR, "workers"))
+    front = ClusterFront(supervisor.sockets, path=webhook_path, secret_token=secret)
+    await supervisor.start()
+    try:
+        await supervisor.wait_ready()
+        await front.start(host, port)
+        await bot.set_webhook(f"{webhook_url}{webhook_path}", secret_token=secret)
+        await wait_for_stop()
+    finally:
+        print("[bot] Остановка webhook...")
+        await front.stop()
+        await supervisor.stop()
+        await bot.session.close()
+
+async def start_worker(socket_path: str):
+    """Воркер кластера: обычный WebhookServer на unix-сокете, секрет проверяет фронт."""
+    print(f"[bot] Воркер {os.getenv('BOT_WORKER_INDEX')} запущен: {socket_path}")
+    os.makedirs(DATA_DIR, exist_ok=True)
+    card_renderer.start()
+    await prepare_cache()
+    builds_watcher.start()
+    await prepare_portraits()
+    spawn_background(prerender_cards())
+    schedule_fallback_refresh()
+    await broadcaster.resume()
+
+    server = WebhookServer(
+        dp,
+        bot,
+        path="/",
+        max_in_flight=int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", MAX_IN_FLIGHT)),
+        # Колбэки упорядочивает CallbackMiddleware, успев сразу ответить на нажатие
+        order_callbacks=False,
+    )
+    await server.start_unix(socket_path)
+    try:
+        await wait_for_stop()
+    finally:
+        await server.stop()
+        card_renderer.shutdown()
+        await bot.session.close()
 
 async def main():
     print("[bot] Запуск main()...")
+    if os.getenv("BOT_WORKER_SOCKET"):
+        await start_worker(os.environ["BOT_WORKER_SOCKET"])
+        return
     if os.getenv("WEBHOOK_URL"):
         await start_webhook()
-    else:
-        os.makedirs(DATA_DIR, exist_ok=True)
-        # Убеждаемся, что режим polling не конфликтует с активным webhook
+        return
+    os.makedirs(DATA_DIR, exist_ok=True)
+    # Пул карточек — до первых потоков (to_thread, DNS, наблюдатель best_builds.json)
+    card_renderer.start()
+    # Убеждаемся, что режим polling не конфликтует с активным webhook
+    try:
+        await bot.delete_webhook(drop_pending_updates=True)
+    except Exception:
+        pass
+    await prepare_cache()
+    builds_watcher.start()
+    await prepare_portraits()
+    spawn_background(prerender_cards())
+    schedule_fallback_refresh()
+    await broadcaster.resume()
+    # В polling своего HTTP-сервера нет — /metrics поднимаем отдельно
+    if os.getenv("METRICS_PORT"):
+        await start_metrics_server(os.getenv("WEBAPP_HOST", "0.0.0.0"), int(os.environ["METRICS_PORT"]))
+    try:
+        await dp.start_polling(bot)
+    finally:
+        card_renderer.shutdown()
+
+# --- Отправка портретов ---
+async def send_portrait(chat_id, art_path, **kwargs):
+    """send_photo, который загружает картинку только один раз.
+
+    Повторные отправки идут по сохранённому file_id. Если Telegram его не
+    принял (например, сменился токен бота), запись удаляется и файл
+    загружается заново. Загружается сжатый вариант из pack-файла, а если
+    его там нет — исходный файл с диска.
+    """
+    entry = portrait_pack.get(art_path)
+    digest = entry.hash if entry else None
+    file_id = portrait_registry.get(art_path, digest)
+    metrics.CACHE_REQUESTS.inc(cache="portrait_file_id", result="hit" if file_id else "miss")
+    if file_id:
         try:
-            await bot.delete_webhook(drop_pending_updates=True)
-        except Exception:
-            pass
-        cache = load_cache()
-        if not is_cache_valid(cache):
-            print("[bot] Кэш невалиден, обновляю...")
-            update_cache()
-        else:
-            print("[bot] Кэш валиден, запуск бота...")
-        asyncio.create_task(auto_update_cache())
-    await dp.start_polling(bot)
+            with PHOTO_SECONDS.time(source="file_id"):
+                return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            # Ошибки подписи пробрасываем как есть, невалидный file_id — забываем
+            if "file" not in str(e).lower():
+                raise
+            logging.warning(f"[portraits] file_id для {art_path} отклонён: {e}")
+            portrait_registry.forget(art_path)
+    photo = portrait_pack.input_file(art_path) if entry else FSInputFile(art_path)
+    with PHOTO_SECONDS.time(source="pack" if entry else "upload"):
+        msg = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+    if msg.photo:
+        portrait_registry.remember(art_path, msg.photo[-1].file_id, digest)
+    return msg
+
+async def send_card(chat_id, card_path, **kwargs):
+    """Как send_portrait, но для карточек: имя файла — хэш карточки, он же проверяет file_id."""
+    digest = os.path.splitext(os.path.basename(card_path))[0]
+    file_id = card_registry.get(card_path, digest)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            if "file" not in str(e).lower():
+                raise
+            card_registry.forget(card_path)
+    msg = await bot.send_photo(chat_id=chat_id, photo=FSInputFile(card_path), **kwargs)
+    if msg.photo:
+        card_registry.remember(card_path, msg.photo[-1].file_id, digest)
+    return msg
+
+@dp.message(Command("warm_portraits"))
+async def cmd_warm_portraits(message: types.Message):
+    """Заранее загружает все портреты и запоминает их file_id (только для администратора)."""
+    if not ADMIN_CHAT_ID or str(message.from_user.id) != str(ADMIN_CHAT_ID):
+        await message.reply("Команда доступна только администратору.")
+        return
+    paths = sorted(
+        os.path.join(ART_DIR, name) for name in os.listdir(ART_DIR)
+        if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp"))
+    )
+    pending = [p for p in paths if not portrait_registry.get(p, getattr(portrait_pack.get(p), "hash", None))]
+    await message.reply(f"Портретов: {len(paths)}, без file_id: {len(pending)}. Загружаю…")
+    uploaded, failed = 0, 0
+    for art_path in pending:
+        while True:
+            try:
+                sent = await send_portrait(message.chat.id, art_path, disable_notification=True)
+                uploaded += 1
+                try:
+                    await sent.delete()
+                except Exception:
+                    pass
+                break
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                logging.warning(f"[portraits] Не удалось загрузить {art_path}: {e}")
+                failed += 1
+                break
+        # Не больше одного сообщения в секунду в один чат
+        await asyncio.sleep(1)
+    await message.reply(f"Готово: загружено {uploaded}, ошибок {failed}, в реестре {len(portrait_registry)}.")
 
 # --- утилита безопасного редактирования ---
 async def safe_edit_text(msg: types.Message, text: str, reply_markup=None):
@@ -989,7 +1603,8 @@ async def safe_edit_text(msg: types.Message, text: str, reply_markup=None):
 @dp.callback_query(F.data == "teams:show")
 async def cb_show_teams(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    team_text: str = data.get("team_text", "Нет примеров отрядов.")
+    rendered = get_rendered_build_by_key(data.get("char_key"))
+    team_text: str = rendered.team_text if rendered else "Нет примеров отрядов."
     try:
         # Если сообщение – фото, изменяем подпись, сохраняем изображение
         await bot.edit_message_caption(
@@ -1005,10 +1620,10 @@ async def cb_show_teams(callback: types.CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data == "teams:back")
 async def cb_back_to_build(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    build_text: str = data.get("build_text", "")
-    if not build_text:
-        await callback.answer()
+    rendered = get_rendered_build_by_key(data.get("char_key"))
+    if not rendered:
         return
+    build_text: str = rendered.text
     try:
         await bot.edit_message_caption(
             chat_id=callback.message.chat.id,
@@ -1019,26 +1634,6 @@ async def cb_back_to_build(callback: types.CallbackQuery, state: FSMContext):
     except TelegramBadRequest:
         await safe_edit_text(callback.message, build_text, reply_markup=build_keyboard(show_team_button=True))
 
-# === Подписчики ===
-
-def load_subscribers() -> set[int]:
-    """Возвращает множество chat_id подписчиков рассылки."""
-    if not os.path.exists(SUBSCRIBERS_FILE):
-        return set()
-    try:
-        with open(SUBSCRIBERS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return set(data)
-    except Exception:
-        return set()
-
-
-def save_subscribers(subs: set[int]):
-    """Сохраняет множество chat_id подписчиков."""
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(SUBSCRIBERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(list(subs), f, ensure_ascii=False, indent=2)
-
 if __name__ == "__main__":
     print("[bot] Запуск через __main__...")
     asyncio.run(main())
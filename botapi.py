@@ -0,0 +1,162 @@
+"""Сессия Bot API: пул соединений, таймауты по методам и повторы.
+
+``create_session`` настраивает ``AiohttpSession`` явно, а не полагается на
+умолчания aiogram: размер пула соединений, keep-alive, кэш DNS и таймаут на
+каждый метод (ответ на колбэк не должен ждать столько же, сколько загрузка
+фото).
+
+``RetryMiddleware`` повторяет запросы при временных ошибках:
+
+* flood wait (429) — пауза ``retry_after`` ставится на все запросы бота, а не
+  только на упавший: иначе остальные обработчики тут же получили бы тот же 429;
+* 5xx и сетевые ошибки — экспоненциальная задержка со случайным разбросом
+  (full jitter). После такой ошибки неизвестно, принял ли Telegram запрос
+  (502 от прокси может прийти и после отправки сообщения), поэтому
+  повторяются только методы, повтор которых безопасен (get/edit/delete/answer…),
+  а не send*/copy*.
+
+Постоянные ошибки (400, 403) пробрасываются сразу — их разбирают обработчики.
+"""
+import ssl
+import time
+import random
+import asyncio
+import logging
+
+import aiogram
+import certifi
+from aiohttp import ClientSession, TCPConnector
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+import metrics
+
+POOL_SIZE = 100
+KEEPALIVE = 60          # с, сколько держать простаивающее соединение
+DNS_TTL = 600           # с
+DEFAULT_TIMEOUT = 20    # с, для методов не из METHOD_TIMEOUTS
+METHOD_TIMEOUTS = {
+    "answerCallbackQuery": 5,
+    "answerInlineQuery": 10,
+    "sendPhoto": 60,
+    "sendDocument": 60,
+    "sendMediaGroup": 60,
+}
+
+ATTEMPTS = 4
+BASE_DELAY = 0.5
+MAX_DELAY = 8.0
+# Более долгий flood wait не пережидаем внутри запроса: пауза ставится, а ошибка уходит вызывающему
+MAX_FLOOD_WAIT = 30
+# Повтор после сетевой ошибки не создаст дубль сообщения
+IDEMPOTENT_PREFIXES = ("get", "edit", "delete", "answer", "set", "pin", "unpin")
+# У long polling своя обработка ошибок в aiogram; рассылка (broadcast.py) повторяет
+# copyMessage сама и ставит на паузу свой лимит
+NO_RETRY = {"getUpdates", "copyMessage"}
+
+RETRIES = metrics.counter("bot_api_retries_total", "Повторы запросов к Bot API", ["method", "reason"])
+FLOOD_WAIT_SECONDS = metrics.counter("bot_api_flood_wait_seconds_total", "Суммарная пауза по flood wait")
+
+
+class TunedSession(AiohttpSession):
+    """AiohttpSession со своим ClientSession: пул, keep-alive и кэш DNS задаются явно.
+
+    Коннектор создаётся в ``create_session`` (публичный метод, через который
+    aiogram получает ClientSession для каждого запроса), а не через внутренние
+    настройки AiohttpSession. Прокси эта сессия не поддерживает.
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE, keepalive: float = KEEPALIVE, dns_ttl: int = DNS_TTL,
+                 timeouts: dict | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.dns_ttl = dns_ttl
+        self.method_timeouts = METHOD_TIMEOUTS if timeouts is None else timeouts
+        self._client = None
+
+    async def create_session(self) -> ClientSession:
+        if self._client is None or self._client.closed:
+            connector = TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive,
+                ttl_dns_cache=self.dns_ttl,
+                ssl=ssl.create_default_context(cafile=certifi.where()),
+            )
+            self._client = ClientSession(connector=connector, headers={"User-Agent": f"aiogram/{aiogram.__version__}"})
+        return self._client
+
+    async def close(self):
+        if self._client is not None and not self._client.closed:
+            await self._client.close()
+        await super().close()
+
+    async def make_request(self, bot, method, timeout=None):
+        if timeout is None:
+            timeout = self.method_timeouts.get(method.__api_method__)
+        return await super().make_request(bot, method, timeout)
+
+
+def create_session(api_base: str | None = None, pool_size: int = POOL_SIZE, keepalive: float = KEEPALIVE,
+                   timeout: float = DEFAULT_TIMEOUT) -> TunedSession:
+    """Сессия для Bot(...); ``api_base`` — свой Bot API сервер (например, локальная заглушка).
+
+    RetryMiddleware подключается отдельно (``session.middleware(RetryMiddleware())``),
+    чтобы вызывающий код мог поставить свои middleware снаружи неё.
+    """
+    kwargs = {"timeout": timeout}
+    if api_base:
+        kwargs["api"] = TelegramAPIServer.from_base(api_base)
+    return TunedSession(pool_size=pool_size, keepalive=keepalive, **kwargs)
+
+
+class RetryMiddleware(BaseRequestMiddleware):
+    def __init__(self, attempts: int = ATTEMPTS, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY,
+                 max_flood_wait: float = MAX_FLOOD_WAIT):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_flood_wait = max_flood_wait
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Все запросы через эту middleware ждут ``seconds`` секунд."""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            FLOOD_WAIT_SECONDS.inc(until - max(self._paused_until, time.monotonic()))
+            self._paused_until = until
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        attempt = 0
+        while True:
+            wait = self._paused_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.pause(e.retry_after)
+                if name in NO_RETRY or e.retry_after > self.max_flood_wait or attempt + 1 >= self.attempts:
+                    raise
+                logging.warning(f"[bot-api] {name}: flood wait {e.retry_after} с, пауза для всех запросов")
+                reason = "flood"
+            except TelegramServerError as e:
+                if name in NO_RETRY or not name.startswith(IDEMPOTENT_PREFIXES) or attempt + 1 >= self.attempts:
+                    raise
+                logging.warning(f"[bot-api] {name}: {e}, повтор {attempt + 1}/{self.attempts - 1}")
+                reason = "server"
+                await asyncio.sleep(self._backoff(attempt))
+            except TelegramNetworkError as e:
+                if name in NO_RETRY or not name.startswith(IDEMPOTENT_PREFIXES) or attempt + 1 >= self.attempts:
+                    raise
+                logging.warning(f"[bot-api] {name}: {e}, повтор {attempt + 1}/{self.attempts - 1}")
+                reason = "network"
+                await asyncio.sleep(self._backoff(attempt))
+            RETRIES.inc(method=name, reason=reason)
+            attempt += 1
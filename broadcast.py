@@ -0,0 +1,326 @@
+"""Рассылка сообщения всем подписчикам.
+
+* пул воркеров ограниченного размера копирует сообщение (copy_message);
+* общий token bucket держит темп ниже лимита Telegram (~30 сообщений в
+  секунду на бота), а для каждого чата выдерживается не больше одного
+  сообщения в секунду;
+* RetryAfter приостанавливает всю рассылку на указанное время, после чего
+  чат повторяется;
+* чаты, где бот заблокирован или которых больше нет, удаляются из
+  подписчиков через колбэк ``on_blocked`` (вызывается в потоке: он пишет на диск);
+* прогресс пишется в журнал ``<journal_dir>/<job>.jsonl`` (по строке на
+  чат), поэтому после перезапуска рассылка продолжается с места остановки;
+  пока рассылка идёт, журнал заблокирован (flock), так что при нескольких
+  процессах бота её продолжит только один; журнал завершённой рассылки
+  удаляется;
+* ход рассылки показывается правкой одного статусного сообщения.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+import metrics
+from locks import FileLock
+
+GLOBAL_RATE = 25          # сообщений в секунду на бота (лимит Telegram ~30)
+PER_CHAT_INTERVAL = 1.0   # секунд между сообщениями в один чат
+WORKERS = 16
+MAX_ATTEMPTS = 3
+STATUS_EVERY = 3.0        # как часто обновлять статусное сообщение, с
+
+# Ошибки BadRequest, после которых чат можно смело удалять из подписчиков
+_GONE_MARKERS = ("chat not found", "user is deactivated", "bot was blocked", "peer_id_invalid")
+
+SENT = metrics.counter("bot_broadcast_messages_total", "Сообщения рассылок по результату", ["result"])
+SEND_SECONDS = metrics.histogram("bot_broadcast_send_seconds", "Доставка одного сообщения рассылки с повторами")
+
+
+class TokenBucket:
+    """Классический token bucket: ``rate`` токенов в секунду, запас ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        # Небольшой запас: за любую секунду уходит не больше ~1.2 * rate сообщений
+        self.capacity = capacity or max(1.0, rate / 5)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Остановить выдачу токенов (flood wait распространяется на всего бота)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastJob:
+    def __init__(self, job_id, from_chat_id, message_id, chat_ids, status_chat_id=None, status_message_id=None):
+        self.job_id = job_id
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.chat_ids = list(chat_ids)
+        self.status_chat_id = status_chat_id
+        self.status_message_id = status_message_id
+        self.results = {}  # chat_id -> "ok" | "gone" | "failed"
+        self.lock = None
+
+    @property
+    def pending(self):
+        return [c for c in self.chat_ids if c not in self.results]
+
+    def counts(self):
+        counts = {"ok": 0, "gone": 0, "failed": 0}
+        for result in self.results.values():
+            counts[result] += 1
+        return counts
+
+    def header(self):
+        return {
+            "job": self.job_id, "from_chat_id": self.from_chat_id, "message_id": self.message_id,
+            "chat_ids": self.chat_ids, "status_chat_id": self.status_chat_id,
+            "status_message_id": self.status_message_id,
+        }
+
+
+class Broadcaster:
+    def __init__(self, bot, journal_dir: str, on_blocked=None, rate: float = GLOBAL_RATE, workers: int = WORKERS):
+        self.bot = bot
+        self.journal_dir = journal_dir
+        self.on_blocked = on_blocked
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self._last_sent = {}  # chat_id -> время последней отправки; по порядку отправки
+        self._tasks = set()
+
+    # --- журнал ---
+    def _journal_path(self, job_id):
+        return os.path.join(self.journal_dir, f"{job_id}.jsonl")
+
+    def _append(self, job, record):
+        with open(self._journal_path(job.job_id), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    @staticmethod
+    def _remove_journal(path):
+        # Удаляем под блокировкой: процесс, который откроет путь после нас,
+        # получит пустой файл и тоже удалит его в resume()
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.warning(f"[broadcast] Не удалось удалить журнал {path}: {e}")
+
+    def _load_job(self, path):
+        """Восстанавливает задание из журнала; None, если оно завершено или журнал битый."""
+        job = None
+        line = "\n"
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Последняя строка могла оборваться при падении процесса
+                    continue
+                if "job" in record:
+                    job = BroadcastJob(record["job"], record["from_chat_id"], record["message_id"],
+                                       record["chat_ids"], record.get("status_chat_id"),
+                                       record.get("status_message_id"))
+                elif job and "finished" in record:
+                    return None
+                elif job and "chat_id" in record:
+                    job.results[record["chat_id"]] = record["result"]
+        if job and not line.endswith("\n"):
+            # Новые записи не должны склеиться с оборванной строкой
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n")
+        return job
+
+    # --- запуск ---
+    async def start(self, from_chat_id, message_id, chat_ids, status_chat_id=None) -> BroadcastJob:
+        """Создаёт задание, отправляет статусное сообщение и запускает рассылку в фоне."""
+        os.makedirs(self.journal_dir, exist_ok=True)
+        job = BroadcastJob(f"{int(time.time())}-{uuid.uuid4().hex[:8]}", from_chat_id, message_id,
+                           sorted(set(chat_ids)), status_chat_id)
+        if status_chat_id is not None:
+            status = await self.bot.send_message(status_chat_id, self._status_text(job))
+            job.status_message_id = status.message_id
+        # Сначала блокировка: недописанный журнал не должен достаться resume() другого процесса
+        job.lock = FileLock(self._journal_path(job.job_id))
+        job.lock.acquire()
+        self._append(job, job.header())
+        self._spawn(job)
+        return job
+
+    async def resume(self) -> int:
+        """Продолжает незавершённые рассылки из журналов. Возвращает их число."""
+        if not os.path.isdir(self.journal_dir):
+            return 0
+        resumed = 0
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(self.journal_dir, name)
+            lock = FileLock(path)
+            if not lock.acquire(blocking=False):
+                # Эту рассылку ведёт другой процесс
+                continue
+            try:
+                job = self._load_job(path)
+            except OSError as e:
+                logging.warning(f"[broadcast] Не удалось прочитать журнал {name}: {e}")
+                lock.release()
+                continue
+            if not job:
+                # Завершённая рассылка или пустой/битый журнал — продолжать нечего
+                self._remove_journal(path)
+                lock.release()
+                continue
+            job.lock = lock
+            logging.info(f"[broadcast] Продолжаю рассылку {job.job_id}: осталось {len(job.pending)}")
+            self._spawn(job)
+            resumed += 1
+        return resumed
+
+    def _spawn(self, job):
+        task = asyncio.create_task(self.run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # --- выполнение ---
+    async def run(self, job: BroadcastJob):
+        queue = asyncio.Queue()
+        for chat_id in job.pending:
+            queue.put_nowait(chat_id)
+        started = time.monotonic()
+        reporter = asyncio.create_task(self._report_progress(job, started))
+        workers = [asyncio.create_task(self._worker(job, queue)) for _ in range(min(self.workers, queue.qsize()) or 1)]
+        try:
+            await queue.join()
+            elapsed = time.monotonic() - started
+            counts = job.counts()
+            self._append(job, {"finished": time.time(), **counts})
+            self._remove_journal(self._journal_path(job.job_id))
+        finally:
+            for w in workers:
+                w.cancel()
+            reporter.cancel()
+            if job.lock:
+                job.lock.release()
+        logging.info(f"[broadcast] {job.job_id} завершена за {elapsed:.1f} с: {counts}")
+        await self._update_status(job, final=True, elapsed=elapsed)
+        return counts
+
+    async def _worker(self, job, queue):
+        while True:
+            chat_id = await queue.get()
+            try:
+                with SEND_SECONDS.time():
+                    result = await self._deliver(job, chat_id)
+                SENT.inc(result=result)
+                job.results[chat_id] = result
+                self._append(job, {"chat_id": chat_id, "result": result})
+                if result == "gone" and self.on_blocked:
+                    try:
+                        await asyncio.to_thread(self.on_blocked, chat_id)
+                    except Exception as e:
+                        logging.warning(f"[broadcast] Не удалось отписать {chat_id}: {e}")
+            finally:
+                queue.task_done()
+
+    async def _deliver(self, job, chat_id) -> str:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            # Не чаще раза в секунду в один чат
+            self._forget_sent()
+            wait = self._last_sent.get(chat_id, 0) + PER_CHAT_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.bucket.acquire()
+            self._last_sent.pop(chat_id, None)
+            self._last_sent[chat_id] = time.monotonic()
+            try:
+                await self.bot.copy_message(chat_id=chat_id, from_chat_id=job.from_chat_id, message_id=job.message_id)
+                return "ok"
+            except TelegramRetryAfter as e:
+                logging.warning(f"[broadcast] Flood wait {e.retry_after} с")
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return "gone"
+            except TelegramBadRequest as e:
+                if any(marker in str(e).lower() for marker in _GONE_MARKERS):
+                    return "gone"
+                logging.warning(f"[broadcast] {chat_id}: {e}")
+                return "failed"
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logging.warning(f"[broadcast] {chat_id}: {e}, попытка {attempt}/{MAX_ATTEMPTS}")
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                logging.warning(f"[broadcast] {chat_id}: {e}")
+                return "failed"
+        return "failed"
+
+    def _forget_sent(self):
+        """Забывает чаты, у которых пауза между сообщениями уже прошла."""
+        deadline = time.monotonic() - PER_CHAT_INTERVAL
+        while self._last_sent:
+            chat_id, sent = next(iter(self._last_sent.items()))
+            if sent > deadline:
+                break
+            del self._last_sent[chat_id]
+
+    # --- статус ---
+    def _status_text(self, job, final=False, elapsed=None):
+        counts = job.counts()
+        done = len(job.results)
+        total = len(job.chat_ids)
+        head = "Рассылка завершена." if final else "Идёт рассылка…"
+        text = (f"{head}\nОбработано: {done}/{total}\n"
+                f"Успешно: {counts['ok']}, отписано (бот заблокирован): {counts['gone']}, ошибок: {counts['failed']}")
+        if elapsed:
+            text += f"\nВремя: {elapsed:.0f} с"
+        return text
+
+    async def _update_status(self, job, final=False, elapsed=None):
+        if job.status_chat_id is None or job.status_message_id is None:
+            return
+        # Правка статуса — тоже запрос к Telegram и тоже расходует лимит
+        await self.bucket.acquire()
+        try:
+            await self.bot.edit_message_text(self._status_text(job, final, elapsed),
+                                             chat_id=job.status_chat_id, message_id=job.status_message_id)
+        except TelegramRetryAfter as e:
+            self.bucket.pause(e.retry_after)
+        except Exception:
+            # «message is not modified» и прочее — статус не критичен
+            pass
+
+    async def _report_progress(self, job, started):
+        last = -1
+        while True:
+            await asyncio.sleep(STATUS_EVERY)
+            if len(job.results) != last:
+                last = len(job.results)
+                await self._update_status(job, elapsed=time.monotonic() - started)
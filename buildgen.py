@@ -0,0 +1,271 @@
+"""Подбор билда по справочнику StarRailRes — для персонажей без записи в best_builds.json.
+
+Для каждого снимка справочника один раз строятся обратные индексы
+«основа слова → {id: сколько раз встретилась}» по описаниям комплектов
+реликвий, планарных украшений и световых конусов. Запрос персонажа — основы
+названия его стихии и ключевых слов роли его пути с весами; кандидат
+получает сумму вес × (1 + ln tf) × idf, поэтому редкое «квантовый» значит
+больше, чем «урон», который есть почти в каждом описании.
+
+Результат — ``GeneratedBuild`` (данные, а не HTML); текст для Telegram
+собирает ``format_generated_build``. ``generate_missing`` за один проход
+подбирает билды всем персонажам, которых нет в best_builds.json.
+"""
+import re
+import html
+import math
+import time
+import weakref
+import functools
+import threading
+from typing import NamedTuple
+
+from gamedata import get_index
+
+_WORD = re.compile(r"[a-zа-я]+")
+# Окончания для грубого стемминга: «квантового»/«квантовый» → «квантов»
+_ENDINGS = sorted((
+    "ого", "его", "ому", "ему", "ыми", "ими", "ами", "ями", "ый", "ий", "ой", "ая", "яя", "ое", "ее",
+    "ые", "ие", "ых", "их", "ым", "им", "ую", "юю", "ов", "ев", "ом", "ем", "ах", "ях", "ам", "ям", "ей",
+    "а", "я", "ы", "и", "у", "ю", "е", "о", "й", "ь",
+), key=len, reverse=True)
+MIN_STEM = 3
+
+ELEMENT_WEIGHT = 2.0
+# Роль пути (id StarRailRes) → ключевые слова и их веса
+ROLE_TERMS = {
+    "Warrior": {"урон": 1.0, "крит": 1.0, "атака": 0.5},
+    "Rogue": {"урон": 1.0, "крит": 1.0, "атака": 0.5},
+    "Mage": {"урон": 1.0, "крит": 1.0, "противник": 0.5},
+    "Memory": {"урон": 1.0, "крит": 0.5, "союзник": 0.5},
+    "Shaman": {"союзник": 1.0, "скорость": 1.0, "энергия": 1.0},
+    "Warlock": {"эффект": 1.0, "шанс": 1.0, "противник": 0.5},
+    "Knight": {"защита": 1.0, "щит": 1.0, "союзник": 0.5},
+    "Priest": {"лечение": 1.0, "исцеление": 1.0, "союзник": 0.5},
+}
+DEFAULT_ROLE = {"урон": 1.0}
+
+RELIC_SETS = 2
+PLANAR_SETS = 2
+CONE_RARITIES = (5, 4, 3)
+SUB_STATS = ["CriticalChanceBase", "CriticalDamageBase", "SpeedDelta", "AttackAddedRatio", "HPAddedRatio",
+             "StatusProbabilityBase"]
+
+
+@functools.lru_cache(maxsize=None)  # словарь описаний невелик, а слова повторяются постоянно
+def stem(word: str) -> str:
+    word = word.lower().replace("ё", "е")
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def stems(text) -> list[str]:
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(t) for t in text)
+    return [stem(w) for w in _WORD.findall(str(text).lower().replace("ё", "е"))]
+
+
+class Candidate(NamedTuple):
+    id: str
+    name: str
+    score: float
+    rarity: int | None = None
+
+
+class GeneratedBuild(NamedTuple):
+    character_id: str
+    name: str
+    path: str             # отображаемые названия
+    element: str
+    relic_sets: list      # [Candidate]
+    planar_sets: list
+    light_cones: list     # по одному на редкость из CONE_RARITIES
+    main_stats: dict      # слот → [id характеристик]
+    sub_stats: list
+
+
+class BulkReport(NamedTuple):
+    characters: int       # всего персонажей в справочнике
+    generated: int        # из них без билда в best_builds.json
+    index_ms: float       # построение индексов (0, если уже были)
+    generate_ms: float
+
+
+class InvertedIndex:
+    """Основа слова → {id: tf} по описаниям; idf считается сразу."""
+
+    def __init__(self, docs: dict):
+        postings = {}
+        for doc_id, text in docs.items():
+            counts = {}
+            for s in stems(text):
+                counts[s] = counts.get(s, 0) + 1
+            for s, tf in counts.items():
+                postings.setdefault(s, {})[doc_id] = tf
+        self.postings = postings
+        self.idf = {s: math.log(1 + len(docs) / len(ids)) for s, ids in postings.items()}
+
+    def scores(self, query: dict) -> dict:
+        result = {}
+        for s, weight in query.items():
+            ids = self.postings.get(s)
+            if not ids:
+                continue
+            idf = self.idf[s]
+            for doc_id, tf in ids.items():
+                result[doc_id] = result.get(doc_id, 0.0) + weight * (1 + math.log(tf)) * idf
+        return result
+
+
+class BuildEngine:
+    """Индексы и подбор для одного снимка справочника (см. ``get_engine``).
+
+    Ссылок на справочник и его GameDataIndex движок не хранит — только нужные
+    словари из индекса: иначе запись в ``_engines`` (WeakKeyDictionary по
+    индексу) держала бы свой ключ и снимок не освобождался бы никогда.
+    """
+
+    def __init__(self, game_data):
+        index = get_index(game_data)
+        self._path_names = index.path_names
+        self._element_names = index.element_names
+        self._relic_set_names = index.relic_set_names
+        self._cone_names = index.cones
+        self._cones_by_path_rarity = index.cones_by_path_rarity
+        relics, planars = {}, {}
+        for relic_set in game_data.get("relic_sets", {}).values():
+            target = planars if relic_set.get("type") == "Planar" else relics
+            target.setdefault(relic_set["id"], relic_set.get("desc", ""))
+        self._relic_order = list(relics)
+        self._planar_order = list(planars)
+        self._relics = InvertedIndex(relics)
+        self._planars = InvertedIndex(planars)
+        self._cones = InvertedIndex({c["id"]: c.get("desc", "") for c in game_data.get("light_cones", {}).values()})
+        self._queries = {}
+        self._selections = {}  # (путь, стихия) → (реликвии, украшения, конусы)
+
+    def query(self, path_id, element_id) -> dict:
+        """Основы слов запроса → вес (стихия + роль пути)."""
+        key = (path_id, element_id)
+        query = self._queries.get(key)
+        if query is None:
+            query = {}
+            for word, weight in ROLE_TERMS.get(path_id, DEFAULT_ROLE).items():
+                s = stem(word)
+                query[s] = query.get(s, 0.0) + weight
+            element = self._element_names.get(element_id, element_id)
+            for s in {*stems(element), *stems(element_id or "")}:
+                query[s] = query.get(s, 0.0) + ELEMENT_WEIGHT
+            self._queries[key] = query
+        return query
+
+    def _top(self, inverted: InvertedIndex, order: list, names: dict, query: dict, limit: int) -> list:
+        scores = inverted.scores(query)
+        # При равном счёте — порядок справочника, как в прежнем подборе
+        position = {doc_id: n for n, doc_id in enumerate(order)}
+        ranked = sorted((doc_id for doc_id, score in scores.items() if score > 0),
+                        key=lambda doc_id: (-scores[doc_id], position.get(doc_id, 0)))[:limit]
+        if not ranked:
+            ranked = order[:limit]
+        return [Candidate(doc_id, names.get(doc_id, doc_id), round(scores.get(doc_id, 0.0), 3)) for doc_id in ranked]
+
+    def select(self, path_id, element_id) -> tuple:
+        """(реликвии, украшения, конусы) — зависят только от пути и стихии, поэтому кэшируются."""
+        key = (path_id, element_id)
+        selection = self._selections.get(key)
+        if selection is None:
+            query = self.query(path_id, element_id)
+            names = self._relic_set_names
+            cone_scores = self._cones.scores(query)
+            light_cones = []
+            for rarity in CONE_RARITIES:
+                ids = self._cones_by_path_rarity.get((path_id, rarity), [])
+                if ids:
+                    best = max(ids, key=lambda cone_id: cone_scores.get(cone_id, 0.0))  # первый при равенстве
+                    name, _ = self._cone_names.get(best, (best, rarity))
+                    light_cones.append(Candidate(best, name, round(cone_scores.get(best, 0.0), 3), rarity))
+            selection = self._selections[key] = (
+                self._top(self._relics, self._relic_order, names, query, RELIC_SETS),
+                self._top(self._planars, self._planar_order, names, query, PLANAR_SETS),
+                light_cones,
+            )
+        return selection
+
+    def generate(self, character) -> GeneratedBuild:
+        path_id = character.get("path")
+        element_id = character.get("element")
+        relic_sets, planar_sets, light_cones = self.select(path_id, element_id)
+        return GeneratedBuild(
+            character_id=str(character.get("id")),
+            name=character.get("name", ""),
+            path=self._path_names.get(path_id, path_id),
+            element=self._element_names.get(element_id, element_id),
+            relic_sets=list(relic_sets),
+            planar_sets=list(planar_sets),
+            light_cones=list(light_cones),
+            main_stats={
+                "Голова": ["HPDelta"],
+                "Руки": ["AttackDelta"],
+                "Тело": ["AttackAddedRatio", "CriticalChanceBase", "CriticalDamageBase", "HealRatioBase",
+                         "StatusProbabilityBase"],
+                "Ноги": ["SpeedDelta", "AttackAddedRatio"],
+                "Сфера": [f"{element_id}AddedRatio", "HPAddedRatio", "AttackAddedRatio"],
+                "Канат": ["SPRatioBase", "AttackAddedRatio", "HPAddedRatio"],
+            },
+            sub_stats=list(SUB_STATS),
+        )
+
+
+# GameDataIndex живёт столько же, сколько снимок справочника
+_engines = weakref.WeakKeyDictionary()
+# Движок нужен и обработчикам в event loop, и generate_missing в потоке:
+# под блокировкой его строит только кто-то один
+_engines_lock = threading.Lock()
+
+
+def _engine(game_data) -> tuple[BuildEngine, bool]:
+    """(движок, был ли он уже построен)."""
+    index = get_index(game_data)
+    with _engines_lock:
+        engine = _engines.get(index)
+        if engine is not None:
+            return engine, True
+        engine = _engines[index] = BuildEngine(game_data)
+        return engine, False
+
+
+def get_engine(game_data) -> BuildEngine:
+    return _engine(game_data)[0]
+
+
+def generate_missing(game_data, has_build) -> tuple[dict, BulkReport]:
+    """Билды всем персонажам, для которых ``has_build(character)`` ложно: {id: GeneratedBuild}."""
+    start = time.perf_counter()
+    engine, cached = _engine(game_data)
+    index_ms = 0.0 if cached else (time.perf_counter() - start) * 1000
+    characters = list(get_index(game_data).characters_by_id.values())
+    start = time.perf_counter()
+    builds = {str(c.get("id")): engine.generate(c) for c in characters if not has_build(c)}
+    return builds, BulkReport(len(characters), len(builds), index_ms, (time.perf_counter() - start) * 1000)
+
+
+def format_generated_build(build: GeneratedBuild, game_data) -> str:
+    """HTML для Telegram (в прежнем формате generate_build_for_character)."""
+    index = get_index(game_data)
+    esc = lambda value: html.escape(str(value), quote=False)
+    msg = f"<b>{esc(build.name)}</b>\n"
+    msg += f"Путь: {esc(build.path)}\n"
+    msg += f"Элемент: {esc(build.element)}\n\n"
+    msg += f"<b>Реликвии:</b> {', '.join(esc(c.name) for c in build.relic_sets)}\n"
+    if build.planar_sets:
+        msg += f"<b>Планарные украшения:</b> {', '.join(esc(c.name) for c in build.planar_sets)}\n"
+    if build.light_cones:
+        cones = [f"{esc(c.name)} ({c.rarity}★)" if c.rarity else esc(c.name) for c in build.light_cones]
+        msg += f"<b>Конусы:</b> {', '.join(cones)}\n"
+    msg += "<b>Основные статы:</b>\n"
+    for slot, stats in build.main_stats.items():
+        msg += f"- {slot}: {', '.join(esc(index.main_stat_names.get(s, s)) for s in stats)}\n"
+    msg += "<b>Второстаты:</b> " + ", ".join(esc(index.sub_stat_names.get(s, s)) for s in build.sub_stats)
+    return msg.strip()
@@ -0,0 +1,24 @@
+"""Схема callback_data инлайн-кнопок.
+
+Telegram ограничивает callback_data 64 байтами, а кириллица в UTF-8 занимает
+по 2 байта на символ, поэтому в кнопки кладём не имена, а короткие коды:
+персонажа — числовой id из StarRailRes (``c:1005``), путь — его id
+(``p:Rogue``), функцию — код игры и функции (``f:HSR:builds``).
+
+Прежние строки (``char:<имя>``, ``element:<путь>``, ``feature:...``) по-прежнему
+обрабатываются — они остаются в уже отправленных сообщениях.
+"""
+from aiogram.filters.callback_data import CallbackData
+
+
+class FeatureCallback(CallbackData, prefix="f"):
+    game: str
+    feature: str
+
+
+class PathCallback(CallbackData, prefix="p"):
+    path: str
+
+
+class CharacterCallback(CallbackData, prefix="c"):
+    id: int
@@ -0,0 +1,298 @@
+"""Карточки билдов («Генерация карточек»): портрет и выжимка билда на одной картинке.
+
+Рисование (Pillow) выполняется в ``ProcessPoolExecutor``, так что event loop
+не ждёт CPU. Пул (fork) запускается через ``CardRenderer.start()`` при старте
+бота, пока в процессе нет других потоков: fork после их запуска скопировал бы
+захваченные ими блокировки. Без пула (не запущен или процесс пула упал)
+карточки рисуются в потоке. Готовая карточка лежит на диске под именем
+sha1(версия шаблона, хэш портрета, билд): изменился билд, портрет или шаблон —
+получается новый файл, а старые вытесняются по LRU (mtime обновляется при
+каждом попадании). Одну и ту же карточку одновременно рисует только один
+процесс пула, остальные запросы ждут его результат.
+"""
+import os
+import io
+import json
+import asyncio
+import hashlib
+import logging
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # без Pillow карточки недоступны
+    Image = None
+
+# Меняется вместе с макетом — все карточки перерисовываются
+TEMPLATE_VERSION = 2
+CACHE_SIZE = 300
+
+WIDTH = 1080
+PADDING = 40
+PORTRAIT = 320
+BACKGROUND = (24, 24, 27)
+PANEL = (36, 37, 42)
+TEXT = (232, 232, 236)
+MUTED = (160, 161, 170)
+DEFAULT_ACCENT = (200, 170, 110)
+# analytics.element из best_builds.json (встречаются и опечатки/русские названия)
+ELEMENT_COLORS = {
+    "physical": (196, 196, 204), "phisycal": (196, 196, 204), "физический": (196, 196, 204),
+    "fire": (240, 106, 64), "огненный": (240, 106, 64),
+    "ice": (96, 186, 236), "ледяной": (96, 186, 236),
+    "thunder": (196, 112, 236), "lightning": (196, 112, 236), "электрический": (196, 112, 236),
+    "wind": (86, 204, 160), "ветряной": (86, 204, 160),
+    "quantum": (126, 112, 236), "квантовый": (126, 112, 236),
+    "imaginary": (244, 204, 84), "мнимый": (244, 204, 84),
+}
+MAIN_STAT_SLOTS = (("Body", "Тело"), ("Feet", "Ноги"), ("Sphere", "Сфера"), ("Rope", "Канат"))
+# (обычный, жирный)
+FONT_PATHS = (
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"),
+    ("/usr/share/fonts/dejavu/DejaVuSans.ttf", "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf"),
+    ("/Library/Fonts/Arial.ttf", "/Library/Fonts/Arial Bold.ttf"),
+    ("C:/Windows/Fonts/arial.ttf", "C:/Windows/Fonts/arialbd.ttf"),
+)
+
+CARD_SECONDS = metrics.histogram("bot_card_render_seconds", "Рисование карточки билда в пуле процессов")
+
+
+def card_key(build: dict, portrait_hash: str | None) -> str:
+    payload = json.dumps(build, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(f"{TEMPLATE_VERSION}\0{portrait_hash or ''}\0{payload}".encode()).hexdigest()
+
+
+# --- рисование (выполняется в процессах пула) ---
+@functools.lru_cache(maxsize=None)
+def _font(size: int, bold: bool = False):
+    """Шрифт с кириллицей: CARD_FONT/CARD_FONT_BOLD или DejaVu Sans/Arial из системы."""
+    override = os.getenv("CARD_FONT_BOLD" if bold else "CARD_FONT")
+    candidates = [override] if override else []
+    candidates += [pair[bold] for pair in FONT_PATHS]
+    for path in candidates:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def _wrap(draw, text: str, font, width: int) -> list[str]:
+    lines = []
+    for paragraph in str(text).split("\n"):
+        line = ""
+        for word in paragraph.split():
+            candidate = f"{line} {word}" if line else word
+            if line and draw.textlength(candidate, font=font) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def _sections(build: dict) -> list[tuple[str, list[str]]]:
+    """(заголовок, строки) блоков карточки — только непустые."""
+    def alt(value):
+        return f"или: {value}" if value else ""
+
+    main_stats = build.get("main_stats") or {}
+    sections = [
+        ("Реликвии", [build.get("best_relic"), alt(build.get("alt_relic"))]),
+        ("Планарные украшения", [build.get("best_planar"), alt(build.get("alt_planar"))]),
+        ("Световые конусы", [f"5★ {build['best_5_lc']}" if build.get("best_5_lc") else "",
+                             f"4★ {build['best_4_lc']}" if build.get("best_4_lc") else ""]),
+        ("Основные статы", [f"{title}: {main_stats[slot]}" for slot, title in MAIN_STAT_SLOTS if main_stats.get(slot)]),
+        ("Субстаты", [build.get("substats")]),
+    ]
+    return [(title, [str(v) for v in values if v]) for title, values in sections if any(values)]
+
+
+def render_card(build: dict, portrait_path: str | None) -> bytes:
+    """Рисует карточку билда, возвращает JPEG."""
+    analytics = build.get("analytics") or {}
+    accent = ELEMENT_COLORS.get(str(analytics.get("element", "")).strip().lower(), DEFAULT_ACCENT)
+    title_font, meta_font = _font(54, bold=True), _font(30)
+    head_font, body_font = _font(30, bold=True), _font(27)
+    measure = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+    # Сначала раскладка, чтобы знать высоту картинки
+    text_x = PADDING * 2 + PORTRAIT
+    text_width = WIDTH - text_x - PADDING
+    title = _wrap(measure, build.get("character", ""), title_font, text_width)
+    rarity = analytics.get("rarity")
+    meta = [v for v in (f"{'★' * int(rarity)}" if str(rarity).isdigit() else "",
+                        analytics.get("path"), analytics.get("element")) if v]
+    header_bottom = PADDING + len(title) * 64 + (40 if meta else 0)
+
+    body_width = WIDTH - PADDING * 2 - 30
+    blocks = [(heading, [_wrap(measure, line, body_font, body_width) for line in lines])
+              for heading, lines in _sections(build)]
+    body_height = sum(44 + sum(len(w) * 36 for w in wrapped) + 18 for _, wrapped in blocks)
+    top = max(PADDING + PORTRAIT, header_bottom) + PADDING
+    height = top + body_height + PADDING
+
+    img = Image.new("RGB", (WIDTH, height), BACKGROUND)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, WIDTH, 8), fill=accent)
+    box = (PADDING, PADDING, PADDING + PORTRAIT, PADDING + PORTRAIT)
+    draw.rounded_rectangle(box, radius=24, fill=PANEL, outline=accent, width=4)
+    if portrait_path:
+        with Image.open(portrait_path) as portrait:
+            portrait = portrait.convert("RGBA")
+            side = PORTRAIT - 24
+            portrait.thumbnail((side, side), Image.LANCZOS)
+            x = PADDING + (PORTRAIT - portrait.width) // 2
+            y = PADDING + (PORTRAIT - portrait.height) // 2
+            img.paste(portrait, (x, y), portrait)
+
+    y = PADDING
+    for line in title:
+        draw.text((text_x, y), line, font=title_font, fill=TEXT)
+        y += 64
+    if meta:
+        draw.text((text_x, y + 4), "  ·  ".join(str(v) for v in meta), font=meta_font, fill=accent)
+
+    y = top
+    for heading, wrapped in blocks:
+        draw.text((PADDING, y), heading, font=head_font, fill=accent)
+        y += 44
+        for lines in wrapped:
+            draw.text((PADDING, y), "•", font=body_font, fill=MUTED)
+            for line in lines:
+                draw.text((PADDING + 30, y), line, font=body_font, fill=TEXT)
+                y += 36
+        y += 18
+
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=88, optimize=True)
+    return out.getvalue()
+
+
+# --- кэш и пул ---
+class CardCache:
+    """Карточки на диске: ``<ключ>.jpg``, не больше ``size`` файлов (LRU по mtime)."""
+
+    def __init__(self, directory: str, size: int = CACHE_SIZE):
+        self.directory = directory
+        self.size = size
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.jpg")
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def get(self, key: str) -> str | None:
+        path = self.path(key)
+        try:
+            os.utime(path)  # отметка для LRU
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, data: bytes) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._evict()
+        return path
+
+    def _evict(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".jpg"):
+                try:
+                    files.append((entry.stat().st_mtime_ns, entry.path))
+                except FileNotFoundError:
+                    pass
+        if len(files) <= self.size:
+            return
+        files.sort()
+        for _, path in files[:len(files) - self.size]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class CardRenderer:
+    def __init__(self, cache: CardCache, workers: int = 0):
+        self.cache = cache
+        self.workers = workers or min(2, os.cpu_count() or 1)
+        self._pool = None
+        self._pending = {}  # ключ -> Future с путём к карточке
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def start(self):
+        """Создаёт пул и сразу запускает его процессы.
+
+        Вызывать при старте, до первого ``asyncio.to_thread`` и других потоков.
+        """
+        if not self.available or self._pool is not None:
+            return
+        # При spawn/forkserver дочерний процесс заново импортировал бы bot.py
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+        # С fork все процессы пула создаются при первой задаче — создаём их сейчас
+        self._pool.submit(os.getpid).result()
+
+    async def render(self, build: dict, portrait_path: str | None, portrait_hash: str | None) -> str:
+        """Путь к карточке: из кэша или только что нарисованной."""
+        key = card_key(build, portrait_hash)
+        path = self.cache.get(key)
+        metrics.CACHE_REQUESTS.inc(cache="card", result="hit" if path else "miss")
+        if path:
+            return path
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(self._render(key, build, portrait_path))
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        # shield: отмена одного ожидающего не прерывает рисование для остальных
+        return await asyncio.shield(pending)
+
+    async def _render(self, key: str, build: dict, portrait_path: str | None) -> str:
+        loop = asyncio.get_running_loop()
+        try:
+            with CARD_SECONDS.time():
+                # Без пула — в потоке: новый fork из процесса с потоками небезопасен
+                data = await loop.run_in_executor(self._pool, render_card, build, portrait_path)
+        except BrokenProcessPool:
+            # Процесс пула упал (OOM и т.п.) — дальше рисуем в потоке до перезапуска бота
+            logging.error("[cards] Пул процессов сломан, карточки рисуются в потоке")
+            self._pool = None
+            raise
+        return await asyncio.to_thread(self.cache.put, key, data)
+
+    async def prerender(self, items) -> int:
+        """Рисует недостающие карточки; ``items`` — [(билд, портрет, хэш портрета)]."""
+        missing = [item for item in items if card_key(item[0], item[2]) not in self.cache]
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def one(item) -> int:
+            async with semaphore:
+                try:
+                    await self.render(*item)
+                    return 1
+                except Exception as e:
+                    logging.warning(f"[cards] Не удалось нарисовать карточку {item[0].get('character')}: {e}")
+                    return 0
+
+        return sum(await asyncio.gather(*(one(item) for item in missing)))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,196 @@
+"""Многопроцессный режим webhook (``WEBHOOK_WORKERS`` > 1).
+
+Главный процесс — фронт и супервизор:
+
+* запускает N воркеров (``python bot.py`` с ``BOT_WORKER_INDEX`` и
+  ``BOT_WORKER_SOCKET`` в окружении), каждый — обычный WebhookServer на
+  своём unix-сокете, и перезапускает упавшие;
+* принимает апдейты от Telegram, проверяет секрет и пересылает апдейт
+  воркеру ``chat_id % N``: все апдейты одного чата попадают в один процесс,
+  а там выполняются по очереди, так что порядок для пользователя сохраняется;
+* ``GET /healthz`` собирает состояние воркеров, ``GET /metrics`` — их метрики
+  с меткой ``worker``.
+
+SO_REUSEPORT здесь не подходит: ядро распределяет соединения, а не чаты.
+
+Общее для процессов состояние живёт в папке data: FSM — в SQLite
+(storage.py), подписчики — в журнале с файловой блокировкой
+(subscribers.py), кэш справочника — в манифесте (gamedata.py).
+"""
+import os
+import sys
+import json
+import hmac
+import asyncio
+import logging
+
+from aiohttp import web, ClientSession, UnixConnector, ClientError
+
+import metrics
+from webhook import SECRET_HEADER, update_chat_id
+
+RESTART_DELAY = 1.0
+STOP_TIMEOUT = 40.0
+
+
+def worker_for(chat_id: int | None, workers: int) -> int:
+    """Номер воркера для чата; апдейты без чата идут в воркер 0."""
+    return chat_id % workers if chat_id is not None else 0
+
+
+class WorkerSupervisor:
+    """Запускает воркеры и перезапускает их, если они падают."""
+
+    def __init__(self, workers: int, socket_dir: str, command: list[str] | None = None):
+        self.workers = workers
+        self.socket_dir = socket_dir
+        self.command = command or [sys.executable, os.path.abspath(sys.argv[0])]
+        self.sockets = [os.path.join(socket_dir, f"worker-{i}.sock") for i in range(workers)]
+        self._procs = [None] * workers
+        self._watchers = []
+        self._stopping = False
+
+    async def start(self):
+        os.makedirs(self.socket_dir, exist_ok=True)
+        for i in range(self.workers):
+            await self._spawn(i)
+            self._watchers.append(asyncio.create_task(self._watch(i)))
+
+    async def _spawn(self, index: int):
+        try:
+            os.remove(self.sockets[index])
+        except FileNotFoundError:
+            pass
+        env = {**os.environ, "BOT_WORKER_INDEX": str(index), "BOT_WORKER_SOCKET": self.sockets[index]}
+        self._procs[index] = await asyncio.create_subprocess_exec(*self.command, env=env)
+        logging.info(f"[cluster] Воркер {index} запущен, pid {self._procs[index].pid}")
+
+    async def _watch(self, index: int):
+        while not self._stopping:
+            code = await self._procs[index].wait()
+            if self._stopping:
+                return
+            logging.error(f"[cluster] Воркер {index} завершился с кодом {code}, перезапускаю")
+            await asyncio.sleep(RESTART_DELAY)
+            await self._spawn(index)
+
+    async def wait_ready(self, timeout: float = 60.0):
+        """Ждёт, пока все воркеры начнут отвечать на /healthz."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for socket_path in self.sockets:
+            while True:
+                try:
+                    async with ClientSession(connector=UnixConnector(path=socket_path)) as session:
+                        async with session.get("http://worker/healthz") as resp:
+                            if resp.status == 200:
+                                break
+                except (ClientError, OSError):
+                    pass
+                if loop.time() > deadline:
+                    raise RuntimeError(f"воркер {socket_path} не запустился за {timeout:.0f} с")
+                await asyncio.sleep(0.2)
+
+    async def stop(self):
+        """SIGTERM всем воркерам: они дорабатывают начатые апдейты и выходят."""
+        self._stopping = True
+        for watcher in self._watchers:
+            watcher.cancel()
+        procs = [p for p in self._procs if p is not None and p.returncode is None]
+        for proc in procs:
+            proc.terminate()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(p.wait() for p in procs)), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            for proc in procs:
+                if proc.returncode is None:
+                    proc.kill()
+
+
+class ClusterFront:
+    """Принимает апдейты от Telegram и раздаёт их воркерам по chat_id."""
+
+    def __init__(self, socket_paths: list[str], path: str = "/webhook", secret_token: str | None = None):
+        self.socket_paths = socket_paths
+        self.path = path
+        self.secret_token = secret_token
+        self._sessions = []
+        self._runner = None
+        self._draining = False
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self.app.router.add_get("/healthz", self.handle_health)
+        self.app.router.add_get("/metrics", self.handle_metrics)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            return web.Response(status=401)
+        if self._draining:
+            return web.Response(status=503)
+        body = await request.read()
+        try:
+            chat_id = update_chat_id(json.loads(body))
+        except (ValueError, AttributeError):
+            return web.Response(status=400)
+        index = worker_for(chat_id, len(self._sessions))
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            # Воркер отвечает сразу после постановки апдейта в очередь
+            async with self._sessions[index].post("http://worker/", data=body,
+                                                  headers={"Content-Type": "application/json"}) as resp:
+                return web.Response(status=resp.status)
+        except (ClientError, OSError) as e:
+            # Воркер перезапускается — Telegram повторит апдейт позже
+            logging.warning(f"[cluster] Воркер {index} недоступен: {e}")
+            return web.Response(status=503)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        workers = []
+        for index, session in enumerate(self._sessions):
+            try:
+                async with session.get("http://worker/healthz") as resp:
+                    workers.append(await resp.json())
+            except (ClientError, OSError, ValueError):
+                workers.append({"status": "down"})
+        healthy = not self._draining and all(w.get("status") == "ok" for w in workers)
+        return web.json_response({
+            "status": "ok" if healthy else ("draining" if self._draining else "degraded"),
+            "workers": workers,
+        }, status=200 if healthy else 503)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        texts = []
+        for index, session in enumerate(self._sessions):
+            try:
+                async with session.get("http://worker/metrics") as resp:
+                    texts.append(metrics.add_label(await resp.text(), "worker", index))
+            except (ClientError, OSError) as e:
+                logging.warning(f"[cluster] Нет метрик воркера {index}: {e}")
+        return web.Response(body=metrics.merge(texts).encode("utf-8"),
+                            headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    async def start(self, host: str, port: int):
+        self._sessions = [ClientSession(connector=UnixConnector(path=p)) for p in self.socket_paths]
+        self._runner = web.AppRunner(self.app, handle_signals=False, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info(f"[cluster] Фронт слушает {host}:{port}{self.path}, воркеров: {len(self.socket_paths)}")
+
+    async def stop(self):
+        """Перестаёт принимать апдейты и дожидается пересылки начатых."""
+        self._draining = True
+        await self._idle.wait()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        for session in self._sessions:
+            await session.close()
@@ -0,0 +1,109 @@
+"""Асинхронная загрузка json-файлов StarRailRes.
+
+Все файлы качаются параллельно через aiohttp. Для каждого запоминаются
+ETag/Last-Modified, и при следующем обновлении отправляется условный
+запрос: на ответ 304 файл не скачивается и не парсится заново, а берётся
+из предыдущего кэша.
+
+Предыдущий кэш — обычно ленивый ``GameData``: раздел читается с диска только
+если он действительно переиспользуется (304 или ошибка загрузки), и это
+чтение выполняется в потоке, а не в event loop.
+"""
+import os
+import json
+import asyncio
+import logging
+
+import aiohttp
+
+FETCH_TIMEOUT = 10
+
+
+async def _previous_section(previous, key):
+    """Раздел прежнего кэша или None; ленивый раздел читается с диска в потоке."""
+    if key not in previous:  # у GameData проверка не загружает раздел
+        return None
+    return await asyncio.to_thread(previous.get, key)
+
+
+async def _fetch_one(session, key, url, previous, validators):
+    """Возвращает (key, data | None, validators | None, status)."""
+    headers = {}
+    known = validators.get(key) or {}
+    # Условный запрос имеет смысл, только если есть что переиспользовать
+    if key in previous:
+        if known.get("etag"):
+            headers["If-None-Match"] = known["etag"]
+        if known.get("last_modified"):
+            headers["If-Modified-Since"] = known["last_modified"]
+    try:
+        async with session.get(url, headers=headers) as resp:
+            not_modified = resp.status == 304
+            if not not_modified:
+                resp.raise_for_status()
+                body = await resp.read()
+                new_validators = {
+                    "etag": resp.headers.get("ETag"),
+                    "last_modified": resp.headers.get("Last-Modified"),
+                }
+        if not_modified:
+            if not headers:
+                raise RuntimeError("304 в ответ на безусловный запрос")
+            section = await _previous_section(previous, key)
+            if section:
+                return key, section, known, "not_modified"
+            # Прежний раздел пуст или не прочитался с диска — качаем без условий
+            return await _fetch_one(session, key, url, {}, validators)
+        # Разбор мегабайтного json уводим с event loop
+        data = await asyncio.to_thread(json.loads, body)
+        return key, data, new_validators, "downloaded"
+    except Exception as e:
+        logging.warning(f"[cache] Не удалось скачать {url}: {e}")
+        return key, None, None, "failed"
+
+
+def _load_fallback(fallback_dir, key):
+    fallback_path = os.path.join(fallback_dir, f"{key}.json")
+    try:
+        with open(fallback_path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logging.error(f"[cache] Локальный файл {fallback_path} не найден; пропускаю.")
+        return {}
+
+
+async def fetch_sources(urls: dict, previous: dict | None = None, validators: dict | None = None,
+                        fallback_dir: str = "data", timeout: float = FETCH_TIMEOUT):
+    """Скачивает все ``urls`` параллельно.
+
+    ``previous`` — разделы из текущего кэша (dict или ленивый GameData), ``validators`` — сохранённые
+    ETag/Last-Modified. Возвращает ``(data, validators, stats)``, где stats —
+    счётчики downloaded / not_modified / failed.
+
+    Если файл скачать не удалось, используется прежний раздел кэша, а при его
+    отсутствии — локальная копия ``<fallback_dir>/<key>.json``.
+    """
+    previous = previous or {}
+    validators = validators or {}
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(timeout=client_timeout) as session:
+        results = await asyncio.gather(*(
+            _fetch_one(session, key, url, previous, validators) for key, url in urls.items()
+        ))
+
+    data, new_validators = {}, {}
+    stats = {"downloaded": 0, "not_modified": 0, "failed": 0}
+    for key, section, section_validators, status in results:
+        stats[status] += 1
+        if section is None:
+            section = await _previous_section(previous, key)
+            if section:
+                logging.warning(f"[cache] Оставляю прежнюю версию {key}.")
+                section_validators = validators.get(key)
+            else:
+                logging.warning(f"[cache] Пытаюсь загрузить локальный {key}.json…")
+                section = await asyncio.to_thread(_load_fallback, fallback_dir, key)
+        data[key] = section
+        if section_validators:
+            new_validators[key] = section_validators
+    return data, new_validators, stats
@@ -0,0 +1,472 @@
+"""Снимок справочных данных StarRailRes в памяти процесса.
+
+Раньше каждый обработчик заново открывал и парсил ``data/cache.json``.
+Теперь кэш читается один раз, результат хранится как неизменяемый снимок
+и атомарно подменяется после обновления кэша. Не чаще раза в
+``CHECK_INTERVAL`` секунд перед выдачей снимка проверяется mtime/размер
+манифеста, поэтому кэш, записанный другим процессом, тоже подхватывается
+без перезапуска.
+
+Вместе со снимком строится индекс (id → имя, имя → персонаж и т.д.),
+чтобы функции поиска из bot.py работали за O(1).
+
+Формат на диске (версия 2) — папка ``data/cache``::
+
+    manifest.json                         last_updated, ETag'и и для каждого
+                                          раздела: файл, sha256, размер
+    <игра>/<раздел>.<sha256[:16]>.json    компактный JSON одного раздела
+
+Разделы пишутся во временный файл и переименовываются; имя файла зависит от
+содержимого, поэтому неизменившиеся разделы не перезаписываются, а манифест,
+который подменяется последним, всегда ссылается на целые файлы. Разделы
+читаются лениво — при первом обращении — и сверяются с хэшем из манифеста.
+Если установлен orjson, он используется для (де)сериализации; формат тот же.
+Прежний ``data/cache.json`` читается, пока манифеста ещё нет.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from functools import cached_property
+
+import metrics
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен
+    orjson = None
+
+EMPTY_CACHE = {"last_updated": None, "game_data": {}}
+CACHE_VERSION = 2
+MANIFEST = "manifest.json"
+# Как часто GameDataStore.get сверяет манифест на диске (с): get вызывается почти
+# в каждом обработчике, а свои обновления процесс подставляет через publish сразу
+CHECK_INTERVAL = 1.0
+
+CACHE_LOAD_SECONDS = metrics.histogram(
+    "bot_cache_load_seconds", "Чтение кэша с диска: манифест или раздел справочника", ["part"])
+
+
+def dumps(data) -> bytes:
+    """Компактный JSON в UTF-8."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(raw: bytes):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def read_cache_file(path: str) -> dict:
+    """Читает кэш с диска; при любой ошибке возвращает пустой кэш."""
+    if not os.path.exists(path):
+        return dict(EMPTY_CACHE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return dict(EMPTY_CACHE)
+
+
+def write_cache_file(path: str, cache: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "game"
+
+
+def _atomic_write(path: str, raw: bytes):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_manifest(cache_dir: str) -> dict | None:
+    try:
+        with open(os.path.join(cache_dir, MANIFEST), "rb") as f:
+            manifest = loads(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.error(f"[cache] Не удалось прочитать манифест в {cache_dir}: {e}")
+        return None
+    if manifest.get("version") != CACHE_VERSION:
+        logging.warning(f"[cache] Неизвестная версия кэша {manifest.get('version')} в {cache_dir}")
+        return None
+    return manifest
+
+
+def write_cache(cache_dir: str, cache: dict):
+    """Сохраняет кэш по разделам и подменяет манифест.
+
+    Файлы, на которые не ссылаются ни новый, ни предыдущий манифест, удаляются;
+    предыдущее поколение оставляем, чтобы процесс, ещё не заметивший новый
+    манифест, мог дочитать свои разделы.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    previous = read_manifest(cache_dir) or {}
+    games = {}
+    for game_name, game_data in (cache.get("game_data") or {}).items():
+        game_dir = _slug(game_name)
+        os.makedirs(os.path.join(cache_dir, game_dir), exist_ok=True)
+        sections = {}
+        for section, value in game_data.items():
+            raw = dumps(value)
+            digest = hashlib.sha256(raw).hexdigest()
+            rel = f"{game_dir}/{_slug(section)}.{digest[:16]}.json"
+            path = os.path.join(cache_dir, rel)
+            if _file_signature(path) is None or os.path.getsize(path) != len(raw):
+                _atomic_write(path, raw)
+            sections[section] = {"file": rel, "sha256": digest, "size": len(raw)}
+        games[game_name] = sections
+    manifest = {
+        "version": CACHE_VERSION,
+        "last_updated": cache.get("last_updated"),
+        "http_validators": cache.get("http_validators", {}),
+        "games": games,
+    }
+    _atomic_write(os.path.join(cache_dir, MANIFEST), dumps(manifest))
+
+    keep = {MANIFEST}
+    for m in (manifest, previous):
+        for sections in m.get("games", {}).values():
+            keep.update(entry["file"] for entry in sections.values())
+    for root, _dirs, files in os.walk(cache_dir):
+        for name in files:
+            rel = os.path.relpath(os.path.join(root, name), cache_dir).replace(os.sep, "/")
+            if rel not in keep and not name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:
+                    pass
+
+
+def _section_loader(cache_dir: str, game_name: str, section: str, entry: dict):
+    def load():
+        with CACHE_LOAD_SECONDS.time(part=section):
+            return _load_section(cache_dir, game_name, section, entry)
+    return load
+
+
+def _load_section(cache_dir: str, game_name: str, section: str, entry: dict):
+    path = os.path.join(cache_dir, entry["file"])
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except OSError as e:
+        logging.error(f"[cache] Раздел {game_name}/{section} недоступен: {e}")
+        return {}
+    if hashlib.sha256(raw).hexdigest() != entry["sha256"]:
+        logging.error(f"[cache] Раздел {game_name}/{section} повреждён (не совпал sha256)")
+        return {}
+    return loads(raw)
+
+
+def read_cache(cache_dir: str, legacy_path: str | None = None) -> dict:
+    """Читает манифест; сами разделы загрузятся при первом обращении.
+
+    Без манифеста читает прежний одиночный файл ``legacy_path``.
+    """
+    manifest = read_manifest(cache_dir)
+    if manifest is None:
+        return read_cache_file(legacy_path) if legacy_path else dict(EMPTY_CACHE)
+    game_data = {}
+    for game_name, sections in manifest.get("games", {}).items():
+        loaders = {section: _section_loader(cache_dir, game_name, section, entry)
+                   for section, entry in sections.items()}
+        game_data[game_name] = GameData(loaders=loaders)
+    return {
+        "last_updated": manifest.get("last_updated"),
+        "game_data": game_data,
+        "http_validators": manifest.get("http_validators", {}),
+    }
+
+
+def _file_signature(path: str):
+    """(mtime_ns, size) файла или None, если файла нет."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class GameDataIndex:
+    """Словари для O(1)-поиска по справочнику одной игры.
+
+    Каждая группа словарей строится при первом обращении, поэтому из кэша
+    загружаются только нужные обработчику разделы. При совпадающих id
+    выигрывает первая запись — так же, как в прежних линейных поисках.
+    """
+
+    def __init__(self, game_data: Mapping):
+        self._data = game_data
+
+    @cached_property
+    def path_names(self) -> dict:
+        names = {}
+        for path in self._data.get("paths", {}).values():
+            names.setdefault(path["id"], path["name"])
+        return names
+
+    @cached_property
+    def element_names(self) -> dict:
+        names = {}
+        for el in self._data.get("elements", {}).values():
+            names.setdefault(el["id"], el["name"])
+        return names
+
+    @cached_property
+    def relic_set_names(self) -> dict:
+        self._build_relic_sets()
+        return self.__dict__["relic_set_names"]
+
+    @cached_property
+    def planar_names(self) -> dict:
+        self._build_relic_sets()
+        return self.__dict__["planar_names"]
+
+    def _build_relic_sets(self):
+        relic_set_names = {}
+        planar_names = {}
+        for s in self._data.get("relic_sets", {}).values():
+            relic_set_names.setdefault(s["id"], s["name"])
+            if s.get("type") == "Planar":
+                planar_names.setdefault(s["id"], s["name"])
+        self.__dict__.update(relic_set_names=relic_set_names, planar_names=planar_names)
+
+    # id → (name, rarity); rarity → [id]; (path, rarity) → [id]
+    @cached_property
+    def cones(self) -> dict:
+        self._build_cones()
+        return self.__dict__["cones"]
+
+    @cached_property
+    def cones_by_rarity(self) -> dict:
+        self._build_cones()
+        return self.__dict__["cones_by_rarity"]
+
+    @cached_property
+    def cones_by_path_rarity(self) -> dict:
+        self._build_cones()
+        return self.__dict__["cones_by_path_rarity"]
+
+    def _build_cones(self):
+        cones = {}
+        by_rarity = {}
+        by_path_rarity = {}
+        for cone in self._data.get("light_cones", {}).values():
+            if cone["id"] in cones:
+                continue
+            rarity = cone.get("rarity", "")
+            cones[cone["id"]] = (cone["name"], rarity)
+            by_rarity.setdefault(rarity, []).append(cone["id"])
+            by_path_rarity.setdefault((cone.get("path"), rarity), []).append(cone["id"])
+        self.__dict__.update(cones=cones, cones_by_rarity=by_rarity, cones_by_path_rarity=by_path_rarity)
+
+    @cached_property
+    def main_stat_names(self) -> dict:
+        return self._affix_names(self._data.get("relic_main_affixes", {}))
+
+    @cached_property
+    def sub_stat_names(self) -> dict:
+        return self._affix_names(self._data.get("relic_sub_affixes", {}))
+
+    @cached_property
+    def characters_by_name(self) -> dict:
+        self._build_characters()
+        return self.__dict__["characters_by_name"]
+
+    @cached_property
+    def characters_by_id(self) -> dict:
+        self._build_characters()
+        return self.__dict__["characters_by_id"]
+
+    @cached_property
+    def characters_by_path(self) -> dict:
+        self._build_characters()
+        return self.__dict__["characters_by_path"]
+
+    @cached_property
+    def elements(self) -> list:
+        return sorted(self.characters_by_path)
+
+    def _build_characters(self):
+        by_name = {}
+        by_id = {}
+        by_path = {}
+        for c in self._data.get("characters", {}).values():
+            by_name.setdefault(c.get("name"), c)
+            by_id.setdefault(str(c.get("id")), c)
+            if c.get("path"):
+                by_path.setdefault(c["path"], []).append(c)
+        self.__dict__.update(characters_by_name=by_name, characters_by_id=by_id, characters_by_path=by_path)
+
+    @staticmethod
+    def _affix_names(affix_groups: dict) -> dict:
+        # В ru это словарь affixes, для отображения берём property первого
+        names = {}
+        for stat in affix_groups.values():
+            if stat["id"] in names:
+                continue
+            affixes = stat.get("affixes", {})
+            first = next(iter(affixes.values()), None)
+            names[stat["id"]] = first.get("property", stat["id"]) if first else stat["id"]
+        return names
+
+
+class GameData(Mapping):
+    """Справочник игры (только чтение) с прикреплённым индексом ``index``.
+
+    Разделы либо переданы готовыми (``sections``), либо загружаются при
+    первом обращении через ``loaders`` (раздел → функция без аргументов).
+    """
+
+    def __init__(self, sections: dict | None = None, loaders: dict | None = None):
+        self._sections = dict(sections or {})
+        self._loaders = {k: v for k, v in (loaders or {}).items() if k not in self._sections}
+        self._lock = threading.Lock()
+        self.index = GameDataIndex(self)
+
+    def __getitem__(self, section):
+        try:
+            return self._sections[section]
+        except KeyError:
+            pass
+        if section not in self._loaders:
+            raise KeyError(section)
+        with self._lock:
+            if section not in self._sections:
+                self._sections[section] = self._loaders[section]()
+        return self._sections[section]
+
+    def __iter__(self):
+        yield from self._sections
+        yield from (k for k in self._loaders if k not in self._sections)
+
+    def __len__(self):
+        return len(self._sections.keys() | self._loaders.keys())
+
+    def __contains__(self, section):
+        return section in self._sections or section in self._loaders
+
+    @property
+    def loaded_sections(self) -> list:
+        """Какие разделы уже прочитаны с диска (для отладки и бенчмарков)."""
+        return list(self._sections)
+
+
+def get_index(game_data: Mapping) -> GameDataIndex:
+    """Индекс справочника; для «голого» dict строится на лету."""
+    index = getattr(game_data, "index", None)
+    if index is None:
+        index = GameDataIndex(game_data)
+    return index
+
+
+def _with_indexes(cache: dict) -> dict:
+    games = cache.get("game_data") or {}
+    indexed = {}
+    for name, data in games.items():
+        try:
+            indexed[name] = data if isinstance(data, GameData) else GameData(sections=data)
+        except Exception as e:
+            logging.error(f"[cache] Не удалось построить индекс для {name}: {e}")
+            indexed[name] = data
+    return {**cache, "game_data": indexed}
+
+
+@dataclass(frozen=True)
+class GameDataSnapshot:
+    """Неизменяемый снимок кэша. Содержимое ``cache`` менять нельзя."""
+    cache: dict
+    generation: int
+    signature: tuple | None = field(default=None, compare=False)
+
+    @property
+    def last_updated(self):
+        return self.cache.get("last_updated")
+
+    def game(self, game_name: str):
+        """Справочник конкретной игры или None."""
+        return self.cache.get("game_data", {}).get(game_name)
+
+
+class GameDataStore:
+    """Хранит текущий снимок и перечитывает кэш, только если манифест изменился.
+
+    Пока манифеста нет, источником служит прежний файл ``legacy_path``.
+    """
+
+    def __init__(self, cache_dir: str, legacy_path: str | None = None, check_interval: float = CHECK_INTERVAL):
+        self.cache_dir = cache_dir
+        self.legacy_path = legacy_path
+        self.check_interval = check_interval
+        self._next_check = 0.0
+        self._manifest_path = os.path.join(cache_dir, MANIFEST)
+        self._lock = threading.Lock()
+        self._snapshot: GameDataSnapshot | None = None
+        self._generation = 0
+
+    def _signature(self):
+        signature = _file_signature(self._manifest_path)
+        if signature is None and self.legacy_path:
+            legacy = _file_signature(self.legacy_path)
+            return ("legacy", legacy) if legacy else None
+        return signature
+
+    def get(self) -> GameDataSnapshot:
+        """Текущий снимок; при изменении кэша на диске строит новый.
+
+        Диск проверяется не чаще раза в ``check_interval`` секунд: изменение,
+        записанное другим процессом, видно с такой задержкой.
+        """
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now < self._next_check:
+            metrics.CACHE_REQUESTS.inc(cache="snapshot", result="hit")
+            return snapshot
+        self._next_check = now + self.check_interval
+        signature = self._signature()
+        if snapshot is not None and snapshot.signature == signature:
+            metrics.CACHE_REQUESTS.inc(cache="snapshot", result="hit")
+            return snapshot
+        metrics.CACHE_REQUESTS.inc(cache="snapshot", result="miss")
+        with self._lock:
+            # Другой поток мог успеть перечитать кэш, пока мы ждали блокировку
+            snapshot = self._snapshot
+            signature = self._signature()
+            if snapshot is not None and snapshot.signature == signature:
+                return snapshot
+            if snapshot is not None:
+                logging.info(f"[cache] {self.cache_dir} изменён на диске, перечитываю…")
+            with CACHE_LOAD_SECONDS.time(part="manifest"):
+                cache = read_cache(self.cache_dir, self.legacy_path)
+            return self._swap(cache, signature)
+
+    def publish(self, cache: dict) -> GameDataSnapshot:
+        """Подменяет снимок свежими данными (после записи кэша на диск)."""
+        with self._lock:
+            return self._swap(cache, self._signature())
+
+    def _swap(self, cache: dict, signature) -> GameDataSnapshot:
+        self._generation += 1
+        cache = _with_indexes(cache)
+        snapshot = GameDataSnapshot(cache=cache, generation=self._generation, signature=signature)
+        # Присваивание ссылки атомарно: читатели видят либо старый, либо новый снимок
+        self._snapshot = snapshot
+        return snapshot
@@ -0,0 +1,59 @@
+"""Межпроцессные блокировки на файлах (flock).
+
+Нужны, когда бот запущен несколькими процессами (``WEBHOOK_WORKERS``) над
+одной папкой data: журнал подписчиков, обновление кэша и продолжение
+рассылок не должны выполняться двумя процессами одновременно. Там, где
+fcntl нет (Windows), блокировка ничего не делает — такой запуск всегда
+однопроцессный.
+"""
+import os
+
+try:
+    import fcntl
+except ImportError:  # не POSIX
+    fcntl = None
+
+
+class FileLock:
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Берёт блокировку. Без ``blocking`` сразу возвращает False, если она занята.
+
+        Без ``blocking`` занятой считается и блокировка, которую держит этот же
+        объект: иначе второй вызывающий в том же процессе решил бы, что она его,
+        и своим ``release`` снял бы её с первого.
+        """
+        if self._fd is not None:
+            return blocking
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                os.close(fd)
+                return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,248 @@
+"""Преобразование псевдо-markdown из best_builds.json в HTML для Telegram.
+
+Один проход по тексту скомпилированным регулярным выражением:
+
+* ``*жирный*`` → ``<b>``, ``_курсив_`` → ``<i>`` (пары ищутся в пределах строки);
+* ``~зачёркнутый~`` → маркеры заменяются пробелами, текст остаётся (как и раньше:
+  ``a~b~c`` → ``a b c``, слова не склеиваются);
+* ````` ```код``` ````` → ``<code>``, содержимое не размечается;
+* ``[текст](https://…)`` → ``<a href="…">``;
+* допустимые в Telegram HTML-теги пропускаются как есть, всё остальное
+  (``<95``, ``A & B``) экранируется; уже готовые сущности (``&lt;``) не
+  трогаются, поэтому повторный вызов не портит текст;
+* теги балансируются: лишние закрывающие отбрасываются, незакрытые
+  закрываются в конце.
+
+Telegram считает длину подписи по видимому тексту в UTF-16:
+до 1024 символов для подписи к фото и до 4096 для сообщения.
+"""
+import re
+import html
+
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+
+# Теги, которые понимает parse_mode=HTML
+ALLOWED_TAGS = frozenset({
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+    "code", "pre", "a", "tg-spoiler", "blockquote",
+})
+
+_TAG = r"(?P<tag><(?P<close>/)?(?P<name>[a-zA-Z][a-zA-Z-]*)(?P<attrs>(?:\s+[^<>]*)?)>)"
+_ENTITY = r"(?P<entity>&(?:[a-zA-Z]+|#\d+|#x[0-9a-fA-F]+);)"
+_SPECIAL = r"(?P<special>[<>&])"
+# Полный разбор: markdown + HTML
+_MARKDOWN_RE = re.compile(
+    r"(?P<fence>```(?P<code>.*?)```)"
+    r"|(?P<link>\[(?P<ltext>[^\]\n]*)\]\((?P<url>https?://[^\s)]+)\))"
+    rf"|{_TAG}|{_ENTITY}"
+    r"|(?P<marker>\*|_+|~)"
+    rf"|{_SPECIAL}",
+    re.DOTALL,
+)
+# Только HTML: теги, сущности и символы, которые надо экранировать
+_HTML_RE = re.compile(rf"{_TAG}|{_ENTITY}|{_SPECIAL}")
+_MARKDOWN_CHARS = frozenset("*_~`[<>&")
+_HTML_CHARS = frozenset("<>&")
+_HREF_RE = re.compile(r'^\s+href\s*=\s*"([^"<>]*)"\s*$')
+_ESCAPES = {"<": "&lt;", ">": "&gt;", "&": "&amp;"}
+# Из именованных сущностей Telegram понимает только эти (числовые — все)
+_NAMED_ENTITIES = frozenset({"&lt;", "&gt;", "&amp;", "&quot;"})
+# Маркер markdown → HTML-тег (None: маркер заменяется пробелом)
+_MARKERS = {"*": "b", "_": "i", "~": None}
+
+
+# Быстрый путь: в best_builds.json почти вся разметка — готовые <b>…</b>/<i>…</i>
+_SIMPLE_TAG_RE = re.compile(r"<(/?)(b|strong|i|em|u|ins|s|strike|del|code|pre|tg-spoiler|blockquote)>")
+_NOT_SIMPLE_CHARS = frozenset("*_~`[&")
+
+
+def _is_simple_html(text: str) -> bool:
+    """Текст, который _convert вернул бы без изменений: только парные теги без атрибутов."""
+    if not _NOT_SIMPLE_CHARS.isdisjoint(text):
+        return False
+    rest = _SIMPLE_TAG_RE.sub("", text)
+    if "<" in rest or ">" in rest:
+        return False
+    stack = []
+    for closing, name in _SIMPLE_TAG_RE.findall(text):
+        if not closing:
+            stack.append(name)
+        elif not stack or stack.pop() != name:
+            return False
+    return not stack
+
+
+def _is_known_entity(entity: str) -> bool:
+    return entity in _NAMED_ENTITIES or (entity.startswith("&#") and html.unescape(entity) != entity)
+
+
+def _convert(text: str, token_re) -> str:
+    out = []
+    # Стек открытых элементов: [тег, открывающая разметка, маркер | None, индекс в out]
+    stack = []
+    # Сколько маркеров markdown сейчас открыто (они живут до конца строки)
+    markers = 0
+    pos = 0
+
+    def open_element(tag, opening, marker=None):
+        stack.append([tag, opening, marker, len(out)])
+        out.append(opening)
+
+    def close_element(match):
+        # Закрываем верхний элемент, для которого match(...) истинно; вложенные
+        # в него закрываем и после него открываем заново
+        # (у «~» тега нет: пробел ставится только при его собственном закрытии)
+        reopen = []
+        while stack:
+            entry = stack.pop()
+            matched = match(entry)
+            if entry[0]:
+                out.append(f"</{entry[0]}>")
+            elif matched:
+                out.append(" ")
+            if matched:
+                break
+            reopen.append(entry)
+        for entry in reversed(reopen):
+            stack.append(entry)
+            if entry[0]:
+                entry[3] = len(out)
+                out.append(entry[1])
+
+    def drop_line_markers():
+        # Непарный маркер до конца строки остаётся обычным символом
+        for entry in [e for e in stack if e[2] is not None]:
+            stack.remove(entry)
+            out[entry[3]] = entry[2]
+
+    for m in token_re.finditer(text):
+        start = m.start()
+        if start > pos:
+            chunk = text[pos:start]
+            # Перевод строки закрывает все маркеры; куда именно в тексте
+            # выше он попал, для результата неважно
+            if markers and "\n" in chunk:
+                drop_line_markers()
+                markers = 0
+            out.append(chunk)
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == "special":
+            out.append(_ESCAPES[m.group(0)])
+        elif kind == "tag":
+            name = m.group("name").lower()
+            attrs = m.group("attrs")
+            if name not in ALLOWED_TAGS:
+                out.append(html.escape(m.group(0), quote=False))
+            elif m.group("close"):
+                if stack and stack[-1][0] == name and stack[-1][2] is None:
+                    stack.pop()
+                    out.append(f"</{name}>")
+                # Лишний закрывающий тег просто отбрасываем
+                elif any(e[0] == name and e[2] is None for e in stack):
+                    close_element(lambda e: e[0] == name and e[2] is None)
+            elif not attrs:
+                if name == "a":
+                    out.append("&lt;a&gt;")
+                else:
+                    open_element(name, f"<{name}>")
+            else:
+                href = _HREF_RE.match(attrs) if name == "a" else None
+                if href:
+                    open_element("a", f'<a href="{href.group(1)}">')
+                else:
+                    out.append(html.escape(m.group(0), quote=False))
+        elif kind == "marker":
+            raw = m.group(0)
+            marker = raw[0]
+            if markers and any(e[2] is not None and e[2][0] == marker for e in stack):
+                close_element(lambda e: e[2] is not None and e[2][0] == marker)
+                markers -= 1
+            else:
+                tag = _MARKERS[marker]
+                open_element(tag, f"<{tag}>" if tag else " ", raw)
+                markers += 1
+        elif kind == "entity":
+            entity = m.group(0)
+            # Неизвестная Telegram сущность — это просто текст с «&»
+            out.append(entity if _is_known_entity(entity) else "&amp;" + entity[1:])
+        elif kind == "fence":
+            out.append(f"<code>{html.escape(m.group('code'), quote=False)}</code>")
+        else:  # link
+            url = html.escape(m.group("url"))
+            out.append(f'<a href="{url}">{html.escape(m.group("ltext"), quote=False)}</a>')
+    if pos < len(text):
+        out.append(text[pos:])
+    if markers:
+        drop_line_markers()
+    while stack:
+        entry = stack.pop()
+        if entry[0]:
+            out.append(f"</{entry[0]}>")
+    return "".join(out)
+
+
+def to_html(text: str) -> str:
+    """Псевдо-markdown + HTML → безопасный для Telegram HTML."""
+    if not text:
+        return ""
+    if _MARKDOWN_CHARS.isdisjoint(text) or _is_simple_html(text):
+        return text
+    return _convert(text, _MARKDOWN_RE)
+
+
+def sanitize_html(text: str) -> str:
+    """Только экранирование и балансировка, без разбора markdown."""
+    if not text:
+        return ""
+    if _HTML_CHARS.isdisjoint(text) or _is_simple_html(text):
+        return text
+    return _convert(text, _HTML_RE)
+
+
+_STRIP_TAGS_RE = re.compile(r"<[^<>]*>")
+
+
+def visible_length(text: str) -> int:
+    """Длина текста так, как её считает Telegram: без тегов, в UTF-16."""
+    plain = html.unescape(_STRIP_TAGS_RE.sub("", text))
+    return len(plain.encode("utf-16-le")) // 2
+
+
+def fits_caption(text: str) -> bool:
+    return visible_length(text) <= CAPTION_LIMIT
+
+
+def fits_message(text: str) -> bool:
+    return visible_length(text) <= MESSAGE_LIMIT
+
+
+_CHECK_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z-]*)((?:\s+[^<>]*)?)>|&(?:[a-zA-Z]+|#\d+|#x[0-9a-fA-F]+);|[<>&]")
+
+
+def check_html(text: str) -> str | None:
+    """Строгая проверка в духе парсера Telegram. Возвращает описание ошибки или None."""
+    stack = []
+    for m in _CHECK_RE.finditer(text):
+        token = m.group(0)
+        if token in "<>&":
+            return f"неэкранированный символ {token!r} на позиции {m.start()}"
+        if token.startswith("&"):
+            if not _is_known_entity(token):
+                return f"неизвестная сущность {token}"
+            continue
+        closing, name, attrs = m.group(1), m.group(2).lower(), m.group(3)
+        if name not in ALLOWED_TAGS:
+            return f"неподдерживаемый тег <{name}>"
+        if closing:
+            if not stack or stack[-1] != name:
+                return f"закрывающий </{name}> без пары"
+            stack.pop()
+        else:
+            if attrs.strip() and not (name == "a" and _HREF_RE.match(attrs)):
+                return f"недопустимые атрибуты у <{name}>"
+            stack.append(name)
+    if stack:
+        return f"незакрытый тег <{stack[-1]}>"
+    return None
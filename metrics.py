@@ -0,0 +1,213 @@
+"""Метрики в текстовом формате Prometheus, без внешних зависимостей.
+
+Метрики объявляются в модулях, где измеряется величина::
+
+    FETCH_SECONDS = metrics.histogram("bot_fetch_seconds", "Загрузка справочника")
+    with FETCH_SECONDS.time():
+        ...
+
+и отдаются все разом через ``REGISTRY.render()`` (``GET /metrics`` в
+webhook.py). Значения, которые и так считает объект (апдейты в работе у
+WebhookServer и т.п.), регистрируются функцией ``collect`` и читаются в
+момент запроса.
+
+Значения меток должны браться из ограниченного набора: каждая новая
+комбинация меток — новый временной ряд.
+"""
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Секунды: от быстрых колбэков до загрузки справочника с GitHub
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels=(), collect=None):
+        """``collect`` — функция без аргументов, возвращающая {значения меток: число}."""
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[n]) for n in self.label_names)
+
+    def _samples(self):
+        if self._collect is not None:
+            values = self._collect()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [(k if isinstance(k, tuple) else (k,), v) for k, v in values.items()]
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._samples():
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счётчики по корзинам..., сумма, количество]
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время блока (работает и вокруг ``await``)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, state in self._samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', '+Inf')])} {state[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(state[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            # Повторная регистрация (например, новый WebhookServer) заменяет прежнюю
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name}: ошибка сбора: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels=(), collect=None) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels, collect))
+
+
+def gauge(name: str, help: str, labels=(), collect=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labels, collect))
+
+
+def histogram(name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def add_label(text: str, name: str, value) -> str:
+    """Добавляет метку ко всем сэмплам (для сводки метрик нескольких процессов)."""
+    label = f'{name}="{_escape(value)}"'
+    lines = []
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            lines.append(line)
+            continue
+        series, _, sample = line.rpartition(" ")
+        if series.endswith("}"):
+            series = f"{series[:-1]},{label}}}"
+        else:
+            series = f"{series}{{{label}}}"
+        lines.append(f"{series} {sample}")
+    return "\n".join(lines)
+
+
+def merge(texts) -> str:
+    """Склеивает выводы render() нескольких процессов по семействам метрик.
+
+    Prometheus требует, чтобы сэмплы одной метрики шли подряд под одним
+    HELP/TYPE, поэтому сэмплы группируются по предшествующему TYPE.
+    """
+    families = {}  # имя -> [HELP, TYPE, сэмплы...]
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                family = families.setdefault(line.split(" ", 3)[2], [line, None])
+            elif line.startswith("# TYPE "):
+                family = families.setdefault(line.split(" ", 3)[2], [None, None])
+                family[1] = family[1] or line
+            elif line and not line.startswith("#") and family is not None:
+                family.append(line)
+    lines = []
+    for family in families.values():
+        lines.extend(line for line in family if line)
+    return "\n".join(lines) + "\n"
+
+
+# Общая для модулей метрика: попадания в кэши в памяти (снимок справочника,
+# file_id портретов, клавиатуры, индекс имён)
+CACHE_REQUESTS = counter("bot_cache_requests_total", "Обращения к кэшам в памяти", ["cache", "result"])
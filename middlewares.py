@@ -0,0 +1,187 @@
+"""Middleware диспетчера aiogram и сессии бота."""
+import time
+import asyncio
+import logging
+import contextvars
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import CallbackQuery, InlineQuery, Message, TelegramObject
+
+import metrics
+from profiling import Profiler
+
+HANDLER_SECONDS = metrics.histogram(
+    "bot_handler_seconds", "Время обработки апдейта по типу нажатия/команды", ["event"])
+HANDLER_ERRORS = metrics.counter(
+    "bot_handler_errors_total", "Исключения, вылетевшие из обработчиков", ["event"])
+CALLBACK_DUPLICATES = metrics.counter(
+    "bot_callback_duplicates_total", "Повторные нажатия той же кнопки, отброшенные без обработки", ["event"])
+API_CALLS_AVOIDED = metrics.counter(
+    "bot_api_calls_avoided_total", "Запросы к Bot API, которые сделали бы отброшенные повторные нажатия")
+
+# Окно, в котором повтор нажатия той же кнопки того же сообщения считается дублем
+DUPLICATE_WINDOW = 1.5
+
+# Счётчик запросов к Bot API текущего апдейта (ставит CallbackMiddleware)
+_api_calls = contextvars.ContextVar("api_calls", default=None)
+
+# Префиксы callback_data (старые и из callbacks.py) -> метка; прочие — «other»,
+# чтобы подделанные callback_data не плодили временные ряды
+CALLBACK_LABELS = {
+    "game": "game:", "feature": "feature:", "f": "feature:",
+    "element": "element:", "p": "element:", "char": "char:", "c": "char:",
+    "back": "back:", "info": "info:", "sub": "sub:", "teams": "teams:",
+}
+
+
+def event_label(event: TelegramObject) -> str:
+    if isinstance(event, CallbackQuery):
+        prefix = (event.data or "").split(":", 1)[0]
+        return CALLBACK_LABELS.get(prefix, "other")
+    if isinstance(event, Message):
+        return "command" if (event.text or "").startswith("/") else "message"
+    if isinstance(event, InlineQuery):
+        return "inline"
+    return type(event).__name__.lower()
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Outer-middleware: время и ошибки каждого апдейта с меткой по префиксу колбэка."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        label = event_label(event)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(event=label)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            HANDLER_SECONDS.observe(elapsed, event=label)
+            if elapsed > 1.0:
+                logging.info(f"[metrics] Медленный апдейт {label}: {elapsed * 1000:.0f} мс")
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Outer-middleware: выборочно выполняет апдейты под профилировщиком (см. profiling.py)."""
+
+    def __init__(self, profiler: Profiler):
+        self.profiler = profiler
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.profiler.should_sample():
+            return await handler(event, data)
+        return await self.profiler.run(event_label(event), lambda: handler(event, data))
+
+
+class ApiCallCounter(BaseRequestMiddleware):
+    """Middleware сессии: считает запросы к Bot API, сделанные при обработке колбэка."""
+
+    async def __call__(self, make_request, bot, method):
+        calls = _api_calls.get()
+        if calls is not None:
+            calls[0] += 1
+        return await make_request(bot, method)
+
+
+class CallbackMiddleware(BaseMiddleware):
+    """Outer-middleware колбэков.
+
+    * Сразу отвечает на колбэк (в фоне), чтобы у кнопки пропали «часики» и
+      пользователь не нажимал её снова. Колбэки с префиксами из
+      ``answered_by_handler`` обработчик гасит сам — с текстом уведомления.
+    * Нажатия одного чата обрабатываются по очереди.
+    * Повтор нажатия той же кнопки того же сообщения, пока первое в работе
+      или в течение ``window`` секунд после него, отбрасывается. Сколько
+      запросов к Bot API это сэкономило, оценивается по первому нажатию
+      (нужен ``ApiCallCounter`` в сессии бота).
+    """
+
+    def __init__(self, window: float = DUPLICATE_WINDOW, answered_by_handler=()):
+        self.window = window
+        self.answered_by_handler = tuple(answered_by_handler)
+        self._chats = {}       # chat_id -> [asyncio.Lock, ожидающих]
+        self._in_flight = {}   # ключ нажатия -> сколько повторов отброшено
+        self._recent = {}      # ключ нажатия -> (время завершения, запросов к API); по порядку завершения
+        self._acks = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, CallbackQuery):
+            return await handler(event, data)
+        answered = not (event.data or "").startswith(self.answered_by_handler)
+        if answered:
+            self._schedule_ack(event)
+
+        chat_id = event.message.chat.id if event.message else event.from_user.id
+        message_id = event.message.message_id if event.message else event.inline_message_id
+        key = (chat_id, message_id, event.data)
+        self._forget_expired()
+        recent = self._recent.get(key)
+        if key in self._in_flight or recent is not None:
+            # Дубль гасим в любом случае: обработчик, который ответил бы сам, не запустится
+            if not answered:
+                self._schedule_ack(event)
+            CALLBACK_DUPLICATES.inc(event=event_label(event))
+            if recent is not None:
+                API_CALLS_AVOIDED.inc(recent[1])
+            else:
+                self._in_flight[key] += 1
+            return None
+
+        self._in_flight[key] = 0
+        entry = self._chats.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        calls = [0]
+        token = _api_calls.set(calls)
+        try:
+            async with entry[0]:
+                return await handler(event, data)
+        finally:
+            _api_calls.reset(token)
+            dropped = self._in_flight.pop(key)
+            if dropped:
+                API_CALLS_AVOIDED.inc(calls[0] * dropped)
+            self._recent.pop(key, None)
+            self._recent[key] = (time.monotonic(), calls[0])
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat_id]
+
+    def _forget_expired(self):
+        deadline = time.monotonic() - self.window
+        while self._recent:
+            key, (finished, _) = next(iter(self._recent.items()))
+            if finished > deadline:
+                break
+            del self._recent[key]
+
+    def _schedule_ack(self, event: CallbackQuery):
+        task = asyncio.create_task(self._ack(event))
+        self._acks.add(task)
+        task.add_done_callback(self._acks.discard)
+
+    @staticmethod
+    async def _ack(event: CallbackQuery):
+        try:
+            await event.answer()
+        except Exception as e:
+            # Колбэк мог устареть (старше 15 минут) — обработке это не мешает
+            logging.debug(f"[callbacks] Не удалось ответить на колбэк: {e}")
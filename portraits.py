@@ -0,0 +1,88 @@
+"""Реестр Telegram file_id для портретов персонажей.
+
+После первой загрузки картинки Telegram возвращает file_id, по которому её
+можно отправлять повторно без выгрузки файла. Реестр хранит file_id по пути
+к картинке вместе с хэшем её содержимого: если файл заменили, запись
+считается недействительной и картинка загружается заново.
+
+Если картинка отправляется не с диска, а из pack-файла (assets.py), хэш
+варианта передаётся в ``digest`` — тогда файл на диске не проверяется.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+
+
+def _atomic_write_json(path: str, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class PortraitRegistry:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # art_path -> {"hash": ..., "file_id": ...}
+        self._entries = self._load()
+        # (art_path, mtime_ns, size) -> sha1; чтобы не читать файл на каждый запрос
+        self._hashes = {}
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.warning(f"[portraits] Не удалось прочитать {self.path}: {e}")
+            return {}
+
+    def content_hash(self, art_path: str) -> str | None:
+        try:
+            st = os.stat(art_path)
+        except OSError:
+            return None
+        key = (art_path, st.st_mtime_ns, st.st_size)
+        digest = self._hashes.get(key)
+        if digest is None:
+            with open(art_path, "rb") as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            self._hashes[key] = digest
+        return digest
+
+    def get(self, art_path: str, digest: str | None = None) -> str | None:
+        """file_id для картинки или None, если её ещё не загружали / она изменилась."""
+        entry = self._entries.get(art_path)
+        if not entry:
+            return None
+        if entry.get("hash") != (digest or self.content_hash(art_path)):
+            self.forget(art_path)
+            return None
+        return entry.get("file_id")
+
+    def remember(self, art_path: str, file_id: str, digest: str | None = None):
+        digest = digest or self.content_hash(art_path)
+        if digest is None:
+            return
+        with self._lock:
+            self._entries[art_path] = {"hash": digest, "file_id": file_id}
+            self._save()
+
+    def forget(self, art_path: str):
+        with self._lock:
+            if self._entries.pop(art_path, None) is not None:
+                self._save()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _save(self):
+        try:
+            _atomic_write_json(self.path, self._entries)
+        except Exception as e:
+            logging.warning(f"[portraits] Не удалось сохранить {self.path}: {e}")
@@ -0,0 +1,118 @@
+"""Профилирование обработчиков по запросу администратора (/profile).
+
+Пока режим выключен, middleware только проверяет флаг. Во включённом режиме
+доля ``fraction`` апдейтов выполняется под cProfile (и, по желанию, под
+tracemalloc):
+
+* профиль каждого такого апдейта пишется в ``<dir>/<время>-<событие>-<мс>.pstats``,
+  хранятся последние ``keep`` файлов (``python -m pstats <файл>``);
+* по ``top`` самым медленным апдейтам в лог пишется разбивка по функциям
+  (cumulative) и, с tracemalloc, главные места выделения памяти.
+
+cProfile видит весь поток, поэтому в профиль попадают и корутины других
+апдейтов, выполнявшиеся во время ``await``. Одновременно профилируется
+только один апдейт — остальные в это время проходят без профиля.
+"""
+import io
+import os
+import time
+import heapq
+import pstats
+import random
+import logging
+import cProfile
+import tracemalloc
+
+DEFAULT_FRACTION = 0.1
+KEEP_FILES = 50
+TOP_SLOWEST = 10
+STATS_LINES = 15
+
+
+class Profiler:
+    def __init__(self, directory: str, keep: int = KEEP_FILES, top: int = TOP_SLOWEST):
+        self.directory = directory
+        self.keep = keep
+        self.top = top
+        self.enabled = False
+        self.fraction = DEFAULT_FRACTION
+        self.memory = False
+        self.sampled = 0
+        self._busy = False
+        self._slowest = []  # min-heap (мс, событие, файл)
+
+    def enable(self, fraction: float = DEFAULT_FRACTION, memory: bool = False):
+        self.fraction = min(1.0, max(0.0, fraction))
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        self._slowest = []
+        self.sampled = 0
+        self.enabled = True
+        logging.info(f"[profile] Включено: {self.fraction:.0%} апдейтов, tracemalloc: {memory}")
+
+    def disable(self):
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = False
+        logging.info(f"[profile] Выключено, профилей: {self.sampled}")
+
+    def should_sample(self) -> bool:
+        return self.enabled and not self._busy and random.random() < self.fraction
+
+    async def run(self, label: str, call):
+        """Выполняет ``await call()`` под профилировщиком."""
+        self._busy = True
+        profile = cProfile.Profile()
+        before = tracemalloc.take_snapshot() if self.memory and tracemalloc.is_tracing() else None
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            return await call()
+        finally:
+            profile.disable()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._busy = False
+            try:
+                self._record(label, elapsed_ms, profile, before)
+            except Exception as e:
+                logging.warning(f"[profile] Не удалось сохранить профиль: {e}")
+
+    def _record(self, label: str, elapsed_ms: float, profile: cProfile.Profile, before):
+        self.sampled += 1
+        os.makedirs(self.directory, exist_ok=True)
+        safe_label = "".join(ch if ch.isalnum() else "_" for ch in label) or "update"
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.sampled:05d}-{safe_label}-{elapsed_ms:.0f}ms.pstats"
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path)
+        self._rotate()
+
+        entry = (elapsed_ms, label, path)
+        if len(self._slowest) < self.top:
+            heapq.heappush(self._slowest, entry)
+        elif elapsed_ms > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+        else:
+            return
+        # Новый апдейт в числе самых медленных — пишем разбивку
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(STATS_LINES)
+        report = [f"[profile] {label}: {elapsed_ms:.1f} мс, профиль {path}", out.getvalue()]
+        if before is not None and tracemalloc.is_tracing():
+            diff = tracemalloc.take_snapshot().compare_to(before, "lineno")
+            report.append("Память (прирост):")
+            report.extend(f"  {stat}" for stat in diff[:5])
+        logging.info("\n".join(report))
+
+    def _rotate(self):
+        files = sorted(f for f in os.listdir(self.directory) if f.endswith(".pstats"))
+        for name in files[:-self.keep] if len(files) > self.keep else []:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def slowest(self) -> list:
+        """Самые медленные профилированные апдейты: [(мс, событие, файл)], по убыванию."""
+        return sorted(self._slowest, reverse=True)
@@ -0,0 +1,80 @@
+"""Координатор обновления кэша справочника.
+
+* single-flight: одновременно идёт не больше одного обновления, все
+  желающие ждут один и тот же task;
+* stale-while-revalidate: пока обновление идёт в фоне, обработчики отдают
+  старый снимок;
+* backoff: после ошибки повторная попытка откладывается (экспоненциально);
+* планировщик периодически проверяет свежесть кэша и обновляет его тем же
+  путём, поэтому плановые и ручные обновления никогда не пересекаются.
+"""
+import time
+import random
+import asyncio
+import logging
+
+
+class CacheRefresher:
+    def __init__(self, refresh, min_backoff: float = 60, max_backoff: float = 60 * 60):
+        """``refresh`` — корутинная функция, выполняющая обновление."""
+        self._refresh = refresh
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._task: asyncio.Task | None = None
+        self.failures = 0
+        self._retry_at = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def backoff_remaining(self) -> float:
+        return max(0.0, self._retry_at - time.monotonic())
+
+    def _start(self, force: bool) -> asyncio.Task | None:
+        if self.running:
+            return self._task
+        if not force and self.backoff_remaining() > 0:
+            return None
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    def trigger(self) -> bool:
+        """Запускает обновление в фоне, не дожидаясь его. False — если идёт backoff."""
+        return self._start(force=False) is not None
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Обновляет кэш или присоединяется к уже идущему обновлению.
+
+        Возвращает True при успехе. Во время backoff без ``force`` сразу
+        возвращает False.
+        """
+        task = self._start(force)
+        if task is None:
+            return False
+        # shield: отмена одного ожидающего не должна прерывать общее обновление
+        return await asyncio.shield(task)
+
+    async def _run(self) -> bool:
+        try:
+            await self._refresh()
+        except Exception as e:
+            self.failures += 1
+            delay = min(self.max_backoff, self.min_backoff * 2 ** (self.failures - 1))
+            delay *= random.uniform(0.8, 1.2)
+            self._retry_at = time.monotonic() + delay
+            logging.warning(f"[cache] Обновление не удалось ({e}); повтор не раньше чем через {delay:.0f} с")
+            return False
+        self.failures = 0
+        self._retry_at = 0.0
+        return True
+
+    async def run_scheduler(self, is_stale, check_every: float = 60):
+        """Бесконечный цикл: раз в ``check_every`` секунд обновляет кэш, если ``is_stale()``."""
+        while True:
+            try:
+                if is_stale():
+                    await self.refresh()
+            except Exception as e:
+                logging.error(f"[cache] Ошибка планировщика обновлений: {e}")
+            await asyncio.sleep(check_every)
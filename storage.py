@@ -0,0 +1,135 @@
+"""Хранилища FSM для aiogram.
+
+Тип выбирается переменной окружения ``FSM_STORAGE``:
+
+* ``sqlite`` (по умолчанию) — файл ``<data>/fsm.sqlite3``: состояние
+  переживает перезапуск, а файл можно делить между несколькими процессами
+  бота на одной машине (WAL);
+* ``memory`` — прежний ``MemoryStorage``.
+
+Диалоги, в которых ничего не происходило дольше ``FSM_TTL_HOURS`` часов
+(по умолчанию 48), считаются завершёнными и удаляются.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+DEFAULT_TTL_HOURS = 48
+# Как часто (в секундах) чистить просроченные диалоги
+PURGE_INTERVAL = 10 * 60
+
+
+def _dumps(data: dict) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite с истечением неактивных диалогов.
+
+    Запросы выполняются синхронно: это точечные операции по первичному ключу
+    в режиме WAL без fsync на каждую запись, они занимают микросекунды.
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL_HOURS * 3600):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT,"
+            " data TEXT,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_updated ON fsm(updated)")
+        self._next_purge = 0.0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def _row(self, key: StorageKey):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, data, updated FROM fsm WHERE key = ?", (self._key(key),)
+            ).fetchone()
+        if row is None or row[2] < self._cutoff(time.time()):
+            return None, None
+        return row[0], row[1]
+
+    def _write(self, sql: str, params: tuple):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(sql, params)
+            if now >= self._next_purge:
+                self._next_purge = now + PURGE_INTERVAL
+                self.purge_expired(now)
+
+    def purge_expired(self, now: float | None = None) -> int:
+        """Удаляет диалоги, неактивные дольше ttl. Возвращает число удалённых."""
+        if not self.ttl:
+            return 0
+        cur = self._conn.execute("DELETE FROM fsm WHERE updated < ?", ((now or time.time()) - self.ttl,))
+        if cur.rowcount:
+            logging.info(f"[fsm] Удалено просроченных диалогов: {cur.rowcount}")
+        return cur.rowcount
+
+    def _cutoff(self, now: float) -> float:
+        return now - self.ttl if self.ttl else float("-inf")
+
+    # При записи в просроченный диалог вторая колонка сбрасывается,
+    # чтобы старое состояние/данные не «ожили» вместе с новой записью
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if hasattr(state, "state") else state
+        now = time.time()
+        self._write(
+            "INSERT INTO fsm(key, state, data, updated) VALUES (?, ?, NULL, ?)"
+            " ON CONFLICT(key) DO UPDATE SET state = excluded.state,"
+            " data = CASE WHEN fsm.updated < ? THEN NULL ELSE fsm.data END,"
+            " updated = excluded.updated",
+            (self._key(key), state, now, self._cutoff(now)),
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._row(key)[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        now = time.time()
+        self._write(
+            "INSERT INTO fsm(key, state, data, updated) VALUES (?, NULL, ?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET data = excluded.data,"
+            " state = CASE WHEN fsm.updated < ? THEN NULL ELSE fsm.state END,"
+            " updated = excluded.updated",
+            (self._key(key), _dumps(data) if data else None, now, self._cutoff(now)),
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        raw = self._row(key)[1]
+        return json.loads(raw) if raw else {}
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_storage(data_dir: str) -> BaseStorage:
+    """FSM-хранилище согласно FSM_STORAGE / FSM_TTL_HOURS."""
+    kind = os.getenv("FSM_STORAGE", "sqlite").lower()
+    if kind == "memory":
+        return MemoryStorage()
+    if kind != "sqlite":
+        logging.warning(f"[fsm] Неизвестный FSM_STORAGE={kind!r}, использую sqlite")
+    ttl_hours = float(os.getenv("FSM_TTL_HOURS", DEFAULT_TTL_HOURS))
+    return SQLiteStorage(os.path.join(data_dir, "fsm.sqlite3"), ttl=ttl_hours * 3600)
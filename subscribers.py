@@ -0,0 +1,160 @@
+"""Подписчики рассылки.
+
+Множество chat_id живёт в памяти, так что проверка «подписан ли чат» не
+трогает диск. Изменения дописываются в журнал ``<снимок>.log`` строками
+``+123`` / ``-123`` (с fsync), а сам снимок — прежний ``subscribers.json``
+со списком chat_id. Когда журнал разрастается, он сворачивается в новый
+снимок: запись во временный файл и атомарное переименование, затем журнал
+обнуляется. Если процесс упадёт между этими шагами, журнал просто
+применится к новому снимку ещё раз — результат тот же.
+
+Несколько процессов бота могут делить одни файлы: запись в журнал и
+сворачивание идут под файловой блокировкой, а при сворачивании и в
+``reload()`` состояние перечитывается с диска вместе с чужими изменениями.
+
+``add``/``discard``/``reload`` блокируются на flock и fsync, поэтому из
+асинхронного кода их вызывают через ``asyncio.to_thread``; чтение — только
+из памяти и безопасно прямо в event loop.
+"""
+import os
+import json
+import logging
+import threading
+
+from locks import FileLock
+
+# Сворачивать журнал, когда в нём столько записей (или больше, чем подписчиков)
+COMPACT_EVERY = 1000
+
+
+class SubscriberStore:
+    def __init__(self, path: str, compact_every: int = COMPACT_EVERY):
+        self.path = path
+        self.log_path = f"{path}.log"
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(f"{path}.lock")
+        self._log = None
+        with self._file_lock:
+            self._subs, self._log_entries = self._read_disk()
+            if self._log_entries:
+                self._compact_locked()
+
+    def _read_disk(self) -> tuple[set[int], int]:
+        """Снимок + журнал. Возвращает (подписчики, число строк журнала)."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                subs = {int(chat_id) for chat_id in json.load(f)}
+        except FileNotFoundError:
+            subs = set()
+        except Exception as e:
+            logging.warning(f"[subscribers] Не удалось прочитать {self.path}: {e}")
+            subs = set()
+        entries = 0
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    entries += 1
+                    # Оборванную при падении последнюю строку (без \n) пропускаем:
+                    # от «+12345» могло остаться «+12»
+                    if not line.endswith("\n"):
+                        continue
+                    line = line.strip()
+                    if len(line) < 2 or line[0] not in "+-" or not line[1:].lstrip("-").isdigit():
+                        continue
+                    chat_id = int(line[1:])
+                    if line[0] == "+":
+                        subs.add(chat_id)
+                    else:
+                        subs.discard(chat_id)
+        except FileNotFoundError:
+            pass
+        return subs, entries
+
+    # --- чтение: только память ---
+    def __contains__(self, chat_id) -> bool:
+        return chat_id in self._subs
+
+    def __len__(self):
+        return len(self._subs)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def snapshot(self) -> set[int]:
+        """Копия множества — для рассылки, пока другие подписываются/отписываются."""
+        with self._lock:
+            return set(self._subs)
+
+    def reload(self):
+        """Перечитывает подписчиков с диска (с изменениями других процессов)."""
+        with self._lock, self._file_lock:
+            self._subs, _entries = self._read_disk()
+
+    # --- изменения ---
+    def add(self, chat_id: int) -> bool:
+        """Подписывает чат. Возвращает False, если он уже был подписан."""
+        return self._change(chat_id, True)
+
+    def discard(self, chat_id: int) -> bool:
+        """Отписывает чат. Возвращает False, если он не был подписан."""
+        return self._change(chat_id, False)
+
+    def _change(self, chat_id: int, subscribe: bool) -> bool:
+        chat_id = int(chat_id)
+        with self._lock:
+            changed = (chat_id in self._subs) != subscribe
+            if subscribe:
+                self._subs.add(chat_id)
+            else:
+                self._subs.discard(chat_id)
+            # Пишем и без изменений в памяти: другой процесс мог изменить этот чат
+            # на диске, а запись в журнал идемпотентна
+            with self._file_lock:
+                try:
+                    self._append(f"{'+' if subscribe else '-'}{chat_id}\n")
+                except OSError as e:
+                    logging.warning(f"[subscribers] Не удалось записать журнал {self.log_path}: {e}")
+                if self._log_entries >= max(self.compact_every, len(self._subs)):
+                    self._compact_locked()
+        return changed
+
+    def _append(self, line: str):
+        if self._log is None:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            # O_APPEND: строки разных процессов не перетирают друг друга
+            self._log = open(self.log_path, "a", encoding="utf-8")
+        self._log.write(line)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._log_entries += 1
+
+    def compact(self):
+        """Сворачивает журнал в снимок."""
+        with self._lock, self._file_lock:
+            self._compact_locked()
+
+    def _compact_locked(self):
+        # Вызывается под self._file_lock: журнал мог пополниться другими процессами
+        subs, _entries = self._read_disk()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(sorted(subs), f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            # Журнал обнуляем только после того, как снимок на месте
+            with open(self.log_path, "w", encoding="utf-8"):
+                pass
+            self._subs = subs
+            self._log_entries = 0
+        except OSError as e:
+            logging.warning(f"[subscribers] Не удалось сохранить {self.path}: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
@@ -0,0 +1,157 @@
+"""RetryMiddleware и TunedSession против локальной заглушки Bot API."""
+import time
+import asyncio
+import contextlib
+
+import pytest
+
+pytest.importorskip("aiogram")
+web = pytest.importorskip("aiohttp.web")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError  # noqa: E402
+
+from botapi import RetryMiddleware, create_session  # noqa: E402
+
+MESSAGE = {"message_id": 1, "date": 1700000000, "chat": {"id": 1, "type": "private"}, "text": "ok"}
+
+
+class FakeApi:
+    """Отвечает по сценарию: метод → список ответов ("flood:<с>", 502, "drop"); дальше — успех."""
+
+    def __init__(self, script: dict):
+        self.script = {method: list(answers) for method, answers in script.items()}
+        self.calls = []  # (метод, время прихода)
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls.append((method, time.monotonic()))
+        await request.post()
+        answers = self.script.get(method)
+        answer = answers.pop(0) if answers else "ok"
+        if isinstance(answer, str) and answer.startswith("flood:"):
+            retry_after = int(answer.split(":", 1)[1])
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": f"Too Many Requests: retry after {retry_after}",
+                                      "parameters": {"retry_after": retry_after}}, status=429)
+        if answer == 502:
+            return web.json_response({"ok": False, "error_code": 502, "description": "Bad Gateway"}, status=502)
+        if answer == "drop":
+            request.transport.close()
+            return web.Response()
+        result = MESSAGE if method.lower() == "sendmessage" else True
+        return web.json_response({"ok": True, "result": result})
+
+    def count(self, method: str) -> int:
+        return sum(1 for m, _ in self.calls if m == method)
+
+    def times(self, method: str) -> list:
+        return [t for m, t in self.calls if m == method]
+
+
+@contextlib.asynccontextmanager
+async def fake_bot(script: dict, **retry):
+    api = FakeApi(script)
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    session = create_session(api_base=f"http://{host}:{port}")
+    session.middleware(RetryMiddleware(**{"base_delay": 0.01, "max_delay": 0.02, **retry}))
+    bot = Bot(token="42:TEST", session=session)
+    try:
+        yield bot, api
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_server_error_retried_for_idempotent_method():
+    async def scenario():
+        async with fake_bot({"deleteMessage": [502, 502]}) as (bot, api):
+            assert await bot.delete_message(chat_id=1, message_id=1) is True
+            assert api.count("deleteMessage") == 3
+    run(scenario())
+
+
+def test_server_error_gives_up_after_attempts():
+    async def scenario():
+        async with fake_bot({"deleteMessage": [502] * 10}, attempts=3) as (bot, api):
+            with pytest.raises(TelegramServerError):
+                await bot.delete_message(chat_id=1, message_id=1)
+            assert api.count("deleteMessage") == 3
+    run(scenario())
+
+
+@pytest.mark.parametrize("failure, error", [(502, TelegramServerError), ("drop", TelegramNetworkError)])
+def test_send_is_not_retried(failure, error):
+    # Telegram мог уже доставить сообщение — повтор дал бы дубль
+    async def scenario():
+        async with fake_bot({"sendMessage": [failure]}) as (bot, api):
+            with pytest.raises(error):
+                await bot.send_message(chat_id=1, text="hi")
+            assert api.count("sendMessage") == 1
+    run(scenario())
+
+
+def test_network_error_retried_for_idempotent_method():
+    async def scenario():
+        async with fake_bot({"answerCallbackQuery": ["drop"]}) as (bot, api):
+            assert await bot.answer_callback_query("1") is True
+            assert api.count("answerCallbackQuery") == 2
+    run(scenario())
+
+
+def test_flood_wait_retries_send_and_pauses_other_requests():
+    async def scenario():
+        async with fake_bot({"sendMessage": ["flood:1"]}) as (bot, api):
+            send = asyncio.create_task(bot.send_message(chat_id=1, text="hi"))
+            while not api.count("sendMessage"):
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.1)  # 429 уже получен, пауза поставлена
+            await bot.delete_message(chat_id=1, message_id=1)
+            await send
+            flood_at = api.times("sendMessage")[0]
+            # Повтор отправки (429 — Telegram запрос не принял) и чужой запрос ждут паузу
+            assert api.count("sendMessage") == 2
+            assert api.times("sendMessage")[1] - flood_at >= 0.9
+            assert api.times("deleteMessage")[0] - flood_at >= 0.9
+    run(scenario())
+
+
+def test_long_flood_wait_is_raised():
+    async def scenario():
+        async with fake_bot({"deleteMessage": ["flood:5"]}, max_flood_wait=1) as (bot, api):
+            with pytest.raises(TelegramRetryAfter):
+                await bot.delete_message(chat_id=1, message_id=1)
+            assert api.count("deleteMessage") == 1
+    run(scenario())
+
+
+def test_copy_message_left_to_broadcaster():
+    async def scenario():
+        async with fake_bot({"copyMessage": ["flood:1"]}) as (bot, api):
+            with pytest.raises(TelegramRetryAfter):
+                await bot.copy_message(chat_id=1, from_chat_id=2, message_id=3)
+            assert api.count("copyMessage") == 1
+    run(scenario())
+
+
+def test_session_pool_settings():
+    async def scenario():
+        session = create_session(pool_size=7, keepalive=5)
+        try:
+            client = await session.create_session()
+            assert client.connector.limit == 7
+            assert await session.create_session() is client
+        finally:
+            await session.close()
+        assert client.closed
+    run(scenario())
@@ -0,0 +1,81 @@
+"""Broadcaster: журналы завершённых рассылок удаляются, паузы по чатам не копятся."""
+import os
+import json
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+import broadcast  # noqa: E402
+from broadcast import Broadcaster  # noqa: E402
+
+
+class FakeBot:
+    def __init__(self):
+        self.copied = []
+
+    async def copy_message(self, chat_id, from_chat_id, message_id):
+        self.copied.append(chat_id)
+
+
+def journals(directory) -> list:
+    return sorted(name for name in os.listdir(directory) if name.endswith(".jsonl"))
+
+
+async def finish(broadcaster):
+    while broadcaster._tasks:
+        await asyncio.gather(*broadcaster._tasks)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_finished_journal_is_removed(tmp_path):
+    async def scenario():
+        bot = FakeBot()
+        broadcaster = Broadcaster(bot, str(tmp_path), rate=1000)
+        await broadcaster.start(1, 2, range(100, 120))
+        assert len(journals(tmp_path)) == 1
+        await finish(broadcaster)
+        assert sorted(bot.copied) == list(range(100, 120))
+        assert journals(tmp_path) == []
+    run(scenario())
+
+
+def test_resume_continues_unfinished_and_drops_finished(tmp_path):
+    def write(name, records):
+        with open(tmp_path / name, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r) + "\n" for r in records)
+
+    header = {"from_chat_id": 1, "message_id": 2, "chat_ids": [10, 11, 12]}
+    write("1-done.jsonl", [{"job": "1-done", **header}, {"chat_id": 10, "result": "ok"},
+                           {"finished": 0, "ok": 3, "gone": 0, "failed": 0}])
+    write("2-open.jsonl", [{"job": "2-open", **header}, {"chat_id": 10, "result": "ok"}])
+    (tmp_path / "3-empty.jsonl").touch()
+
+    async def scenario():
+        bot = FakeBot()
+        broadcaster = Broadcaster(bot, str(tmp_path), rate=1000)
+        assert await broadcaster.resume() == 1
+        assert journals(tmp_path) == ["2-open.jsonl"]
+        await finish(broadcaster)
+        assert sorted(bot.copied) == [11, 12]
+        assert journals(tmp_path) == []
+    run(scenario())
+
+
+def test_per_chat_send_times_are_forgotten(tmp_path, monkeypatch):
+    monkeypatch.setattr(broadcast, "PER_CHAT_INTERVAL", 0.05)
+
+    async def scenario():
+        broadcaster = Broadcaster(FakeBot(), str(tmp_path), rate=1000)
+        await broadcaster.start(1, 2, range(500))
+        await finish(broadcaster)
+        await asyncio.sleep(0.1)
+        await broadcaster.start(1, 3, [7])
+        await finish(broadcaster)
+        # Остался только чат, которому писали только что
+        assert list(broadcaster._last_sent) == [7]
+    run(scenario())
@@ -0,0 +1,182 @@
+"""fetch_sources против локального сервера-заглушки: условные запросы, 304 и откат при ошибках."""
+import json
+import asyncio
+import threading
+import hashlib
+import contextlib
+
+import pytest
+
+web = pytest.importorskip("aiohttp.web")
+
+from fetcher import fetch_sources  # noqa: E402
+from gamedata import GameData  # noqa: E402
+
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class FakeSource:
+    """Отдаёт ``<key>.json`` с ETag; ключи из ``failing`` отвечают 500."""
+
+    def __init__(self, sections: dict):
+        self.sections = dict(sections)
+        self.failing = set()
+        self.requests = []  # (ключ, заголовки запроса)
+
+    def etag(self, key) -> str:
+        return '"%s"' % hashlib.sha1(json.dumps(self.sections[key]).encode()).hexdigest()
+
+    async def handle(self, request):
+        key = request.match_info["key"]
+        self.requests.append((key, dict(request.headers)))
+        if key in self.failing:
+            return web.Response(status=500)
+        if request.headers.get("If-None-Match") == self.etag(key):
+            return web.Response(status=304)
+        return web.json_response(self.sections[key], headers={"ETag": self.etag(key), "Last-Modified": LAST_MODIFIED})
+
+    def headers(self, key) -> list:
+        return [headers for k, headers in self.requests if k == key]
+
+
+@contextlib.asynccontextmanager
+async def fake_source(sections: dict):
+    source = FakeSource(sections)
+    app = web.Application()
+    app.router.add_get("/{key}.json", source.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        yield source, {key: f"http://{host}:{port}/{key}.json" for key in sections}
+    finally:
+        await runner.cleanup()
+
+
+SECTIONS = {
+    "characters": {"1001": {"id": "1001", "name": "Март 7"}},
+    "light_cones": {"20000": {"id": "20000", "name": "Конус"}},
+}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_cold_fetch_downloads_and_saves_validators(tmp_path):
+    async def scenario():
+        async with fake_source(SECTIONS) as (source, urls):
+            data, validators, stats = await fetch_sources(urls, fallback_dir=str(tmp_path))
+            assert data == SECTIONS
+            assert stats == {"downloaded": 2, "not_modified": 0, "failed": 0}
+            assert validators["characters"] == {"etag": source.etag("characters"), "last_modified": LAST_MODIFIED}
+            # Без прежних данных условный запрос не отправляется
+            assert all("If-None-Match" not in h for _, h in source.requests)
+    run(scenario())
+
+
+def test_not_modified_reuses_previous_section(tmp_path):
+    async def scenario():
+        async with fake_source(SECTIONS) as (source, urls):
+            previous, validators, _ = await fetch_sources(urls, fallback_dir=str(tmp_path))
+            data, new_validators, stats = await fetch_sources(urls, previous, validators, fallback_dir=str(tmp_path))
+            assert stats == {"downloaded": 0, "not_modified": 2, "failed": 0}
+            # 304: раздел не разбирается заново, а берётся тот же объект
+            assert all(data[key] is previous[key] for key in SECTIONS)
+            assert new_validators == validators
+            sent = source.headers("characters")[-1]
+            assert sent["If-None-Match"] == source.etag("characters")
+            assert sent["If-Modified-Since"] == LAST_MODIFIED
+    run(scenario())
+
+
+def test_changed_file_is_downloaded_again(tmp_path):
+    async def scenario():
+        async with fake_source(SECTIONS) as (source, urls):
+            previous, validators, _ = await fetch_sources(urls, fallback_dir=str(tmp_path))
+            source.sections["characters"] = {"1002": {"id": "1002", "name": "Дань Хэн"}}
+            data, new_validators, stats = await fetch_sources(urls, previous, validators, fallback_dir=str(tmp_path))
+            assert stats == {"downloaded": 1, "not_modified": 1, "failed": 0}
+            assert data["characters"] == source.sections["characters"]
+            assert new_validators["characters"]["etag"] == source.etag("characters")
+    run(scenario())
+
+
+def test_validators_without_previous_data_are_not_sent(tmp_path):
+    async def scenario():
+        async with fake_source(SECTIONS) as (source, urls):
+            _, validators, _ = await fetch_sources(urls, fallback_dir=str(tmp_path))
+            data, _, stats = await fetch_sources(urls, {}, validators, fallback_dir=str(tmp_path))
+            assert stats["downloaded"] == 2
+            assert data == SECTIONS
+            assert all("If-None-Match" not in h for _, h in source.requests)
+    run(scenario())
+
+
+def test_failure_keeps_previous_section_and_validators(tmp_path):
+    async def scenario():
+        async with fake_source(SECTIONS) as (source, urls):
+            previous, validators, _ = await fetch_sources(urls, fallback_dir=str(tmp_path))
+            source.failing.add("characters")
+            data, new_validators, stats = await fetch_sources(urls, previous, validators, fallback_dir=str(tmp_path))
+            assert stats == {"downloaded": 0, "not_modified": 1, "failed": 1}
+            assert data["characters"] is previous["characters"]
+            assert new_validators["characters"] == validators["characters"]
+    run(scenario())
+
+
+def test_failure_without_previous_uses_local_copy(tmp_path):
+    (tmp_path / "characters.json").write_text(json.dumps({"local": {"id": "local"}}), encoding="utf-8")
+
+    async def scenario():
+        async with fake_source(SECTIONS) as (source, urls):
+            source.failing.update(SECTIONS)
+            data, validators, stats = await fetch_sources(urls, fallback_dir=str(tmp_path))
+            assert stats == {"downloaded": 0, "not_modified": 0, "failed": 2}
+            assert data["characters"] == {"local": {"id": "local"}}
+            # Ни прежних данных, ни локальной копии — пустой раздел
+            assert data["light_cones"] == {}
+            assert validators == {}
+    run(scenario())
+
+
+def lazy_previous(sections: dict, loads: list) -> GameData:
+    """Прежний кэш как в боте: разделы читаются при первом обращении."""
+    main = threading.get_ident()
+
+    def loader(key, value):
+        def load():
+            loads.append((key, threading.get_ident() != main))
+            return value
+        return load
+
+    return GameData(loaders={key: loader(key, value) for key, value in sections.items()})
+
+
+def test_lazy_previous_is_read_only_when_reused_and_off_loop(tmp_path):
+    async def scenario():
+        async with fake_source(SECTIONS) as (source, urls):
+            first, validators, _ = await fetch_sources(urls, fallback_dir=str(tmp_path))
+            source.sections["characters"] = {"1002": {"id": "1002", "name": "Дань Хэн"}}
+            loads = []
+            data, _, stats = await fetch_sources(urls, lazy_previous(first, loads), validators,
+                                                 fallback_dir=str(tmp_path))
+            assert stats == {"downloaded": 1, "not_modified": 1, "failed": 0}
+            # Прочитан только раздел с ответом 304, и не в потоке event loop
+            assert loads == [("light_cones", True)]
+            assert data["light_cones"] == SECTIONS["light_cones"]
+    run(scenario())
+
+
+def test_empty_previous_section_is_downloaded_again(tmp_path):
+    async def scenario():
+        async with fake_source(SECTIONS) as (source, urls):
+            _, validators, _ = await fetch_sources(urls, fallback_dir=str(tmp_path))
+            loads = []
+            previous = lazy_previous({key: {} for key in SECTIONS}, loads)
+            data, _, stats = await fetch_sources(urls, previous, validators, fallback_dir=str(tmp_path))
+            assert stats["downloaded"] == 2
+            assert data == SECTIONS
+    run(scenario())
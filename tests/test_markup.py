@@ -0,0 +1,75 @@
+"""markup.py: примеры разметки и фаззинг — любой выход должен проходить check_html."""
+import os
+import json
+import random
+
+import pytest
+
+import markup
+from conftest import ROOT
+
+FRAGMENTS = (
+    "*", "_", "__", "~", "```", "[ссылка](https://t.me/x)", "[", "](", "<b>", "</b>", "<i>", "</i>",
+    "<code>", "</code>", '<a href="https://t.me">', "</a>", "<span>", "<95", "100>", "<%", "%>", "&",
+    "&lt;", "&gt;", "&amp;", "&nbsp;", "&#955;", "<", ">", "\n", " ", "Крит. шанс", "ATK%", "➜", "🛡️",
+    "Скорость", "<br>", "</p>", "'", '"', "<B>", "<tg-spoiler>", "</tg-spoiler>",
+)
+FUZZ_CASES = 5000
+
+
+def fuzz_cases(seed: int):
+    rng = random.Random(seed)
+    for _ in range(FUZZ_CASES):
+        yield "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 40)))
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("*жирный* и _курсив_", "<b>жирный</b> и <i>курсив</i>"),
+    ("a~b~c", "a b c"),
+    ("~a~", " a "),
+    ("a~b", "a~b"),
+    ("<95 & A", "&lt;95 &amp; A"),
+    ("&lt;b&gt;", "&lt;b&gt;"),
+    ("<b>x</i>", "<b>x</b>"),
+    ("</b>x", "x"),
+    ("<span>x</span>", "&lt;span&gt;x&lt;/span&gt;"),
+    ("[t](https://t.me/x)", '<a href="https://t.me/x">t</a>'),
+    ("```<b>```", "<code>&lt;b&gt;</code>"),
+    ("*a\nb*", "*a\nb*"),
+    ("<b>Готово</b> <i>уже</i>", "<b>Готово</b> <i>уже</i>"),
+])
+def test_to_html_examples(text, expected):
+    assert markup.to_html(text) == expected
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_fuzz_output_is_valid_telegram_html(seed):
+    for text in fuzz_cases(seed):
+        for convert in (markup.to_html, markup.sanitize_html):
+            out = convert(text)
+            assert markup.check_html(out) is None, (convert.__name__, text, out, markup.check_html(out))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_fuzz_sanitize_is_idempotent(seed):
+    for text in fuzz_cases(seed):
+        cleaned = markup.sanitize_html(text)
+        assert markup.sanitize_html(cleaned) == cleaned, text
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_fuzz_fast_path_matches_full_conversion(seed):
+    for text in fuzz_cases(seed):
+        if markup._is_simple_html(text):
+            assert markup._convert(text, markup._MARKDOWN_RE) == text
+            assert markup._convert(text, markup._HTML_RE) == text
+
+
+def test_shipped_builds_render_to_valid_html():
+    with open(os.path.join(ROOT, "best_builds.json"), encoding="utf-8") as f:
+        builds = json.load(f)
+    for build in builds:
+        for field, value in build.items():
+            if field.endswith("_pretty") and isinstance(value, str):
+                out = markup.to_html(value)
+                assert markup.check_html(out) is None, (build.get("character"), field, out)
@@ -0,0 +1,52 @@
+"""NameIndex: точные алиасы, транслит и опечатки."""
+import pytest
+
+from names import NameIndex
+
+ALIASES = {
+    "хохо": ["Huohuo", "Хуохуо", "char1217"],
+    "хук": ["Hook", "char1405"],
+    "кафка": ["Kafka", "char1005"],
+    "клара": ["Clara", "char1107"],
+    "химеко": ["Himeko", "char1003"],
+    "цзин юань": ["Jing Yuan", "char1204"],
+    "цзинлю": ["Jingliu", "char1212"],
+    "март 7 (охота)": ["March 7th", "char1224"],
+    "март 7 (сохранение)": ["March 7th", "char1001"],
+}
+
+
+@pytest.fixture(scope="module")
+def index():
+    return NameIndex(ALIASES)
+
+
+@pytest.mark.parametrize("query, expected", [
+    # Алиас «Хуохуо» найден точно — созвучный «Хук» в выдачу не попадает
+    ("хуохуо", ["хохо"]),
+    ("huo-huo", ["хохо"]),
+    ("Хохо", ["хохо"]),
+    ("цзинь юань", ["цзин юань"]),
+    ("jing yuan", ["цзин юань"]),
+    ("март 7", ["март 7 (охота)", "март 7 (сохранение)"]),
+])
+def test_search_matches(index, query, expected):
+    assert index.search(query) == expected
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("кафак", "кафка"),
+    ("клра", "клара"),
+    # Перестановки в коротких именах: по доле от объединения триграмм не находились совсем
+    ("kakfa", "кафка"),
+    ("кфака", "кафка"),
+    ("lcara", "клара"),
+    ("хуохо", "хохо"),
+    ("himko", "химеко"),
+])
+def test_search_typos(index, query, expected):
+    assert index.search(query)[0] == expected
+
+
+def test_search_unrelated(index):
+    assert index.search("xyzzy") == []
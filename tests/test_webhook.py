@@ -0,0 +1,116 @@
+"""WebhookServer + CallbackMiddleware: на повторное нажатие отвечают сразу, а не после первого."""
+import time
+import asyncio
+import contextlib
+
+import pytest
+
+pytest.importorskip("aiogram")
+web = pytest.importorskip("aiohttp.web")
+
+from aiohttp import ClientSession  # noqa: E402
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+
+from middlewares import CallbackMiddleware  # noqa: E402
+from webhook import WebhookServer  # noqa: E402
+
+SLOW = 0.5
+
+
+class FakeApi:
+    """Заглушка Bot API: запоминает, когда пришёл каждый answerCallbackQuery."""
+
+    def __init__(self):
+        self.answers = []  # (callback_query_id, время)
+
+    async def handle(self, request):
+        form = await request.post()
+        if request.match_info["method"] == "answerCallbackQuery":
+            self.answers.append((form["callback_query_id"], time.monotonic()))
+        return web.json_response({"ok": True, "result": True})
+
+
+async def serve(app) -> tuple:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def callback_update(update_id: int, data: str) -> dict:
+    user = {"id": 7, "is_bot": False, "first_name": "Тест"}
+    message = {"message_id": 1, "date": 1700000000, "chat": {"id": 7, "type": "private"}, "text": "меню"}
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": user, "chat_instance": "1", "message": message, "data": data}}
+
+
+@contextlib.asynccontextmanager
+async def webhook_bot(order_callbacks: bool):
+    api = FakeApi()
+    api_app = web.Application()
+    api_app.router.add_post("/bot{token}/{method}", api.handle)
+    api_runner, api_url = await serve(api_app)
+    bot = Bot(token="42:TEST", session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+
+    handled = []  # (data, начало, конец)
+    dp = Dispatcher()
+    dp.callback_query.outer_middleware(CallbackMiddleware())
+
+    @dp.callback_query()
+    async def on_callback(callback):
+        started = time.monotonic()
+        await asyncio.sleep(SLOW if callback.data == "slow" else 0)
+        handled.append((callback.data, started, time.monotonic()))
+
+    server = WebhookServer(dp, bot, order_callbacks=order_callbacks)
+    await server.start("127.0.0.1", 0)
+    host, port = server._runner.addresses[0][:2]
+    try:
+        async with ClientSession() as client:
+            async def post(update):
+                async with client.post(f"http://{host}:{port}/webhook", json=update) as resp:
+                    assert resp.status == 200
+            yield post, api, handled
+    finally:
+        await server.stop()
+        await bot.session.close()
+        await api_runner.cleanup()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_second_tap_is_answered_while_first_is_processed():
+    async def scenario():
+        async with webhook_bot(order_callbacks=False) as (post, api, handled):
+            sent = time.monotonic()
+            await post(callback_update(1, "slow"))
+            await post(callback_update(2, "fast"))
+            await post(callback_update(3, "slow"))  # повтор первого нажатия
+            while len(handled) < 2:
+                await asyncio.sleep(0.01)
+            answered = dict(api.answers)
+            # «Часики» погашены у всех трёх сразу, не дожидаясь медленного обработчика
+            assert set(answered) == {"1", "2", "3"}
+            assert max(answered.values()) - sent < SLOW / 2
+            # Колбэки чата по-прежнему выполняются по очереди, дубль отброшен
+            assert [data for data, _, _ in handled] == ["slow", "fast"]
+            assert handled[1][1] >= handled[0][2]
+    run(scenario())
+
+
+def test_ordered_callbacks_wait_for_the_chat():
+    # Без order_callbacks=False вторая очередь (webhook) держит нажатие до конца первого
+    async def scenario():
+        async with webhook_bot(order_callbacks=True) as (post, api, handled):
+            await post(callback_update(1, "slow"))
+            await post(callback_update(2, "fast"))
+            while len(handled) < 2:
+                await asyncio.sleep(0.01)
+            answered = dict(api.answers)
+            assert answered["2"] >= handled[0][2]
+    run(scenario())
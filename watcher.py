@@ -0,0 +1,94 @@
+"""Слежение за изменением файла (для best_builds.json).
+
+Если установлен ``watchfiles``, изменения приходят от inotify (или его
+аналога на других ОС); иначе раз в ``interval`` секунд сравнивается
+(mtime, размер) файла. Следим за папкой, а не за самим файлом: редакторы и
+``git checkout`` часто заменяют файл переименованием.
+
+Колбэк вызывается, когда файл перестал меняться дольше ``debounce`` секунд,
+поэтому частично записанный файл он обычно не видит — но проверять
+содержимое всё равно должен сам колбэк.
+"""
+import os
+import asyncio
+import logging
+
+try:
+    from watchfiles import awatch
+except ImportError:  # watchfiles необязателен
+    awatch = None
+
+POLL_INTERVAL = 2.0
+DEBOUNCE = 0.5
+
+
+def _signature(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class FileWatcher:
+    def __init__(self, path: str, on_change, interval: float = POLL_INTERVAL, debounce: float = DEBOUNCE):
+        """``on_change`` — корутинная функция без аргументов."""
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.interval = interval
+        self.debounce = debounce
+        self._signature = _signature(self.path)
+        self._task: asyncio.Task | None = None
+
+    @property
+    def backend(self) -> str:
+        return "inotify" if awatch is not None else "polling"
+
+    def start(self) -> asyncio.Task:
+        """Запускает слежение в фоне (повторный вызов возвращает тот же task)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def run(self):
+        logging.info(f"[watcher] Слежу за {self.path} ({self.backend})")
+        if awatch is not None:
+            try:
+                await self._run_events()
+                return
+            except Exception as e:
+                logging.warning(f"[watcher] inotify недоступен ({e}), перехожу на опрос")
+        await self._run_polling()
+
+    async def _run_events(self):
+        directory = os.path.dirname(self.path)
+        async for changes in awatch(directory, debounce=int(self.debounce * 1000), recursive=False):
+            if any(os.path.abspath(path) == self.path for _change, path in changes):
+                await self._check()
+
+    async def _run_polling(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if _signature(self.path) == self._signature:
+                continue
+            # Ждём, пока запись закончится
+            while True:
+                signature = _signature(self.path)
+                await asyncio.sleep(self.debounce)
+                if _signature(self.path) == signature:
+                    break
+            await self._check()
+
+    async def _check(self):
+        signature = _signature(self.path)
+        if signature is None or signature == self._signature:
+            return
+        self._signature = signature
+        try:
+            await self.on_change()
+        except Exception:
+            logging.exception(f"[watcher] Ошибка при обработке изменения {self.path}")
@@ -0,0 +1,189 @@
+"""HTTP-сервер для режима webhook.
+
+Запускается внутри уже работающего event loop (AppRunner + TCPSite), а не
+через блокирующий ``web.run_app``:
+
+* запросы без правильного ``X-Telegram-Bot-Api-Secret-Token`` отклоняются;
+* Telegram получает ответ сразу, а апдейт обрабатывается в фоне;
+* число одновременно обрабатываемых апдейтов ограничено семафором: когда
+  все слоты заняты, ответ задерживается до освобождения слота — Telegram
+  не шлёт новые апдейты, пока не получил ответ, и сам снижает темп;
+* апдейты одного чата обрабатываются строго по очереди, в порядке прихода;
+  с ``order_callbacks=False`` колбэки идут мимо этой очереди — их упорядочивает
+  ``CallbackMiddleware`` (middlewares.py), который сначала гасит «часики» и
+  отбрасывает повторные нажатия, а не ждёт, пока чат освободится;
+* при остановке новые апдейты не принимаются (503 — Telegram повторит их
+  позже), а начатые дорабатывают не дольше ``drain_timeout`` секунд;
+* ``GET /healthz`` — проверка живости для платформы деплоя;
+* ``GET /metrics`` — метрики в формате Prometheus (metrics.py).
+
+Тот же сервер работает воркером в многопроцессном режиме (cluster.py),
+тогда он слушает unix-сокет, а секрет проверяет фронт.
+"""
+import hmac
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram.types import Update
+
+import metrics
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_IN_FLIGHT = 100
+DRAIN_TIMEOUT = 30.0
+
+
+def update_chat_id(update: dict) -> int | None:
+    """chat_id апдейта (для сообщений и колбэков), иначе id пользователя или None."""
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        event = update.get(key)
+        if event:
+            return event.get("chat", {}).get("id")
+    callback = update.get("callback_query")
+    if callback:
+        chat_id = (callback.get("message") or {}).get("chat", {}).get("id")
+        return chat_id if chat_id is not None else callback.get("from", {}).get("id")
+    for event in update.values():
+        if isinstance(event, dict) and "from" in event:
+            return event["from"].get("id")
+    return None
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=metrics.REGISTRY.render().encode("utf-8"),
+                        headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Отдельный ``/metrics`` — для режима polling, где своего HTTP-сервера нет."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, handle_signals=False, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"[metrics] Слушаю {host}:{port}/metrics")
+    return runner
+
+
+class WebhookServer:
+    def __init__(self, dispatcher, bot, path: str = "/webhook", secret_token: str | None = None,
+                 max_in_flight: int = MAX_IN_FLIGHT, drain_timeout: float = DRAIN_TIMEOUT,
+                 order_callbacks: bool = True):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.drain_timeout = drain_timeout
+        self.order_callbacks = order_callbacks
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tasks = set()
+        # chat_id -> [блокировка, сколько апдейтов этого чата в работе]
+        self._chats = {}
+        self._draining = False
+        self._runner = None
+        self.received = 0
+        self.rejected = 0
+        self.failed = 0
+
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self.app.router.add_get("/healthz", self.handle_health)
+        self.app.router.add_get("/metrics", handle_metrics)
+
+        metrics.gauge("bot_webhook_in_flight", "Апдейты в обработке", collect=lambda: self.in_flight)
+        metrics.counter("bot_webhook_updates_total", "Апдейты, полученные webhook", ["result"], collect=lambda: {
+            "accepted": self.received, "failed": self.failed, "rejected": self.rejected})
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    # --- обработчики HTTP ---
+    def _authorized(self, request: web.Request) -> bool:
+        if not self.secret_token:
+            return True
+        # Сравнение за постоянное время, чтобы секрет нельзя было подобрать по таймингу
+        return hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            self.rejected += 1
+            return web.Response(status=401)
+        if self._draining:
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+            update = Update.model_validate(data, context={"bot": self.bot})
+        except Exception as e:
+            logging.warning(f"[webhook] Некорректный апдейт: {e}")
+            return web.Response(status=400)
+        await self._slots.acquire()
+        self.received += 1
+        ordered = self.order_callbacks or update.callback_query is None
+        task = asyncio.create_task(self._process(update, update_chat_id(data) if ordered else None))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        status = 503 if self._draining else 200
+        return web.json_response({
+            "status": "draining" if self._draining else "ok",
+            "in_flight": self.in_flight,
+            "received": self.received,
+            "failed": self.failed,
+        }, status=status)
+
+    async def _process(self, update: Update, chat_id: int | None):
+        # Задачи стартуют в порядке создания, а asyncio.Lock честный (FIFO),
+        # поэтому апдейты одного чата выполняются в порядке прихода
+        entry = self._chats.setdefault(chat_id, [asyncio.Lock(), 0]) if chat_id is not None else None
+        if entry:
+            entry[1] += 1
+        try:
+            if entry:
+                async with entry[0]:
+                    await self.dispatcher.feed_update(self.bot, update)
+            else:
+                await self.dispatcher.feed_update(self.bot, update)
+        except Exception:
+            self.failed += 1
+            logging.exception(f"[webhook] Ошибка при обработке апдейта {update.update_id}")
+        finally:
+            if entry:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._chats[chat_id]
+            self._slots.release()
+
+    # --- жизненный цикл ---
+    async def start(self, host: str, port: int):
+        await self._start(lambda runner: web.TCPSite(runner, host, port))
+        logging.info(f"[webhook] Слушаю {host}:{port}{self.path}")
+
+    async def start_unix(self, socket_path: str):
+        """Слушает unix-сокет (воркер за фронтом cluster.py)."""
+        await self._start(lambda runner: web.UnixSite(runner, socket_path))
+        logging.info(f"[webhook] Слушаю {socket_path}")
+
+    async def _start(self, make_site):
+        await self.dispatcher.emit_startup(bot=self.bot, dispatcher=self.dispatcher, **self.dispatcher.workflow_data)
+        self._runner = web.AppRunner(self.app, handle_signals=False, access_log=None)
+        await self._runner.setup()
+        await make_site(self._runner).start()
+
+    async def stop(self):
+        """Перестаёт принимать апдейты и дожидается начатых."""
+        self._draining = True
+        if self._tasks:
+            logging.info(f"[webhook] Дожидаюсь {len(self._tasks)} апдейтов…")
+            _done, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+            if pending:
+                logging.warning(f"[webhook] Не дождались {len(pending)} апдейтов, отменяю")
+                for task in pending:
+                    task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.dispatcher.emit_shutdown(bot=self.bot, dispatcher=self.dispatcher, **self.dispatcher.workflow_data)